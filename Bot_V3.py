@@ -4,25 +4,63 @@ import time
 import asyncio
 import concurrent.futures
 import logging
-import pandas as pd
 import traceback
 
-from datetime import date, datetime, timezone
-from typing import Union, Optional, NoReturn
-from exceptions import CBotError
+from typing import Union, NoReturn
+from exceptions import CBotError, CBotFeedError
+from chain import valid_options
+from metrics import REGISTRY, serve
+from loop_monitor import LoopMonitor
+from profiler import Profiler
+from scheduler import Scheduler
+from runtime import Runtime
+from scenario import expiry_tau, YEAR
 
 FILE = 60
 
+EVALUATIONS = REGISTRY.counter('bot_strategy_evaluations_total', 'Strategy runs', ('strategy',))
+STALE = REGISTRY.gauge('bot_stale_instruments', 'Instruments without a quote within max_quote_age')
+EXCLUDED = REGISTRY.gauge('bot_excluded_quotes', 'Quotes dropped by the chain validation')
+RESTARTS = REGISTRY.counter('bot_restarts_total', 'Bot restarts after an error')
+COMPONENT_RESTARTS = REGISTRY.counter('bot_component_restarts_total', 'Warm restarts of a single component', ('component',))
+
+SETTLE_HOUR = 8
+
 class CBot:
     """The class describes the object of a simple bot that works with the Deribit exchange.
     Launch via the run method or asynchronously via start.
     The business logic of the bot itself is described in the worker method."""
 
     def __init__(self, exchange, money_mngmt, run_strategy, interval: int = 2, 
-        logger: Union[logging.Logger, str, None] = None):
+        validate_quotes: bool = True, max_quote_age: float = 30.0, executor: str = '', workers: int = 1,
+        metrics_port: int = 0, slow_callback: float = 0.1, profile_dir: str = '.',
+        warm_restart: bool = True, max_restarts: int = 5, hot_roll: bool = True, roll_warmup: float = 30.0,
+        scheduler_tick: float = 0.1, runtime: Runtime = None, logger: Union[logging.Logger, str, None] = None):
 
         self.interval = interval
+        self.validate_quotes = validate_quotes
+        self.max_quote_age = max_quote_age
+        self.excluded = 0                   # quotes excluded by the last validation, logged on change
+        self.executor = executor
+        self.metrics_port = metrics_port
+        self.warm_restart = warm_restart
+        self.max_restarts = max_restarts    # per component and minute before the whole session restarts
+        self.warm = False
+        self.hot_roll = hot_roll
+        self.roll_warmup = roll_warmup      # seconds the next expiry is subscribed before it can be activated
+        self.listeners = {}                 # odate: orderbook listener tasks
+        self.retiring = []                  # retire tasks of expiries left over by a restart
+        self.pool = None
+
+        # run strategies off the event loop against a copy of the chain
+        if executor == 'thread':
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='strategy')
+        elif executor == 'process':
+            self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        elif executor:
+            raise CBotError(f'Unknown executor: {executor}!')
         self.exchange = exchange
+        self.exchange.export_metrics()
         self.money_mngmt = money_mngmt
 
         self.test_strategy = run_strategy['test']
@@ -32,6 +70,12 @@ class CBot:
         if self.logger is None:
             self.logger = logging.getLogger(__name__)
 
+        self.loop_monitor = LoopMonitor(threshold=slow_callback, interval=interval, logger=self.logger)
+        self.profiler = Profiler(profile_dir, logger=self.logger)
+        self.clock = exchange.clock
+        self.runtime = runtime if runtime is not None else Runtime(logger=self.logger)
+        self.scheduler = Scheduler(scheduler_tick, self.clock, logger=self.logger)
+
         self.init_vals()
         
         self.logger.info('Bot initialized!')
@@ -42,7 +86,8 @@ class CBot:
     #     self.calculate_imargin()
     #     self.calculate_mmargin()
 
-    def init_vals(self):
+    def init_vals(self, full: bool = True):
+        """full resets the exchange state too, otherwise only its session flags"""
         self.stop = False
         self.count_to_reset = 0
         # self.tasks = []
@@ -53,10 +98,78 @@ class CBot:
         # logging.config.dictConfig(self.logconf)
         # self.logger = logging.getLogger(__name__)
 
-        self.exchange.init_vals()
+        if full:
+            self.exchange.init_vals()
+        else:
+            self.exchange.init_session()
+
+
+    def chain_view(self):
+        """Put and call options of the latest chain snapshot for the strategies, without
+        crossed, stale or arbitrageable quotes when validate_quotes is set"""
+        snap = self.exchange.chain.snapshot()
+        put_options, call_options = snap.put_options, snap.call_options
+
+        now_ms = self.clock.time() * 1000
+        max_age = self.max_quote_age * 1000
+        STALE.set(sum(1 for options in (put_options, call_options) for q in options.values()
+                        if not now_ms - q.get('timestamp', 0) <= max_age))
+
+        if self.validate_quotes:
+            put_options = valid_options(put_options, False, now_ms, self.max_quote_age)
+            call_options = valid_options(call_options, True, now_ms, self.max_quote_age)
+
+            excluded = len(snap.put_options) + len(snap.call_options) - len(put_options) - len(call_options)
+            EXCLUDED.set(excluded)
+            if excluded != self.excluded:
+                self.logger.info(f'{excluded} quotes excluded by chain validation')
+                self.excluded = excluded
+
+        return put_options, call_options
+
+    async def run_strategy(self, strategy, *args):
+        """Runs strategy inline, or in the worker pool and awaits the result on the loop.
+        The chain snapshot passed in is never mutated by the listeners, so workers
+        can read it without copying"""
+        EVALUATIONS.labels(strategy.__name__).inc()
+        if self.pool is None:
+            return strategy(*args)
 
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, strategy, *args)
 
-    async def check_riskfree_trade(self, delay=0):
+    @property
+    def loop_lag(self) -> dict:
+        return self.loop_monitor.lag
+
+    async def supervise(self, name: str, factory, backoff: float = 0.05):
+        """Runs the component factory(restart) returns until it ends. When it fails only
+        this component is restarted, with the chain, account state and the other sessions
+        left alone. Feed errors and more than max_restarts failures a minute escalate to run"""
+        failures = []
+
+        while True:
+            try:
+                return await factory(bool(failures))
+
+            except (asyncio.CancelledError, CBotFeedError):
+                raise
+
+            except Exception as E:
+                if not self.exchange.keep_alive:
+                    raise
+
+                now = time.monotonic()
+                failures = [t for t in failures if now - t < 60] + [now]
+                COMPONENT_RESTARTS.labels(name).inc()
+                if len(failures) > self.max_restarts:
+                    self.logger.info(f'{name} failed {len(failures)} times in a minute: {E}')
+                    raise
+
+                self.logger.info(f'Error in {name}: {E}, restarting it')
+                await asyncio.sleep(backoff * 2 ** (len(failures) - 1))
+
+    async def check_riskfree_trade(self, delay=0, refresh_account: bool = True):
 
         # Set CSV Header
         # csv_label = ['strike', 'Call', 'Put']
@@ -67,12 +180,15 @@ class CBot:
         # self.logger.log(FILE, ",".join(csv_label + ['Premium Payout', 'Max Profit', 'Max Loss', 'Risk Reward', 'Kelly']))
 
         # Set CSV Header
-        await asyncio.sleep(delay)
-        await self.exchange.fetch_account_info()
+        await self.clock.sleep(delay)
+        if refresh_account:
+            await self.exchange.fetch_account_info()
 
-        put_label = ['Price', 'instrument_name', 'P_Strike', 'P_Premium', 'P_Delta', 'P_Gamma', 'P_Vega', 'P_Rho']
-        call_label = ['instrument_name', 'C_Strike', 'C_Premium', 'C_Delta', 'C_Gamma', 'C_Vega', 'C_Rho']
-        self.logger.log(FILE, ",".join(put_label + call_label))
+        # market data goes to the tick recorder, FILE only keeps the test strategy results
+        if self.test_strategy:
+            put_label = ['Price', 'instrument_name', 'P_Strike', 'P_Premium', 'P_Delta', 'P_Gamma', 'P_Vega', 'P_Rho']
+            call_label = ['instrument_name', 'C_Strike', 'C_Premium', 'C_Delta', 'C_Gamma', 'C_Vega', 'C_Rho']
+            self.logger.log(FILE, ",".join(put_label + call_label))
 
         # sum_premium = 0
         while self.exchange.keep_alive:
@@ -80,15 +196,18 @@ class CBot:
 
             if self.exchange.updated:
                 price = self.exchange.asset_price
+                put_options, call_options = self.chain_view()
 
                 # trade strategy
-                if self.trade_strategy:
-                    data = self.trade_strategy(self.exchange.put_options, self.exchange.call_options, price, self.exchange.min_prem, self.exchange.strike_dist)
+                if self.trade_strategy and put_options and call_options:
+                    self.exchange.latency.strategy_started()
+                    data = await self.run_strategy(self.trade_strategy, put_options, call_options, price, self.exchange.min_prem, self.exchange.strike_dist)
+                    self.exchange.latency.strategy_ended()
                     await self.exchange.post_orders(data)
 
                 # log strategy results for testing
-                if self.test_strategy:
-                    order_list = self.test_strategy(self.exchange.put_options, self.exchange.call_options, price)
+                if self.test_strategy and put_options and call_options:
+                    order_list = await self.run_strategy(self.test_strategy, put_options, call_options, price)
 
                     if order_list.size:
                         self.logger.info(f'Price index: {price}')
@@ -110,9 +229,9 @@ class CBot:
                 if self.count_to_reset == 100:
                     # self.exchange.keep_alive = False
                     self.logger.info('Resetting connection... ')
-                    raise CBotError('Count_to_reset reached!')
+                    raise CBotFeedError('Count_to_reset reached!')
 
-            await asyncio.sleep(self.interval)
+            await self.clock.sleep(self.interval)
 
         self.logger.info('check_riskfree_trade ended!')
 
@@ -133,19 +252,45 @@ class CBot:
 
         tasks = []
     
-        # self.exchange.call_options, self.exchange.put_options = await self.exchange.prepare_option_struct()
-        await self.exchange.prepare_option_struct()
+        # warm restarts keep the instrument registry and quotes of a live expiry
+        warm = self.warm and self.exchange.put_options and self.exchange.odate \
+                    and expiry_tau(self.exchange.odate, self.clock.now()) > 0
+        self.warm = False
+        if warm:
+            self.logger.info(f'Warm restart, keeping {len(self.exchange.put_options)} strikes of {self.exchange.odate}')
+        else:
+            # self.exchange.call_options, self.exchange.put_options = await self.exchange.prepare_option_struct()
+            await self.exchange.prepare_option_struct()
+
+        # a snapshot of this expiry brings back the book now, the account is reconciled in the background
+        # and retried until it succeeds, the trader fetches it too while restored is set
+        restored = not warm and self.exchange.state_store is not None and self.exchange.state_store.restore(self.exchange)
+        if restored:
+            tasks.append(asyncio.create_task(self.supervise('reconcile', lambda restart: self.exchange.fetch_account_info())))
         # await self.exchange.prepare_prev_option_struct()
         # await self.exchange.fetch_account_info()
 
         # tasks.append(asyncio.to_thread(self.check_riskfree_trade))
-        tasks.append(asyncio.create_task(self.end_of_day()))
-        tasks.append(asyncio.create_task(self.exchange.fetch_deribit_price_index()))
-        tasks.append(asyncio.create_task(self.exchange.fetch_dvol_index()))
+        if warm:
+            # a roll in progress is started over by roll_expiry
+            for odate in [o for o in self.exchange.chains if o != self.exchange.odate]:
+                self.exchange.chains.pop(odate)
+
+        self.schedule_jobs()
+        tasks.append(asyncio.create_task(self.scheduler.run(lambda: self.exchange.keep_alive)))
+        tasks.append(asyncio.create_task(self.roll_expiry() if self.hot_roll else self.end_of_day()))
+        tasks.append(asyncio.create_task(self.supervise('price_index', lambda restart: self.exchange.fetch_deribit_price_index())))
+        tasks.append(asyncio.create_task(self.supervise('dvol_index', lambda restart: self.exchange.fetch_dvol_index())))
+        tasks.append(asyncio.create_task(self.loop_monitor.run(lambda: self.exchange.keep_alive)))
         # tasks.append(asyncio.create_task(self.exchange.order_mgmt_func(self.interval)))
         delay = len(self.exchange.call_options) + len(self.exchange.put_options)
         delay *= 0.5 + 1
-        tasks.append(asyncio.create_task(self.check_riskfree_trade(delay)))
+        if warm:
+            delay = self.interval
+        # the account is fetched unless it is already known, a failed first fetch is retried on restart
+        tasks.append(asyncio.create_task(self.supervise('trader',
+            lambda restart, delay=delay: self.check_riskfree_trade(0 if restart else delay,
+                refresh_account=not self.exchange.pos_updated or self.exchange.restored or not (restart or warm or restored)))))
 
         # if not self.exchange.call_options or not self.exchange.put_options:
         #     return
@@ -153,14 +298,7 @@ class CBot:
         # def update_options_dict(options_dict, strike: str, new_data) -> NoReturn:
         #     options_dict[strike].update(new_data)
 
-        delay = 0.5
-        for key in self.exchange.call_options:
-            tasks.append(
-                asyncio.create_task(
-                    self.exchange.fetch_orderbook_data(key, delay=delay)
-                )
-            )
-            delay += 0.5
+        tasks.append(asyncio.create_task(self.listen_expiry(self.exchange.odate, 0.5, 0.05 if warm else 0.5)))
 
         # for key, val in self.exchange.prev_call_options.items():
         #     _, odate, _, _  = val['instrument_name'].split('-')
@@ -179,8 +317,18 @@ class CBot:
         #     )
         #     delay += 0.5
 
+        server = None
+        if self.metrics_port:
+            server = asyncio.create_task(serve(port=self.metrics_port, routes={'/profile': self.profiler.route},
+                                                logger=self.logger))
+
         self.logger.info(f'Number of tasks: {len(tasks)}')
-        await asyncio.gather(*tasks)
+        self.runtime.started()
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            if server is not None:
+                server.cancel()
         # self.tasks = tasks
 
         # for task in tasks:
@@ -210,18 +358,136 @@ class CBot:
         # # await loop.run_in_executor(None, self.check_riskfree_trade)
         # # executor.submit(self.check_riskfree_trade)
 
+    def schedule_jobs(self):
+        """Periodic jobs of the session, a restart replaces them by name"""
+        exchange = self.exchange
+        self.scheduler.cron('0 * * * *', exchange.regime.update, 'hour_regime')
+        self.scheduler.cron('* * * * *', self.flush_logs, 'log_flush')
+        self.scheduler.every(exchange.latency.report_interval, exchange.latency.maybe_report, 'latency_report')
+        if exchange.state_store is not None:
+            self.scheduler.every(exchange.state_store.interval,
+                                    lambda: exchange.state_store.maybe_save(exchange), 'state_snapshot')
+
+    def flush_logs(self):
+        for handler in logging.getLogger().handlers + self.logger.handlers:
+            handler.flush()
+
+    async def listen_expiry(self, odate: str, delay: float = 0.5, step: float = 0.5):
+        """Orderbook listeners of every strike of odate, started step seconds apart.
+        Ends when the expiry is retired"""
+        chain = self.exchange.chains.get(odate, self.exchange.chain)
+        tasks = []
+        for key in chain.call_options:
+            tasks.append(
+                asyncio.create_task(
+                    self.supervise(f'orderbook_{key}',
+                        lambda restart, key=key, delay=delay: self.exchange.fetch_orderbook_data(key, delay=0 if restart else delay, odate=odate))
+                )
+            )
+            delay += step
+        self.listeners[odate] = tasks
+
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            if odate in self.exchange.chains:
+                raise
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def listeners_done(self, task: asyncio.Task):
+        """Surfaces the failure of listeners started outside of start"""
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.info(f'Error in expiry listeners: {task.exception()}')
+            self.warm = self.warm_restart
+            self.exchange.keep_alive = False
+
+    async def wait(self, seconds: float) -> bool:
+        """Sleeps seconds unless the bot stops first, returns keep_alive"""
+        end = self.clock.monotonic() + seconds
+        while self.exchange.keep_alive and self.clock.monotonic() < end:
+            await self.clock.sleep(min(end - self.clock.monotonic(), 1.0))
+        return self.exchange.keep_alive
+
+    async def roll_expiry(self):
+        """Hot expiry roll, replaces end_of_day. At expire_time the next expiry is loaded and
+        subscribed next to the active one, after roll_warmup it becomes the active expiry
+        (right before settlement when positions are open, these are closed first as
+        end_of_day did). The settled expiry is retired after 08:00 UTC. The index, DVOL
+        and trading loops and their sessions stay up throughout"""
+
+        while self.exchange.pos_updated == False and self.exchange.keep_alive:
+            await self.clock.sleep( 1 )
+
+        # expiries left over by a restart during a roll, e.g. the settling one after a warm restart
+        self.retiring = [asyncio.create_task(self.retire_after_settlement(odate))
+                            for odate in self.exchange.expiries() - {self.exchange.odate}]
+
+        while self.exchange.keep_alive:
+            old = self.exchange.odate
+
+            # roll now when the active expiry settles before the next roll time, e.g. after a restart
+            wait = self.scheduler.next_delay(f'0 {self.exchange.expire_time} * * *')
+            if old and expiry_tau(old, self.clock.now()) * YEAR < wait:
+                wait = 0
+            if not await self.wait(wait):
+                break
+
+            new, put_options, call_options = await self.exchange.load_expiry()
+            if new == old or not put_options:
+                self.logger.info(f'No expiry to roll to from {old}')
+                await self.wait(60)
+                continue
+
+            self.exchange.add_expiry(new, put_options, call_options)
+            task = asyncio.create_task(self.listen_expiry(new, 0, 0.05))
+            task.add_done_callback(self.listeners_done)
+            self.logger.info(f'Rolling from {old} to {new}: {len(put_options)} strikes subscribed')
+
+            if not await self.wait(self.roll_warmup):
+                break
+
+            # orders and positions opened since the last fetch are only known to the exchange
+            try:
+                await self.exchange.fetch_account_info()
+            except Exception as E:
+                self.logger.info(f'Error refreshing the account before the roll: {E}')
+
+            if self.exchange.has_orders(old):
+                if not await self.wait(max(expiry_tau(old, self.clock.now()) * YEAR - 10, 0)):
+                    break
+                await self.exchange.close_all_positions()
+
+            self.exchange.activate(new)
+
+            if not await self.retire_after_settlement(old):
+                break
+
+    async def retire_after_settlement(self, odate: str) -> bool:
+        """Retires odate and stops its listeners a minute after its settlement, right away
+        when it is settled already. Returns keep_alive"""
+        tau = expiry_tau(odate, self.clock.now())
+        if tau and not await self.wait(tau * YEAR + 60):
+            return False
+
+        self.exchange.retire(odate)
+        for task in self.listeners.pop(odate, []):
+            task.cancel()
+        return self.exchange.keep_alive
+
     async def end_of_day(self):
 
-        while self.exchange.pos_updated == False:
-            await asyncio.sleep( 1 )
+        while self.exchange.pos_updated == False and self.exchange.keep_alive:
+            await self.clock.sleep( 1 )
 
-        if datetime.now(timezone.utc).hour < self.exchange.expire_time:
-            await asyncio.sleep( 21600 - int(datetime.now(timezone.utc).timestamp()) % 21600)   # 6hrs, 6am
-        else:
-            await asyncio.sleep( 86400 - int(datetime.now(timezone.utc).timestamp()) % 86400 + 21600)   # 24hrs + 6hrs, 6am
+        # wait ends with keep_alive, a stopped scheduler would leave start() waiting here
+        if not await self.wait(self.scheduler.next_delay(f'0 {self.exchange.expire_time} * * *')):
+            return
 
         if len(self.exchange.orders) > 0:
-            await asyncio.sleep( 28800 - int(datetime.now(timezone.utc).timestamp()) % 28800 - 10 )   # 8am
+            if not await self.wait(max(self.scheduler.next_delay(f'0 {SETTLE_HOUR} * * *') - 10, 0)):   # 8am settlement
+                return
             
         # await asyncio.sleep( 120 - time.time() % 120 )
         self.exchange.keep_alive = False
@@ -229,13 +495,15 @@ class CBot:
         await self.exchange.close_all_positions()
 
         self.logger.info('End of day!')
-        await asyncio.sleep( 90 )  # sleep/wait for 2 minutes before starting
+        await self.clock.sleep( 90 )  # sleep/wait for 2 minutes before starting
         
     def run(self) -> NoReturn:
         """Wrapper for start to run without additional libraries for managing asynchronous"""
 
         self.logger.info('Run started')
-        loop = asyncio.get_event_loop()
+        loop = self.runtime.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.profiler.install(loop)
 
         if self.exchange.env == 'test':
             self.start = self.test_start
@@ -254,6 +522,8 @@ class CBot:
                 self.logger.info(f'Error in run: {E}')
                 self.logger.info(traceback.print_exc())
                 self.logger.info('Restarting bot...')
+                RESTARTS.inc()
+                self.warm = self.warm_restart
 
             finally:
                 time.sleep(0.5)
@@ -262,10 +532,13 @@ class CBot:
                 
                 for task in asyncio.all_tasks(loop):
                     task.cancel()
+                self.loop_monitor.stop()
 
                 time.sleep(0.5)
 
                 if self.stop or self.exchange.env == 'test':
+                    if self.pool is not None:
+                        self.pool.shutdown(wait=False)
                     break
                     
-                self.init_vals()
\ No newline at end of file
+                self.init_vals(full=not self.warm)
\ No newline at end of file
@@ -1,16 +1,16 @@
-# Loading an Environment Variable File with dotenv
-from dotenv import load_dotenv
-load_dotenv()
 import os
 
 from Bot_V3 import CBot, FILE
 from exchange import Deribit_Exchange
+from runtime import Runtime
 # from arbitrage_strategy import check_riskfree_trade, check_riskfree_trade_v2
-from risk_free_strategy import collar_strategy, selling_premiums, sell_008_premium_2k_dist, test
+from risk_free_strategy import sell_008_premium_2k_dist
 
 import yaml
 import logging.config
-from datetime import date
+
+# optional components (dotenv, recorder, capture, state store, simulated clock) are
+# imported when configured, python import_budget.py checks the startup imports
 
 def main():
 
@@ -19,6 +19,9 @@ def main():
         config = yaml.load(f.read(), Loader = yaml.FullLoader)
 
     if config['exchange']['env'] == 'prod':
+        # Loading an Environment Variable File with dotenv
+        from dotenv import load_dotenv
+        load_dotenv()
         config['exchange']['auth']['prod']['client_id'] = os.getenv('client_id')
         config['exchange']['auth']['prod']['client_secret'] = os.getenv('client_secret')
     
@@ -34,10 +37,43 @@ def main():
     #     'trading': test
     # }
     
-    deribit_exch = Deribit_Exchange(**config['exchange'])
-    bot = CBot(**config['bot'], exchange=deribit_exch, run_strategy=option_strats, money_mngmt=None)
+    recorder = None
+    rec_conf = config.get('recorder', {})
+    if rec_conf.pop('enabled', False):
+        from recorder import TickRecorder
+        recorder = TickRecorder(**rec_conf)
+
+    capture = None
+    cap_conf = config.get('capture', {})
+    if cap_conf.pop('enabled', False):
+        from capture import FrameCapture
+        capture = FrameCapture(**cap_conf)
+
+    state_store = None
+    state_conf = config.get('state', {})
+    if state_conf.pop('enabled', False):
+        from state_store import StateStore
+        state_store = StateStore(**state_conf)
+
+    clock = None
+    clock_conf = config.get('clock', {})
+    if clock_conf.pop('simulated', False):
+        from clock import SimClock
+        clock = SimClock(**clock_conf)
+
+    runtime = Runtime(**config.get('runtime', {}))
+    runtime.apply()
+
+    deribit_exch = Deribit_Exchange(**config['exchange'], recorder=recorder, capture=capture, state_store=state_store,
+                                        clock=clock)
+    bot = CBot(**config['bot'], exchange=deribit_exch, run_strategy=option_strats, money_mngmt=None, runtime=runtime)
     bot.run()
 
+    if recorder:
+        recorder.close()
+    if capture:
+        capture.close()
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 
 put_label = ['bid_p', 'ask_p']
 call_label = ['bid_c', 'ask_c']
@@ -85,3 +86,157 @@ def check_riskfree_trade_v2(put_options, call_options, price):
     
     return df_arbi
 
+
+# Deribit fees per contract in BTC (fraction of the underlying), option fees capped at 12.5% of the premium
+OPTION_FEE = {'taker': 0.0003, 'maker': 0.0003}
+FUTURE_FEE = {'taker': 0.0005, 'maker': 0.0}
+DELIVERY_FEE = 0.00015
+FEE_CAP = 0.125
+
+class ParityScanner:
+    """Vectorized put-call parity (conversion / reversal) and box-spread scanner over all
+    loaded expiries. Quote and work arrays are allocated once per expiry and strike set,
+    then refilled in place on every scan. Profits are in $ per contract, after fees"""
+
+    def __init__(self, maker: bool = False, option_fee: dict = OPTION_FEE, future_fee: dict = FUTURE_FEE,
+                    delivery_fee: float = DELIVERY_FEE, fee_cap: float = FEE_CAP, min_profit: float = 0.0):
+
+        side = 'maker' if maker else 'taker'
+        self.option_fee = option_fee[side]
+        self.future_fee = future_fee[side]
+        self.delivery_fee = delivery_fee
+        self.fee_cap = fee_cap
+        self.min_profit = min_profit
+        self.buffers = {}
+
+    def _buffer(self, odate, put_options, call_options):
+        strikes = sorted(set(put_options) & set(call_options))
+        buf = self.buffers.get(odate)
+
+        if buf is None or buf['strikes'] != strikes:
+            n = len(strikes)
+            buf = {'strikes': strikes, 'k': np.array(strikes, dtype=float)}
+            for name in ('pb', 'pa', 'cb', 'ca', 'pb_amt', 'pa_amt', 'cb_amt', 'ca_amt', 'fee', 'tmp'):
+                buf[name] = np.empty(n)
+            for name in ('box', 'box_fee', 'box_tmp'):
+                buf[name] = np.empty((n, n))
+            buf['width'] = buf['k'][None, :] - buf['k'][:, None]
+            self.buffers[odate] = buf
+
+        fields = (('pb', 'bid'), ('pa', 'ask'), ('pb_amt', 'bid_amt'), ('pa_amt', 'ask_amt'))
+        for i, k in enumerate(strikes):
+            put = put_options[k]
+            call = call_options[k]
+            for dst, src in fields:
+                buf[dst][i] = put.get(src, np.nan)
+            for dst, src in fields:
+                buf['c' + dst[1:]][i] = call.get(src, np.nan)
+
+        return buf
+
+    def _leg_fee(self, premium, out):
+        """Option fee per contract in BTC: min(fee rate, cap * premium)"""
+        np.multiply(premium, self.fee_cap, out=out)
+        return np.minimum(out, self.option_fee, out=out)
+
+    def _parity(self, odate, buf, price, put_options, call_options):
+        """Conversion: long underlying, buy put, sell call -> K - F + C - P.
+        Reversal: short underlying, sell put, buy call -> F - K + P - C"""
+        k, fee, tmp = buf['k'], buf['fee'], buf['tmp']
+        fixed = 2 * self.future_fee + self.delivery_fee
+        found = []
+
+        for name, buy, sell, sign, buy_amt, sell_amt in (
+                ('conversion', 'pa', 'cb', 1, 'pa_amt', 'cb_amt'),
+                ('reversal', 'ca', 'pb', -1, 'ca_amt', 'pb_amt')):
+
+            # fee in BTC for both option legs, the underlying in and out and delivery
+            np.add(self._leg_fee(buf[buy], tmp), fixed, out=fee)
+            fee += self._leg_fee(buf[sell], tmp)
+
+            # (sell - buy - fee) * price + sign * (K - F)
+            np.subtract(buf[sell], buf[buy], out=tmp)
+            tmp -= fee
+            tmp *= price
+            tmp += sign * (k - price)
+
+            for i in np.flatnonzero(tmp > self.min_profit):
+                strike = buf['strikes'][i]
+                buy_opt = put_options[strike] if buy[0] == 'p' else call_options[strike]
+                sell_opt = call_options[strike] if sell[0] == 'c' else put_options[strike]
+                found.append({
+                    'expiry': odate,
+                    'strategy': name,
+                    'strikes': (strike,),
+                    'profit': float(tmp[i]),
+                    'size': float(min(buf[buy_amt][i], buf[sell_amt][i])),
+                    'legs': [(buy_opt['instrument_name'], 'buy', float(buf[buy][i])),
+                             (sell_opt['instrument_name'], 'sell', float(buf[sell][i])),
+                             ('underlying', 'sell' if sign > 0 else 'buy', price)]
+                })
+
+        return found
+
+    def _box(self, odate, buf, price, put_options, call_options):
+        """Long box K1 < K2: buy C1, sell C2, buy P2, sell P1 -> pays K2 - K1.
+        Short box is the mirror and pays the premium up front"""
+        box, fee, tmp, width = buf['box'], buf['box_fee'], buf['box_tmp'], buf['width']
+        strikes = buf['strikes']
+        found = []
+
+        for name, c1, c2, p2, p1, sign in (
+                ('long_box', 'ca', 'cb', 'pa', 'pb', 1),
+                ('short_box', 'cb', 'ca', 'pb', 'pa', -1)):
+
+            # net premium paid (long) or received (short) in BTC
+            np.subtract(buf[c1][:, None], buf[c2][None, :], out=box)
+            box += buf[p2][None, :]
+            box -= buf[p1][:, None]
+
+            fee.fill(2 * self.delivery_fee)
+            for leg, axis in ((c1, 0), (c2, 1), (p2, 1), (p1, 0)):
+                leg_fee = self._leg_fee(buf[leg], buf['tmp'])
+                fee += leg_fee[:, None] if axis == 0 else leg_fee[None, :]
+
+            # long: width - paid - fee, short: received - width - fee
+            np.multiply(box, -sign * price, out=tmp)
+            tmp += sign * width
+            tmp -= fee * price
+
+            rows, cols = np.nonzero((width > 0) & (tmp > self.min_profit))
+            for i, j in zip(rows, cols):
+                k1, k2 = strikes[i], strikes[j]
+                legs = [(call_options[k1], 'buy' if sign > 0 else 'sell', c1, i),
+                        (call_options[k2], 'sell' if sign > 0 else 'buy', c2, j),
+                        (put_options[k2], 'buy' if sign > 0 else 'sell', p2, j),
+                        (put_options[k1], 'sell' if sign > 0 else 'buy', p1, i)]
+                found.append({
+                    'expiry': odate,
+                    'strategy': name,
+                    'strikes': (k1, k2),
+                    'profit': float(tmp[i, j]),
+                    'size': float(min(buf[leg + '_amt'][idx] for _, _, leg, idx in legs)),
+                    'legs': [(opt['instrument_name'], direction, float(buf[leg][idx]))
+                                for opt, direction, leg, idx in legs]
+                })
+
+        return found
+
+    def scan(self, expiries: dict, price: float):
+        """expiries is {odate: (put_options, call_options)}. Returns the opportunities
+        that survive fees, best first. Buffers of expiries no longer passed in are dropped"""
+        found = []
+
+        for odate in [o for o in self.buffers if o not in expiries]:
+            del self.buffers[odate]
+
+        for odate, (put_options, call_options) in expiries.items():
+            buf = self._buffer(odate, put_options, call_options)
+            if not buf['strikes']:
+                continue
+
+            found += self._parity(odate, buf, price, put_options, call_options)
+            found += self._box(odate, buf, price, put_options, call_options)
+
+        found.sort(key=lambda f: f['profit'], reverse=True)
+        return found
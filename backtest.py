@@ -0,0 +1,248 @@
+import logging
+import time
+import numpy as np
+import pandas as pd
+
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from exchange import Deribit_Exchange
+from recorder import read_stream
+from scenario import expiry_tau
+
+QUOTE_COLS = ('bid', 'ask', 'bid_amt', 'ask_amt', 'delta', 'gamma', 'vega', 'rho', 'mark_iv')
+
+class FillModel:
+    """Fills a sell order at the quoted premium minus slippage with probability fill_prob.
+    Fees follow Deribit: min(fee rate, fee_cap * premium) per contract, plus the delivery
+    fee on options settled in the money"""
+
+    def __init__(self, slippage: float = 0.0, fill_prob: float = 1.0, fee: float = 0.0003,
+                    delivery_fee: float = 0.00015, fee_cap: float = 0.125, seed: int = 0):
+        self.slippage = slippage
+        self.fill_prob = fill_prob
+        self.fee = fee
+        self.delivery_fee = delivery_fee
+        self.fee_cap = fee_cap
+        self.rng = np.random.default_rng(seed)
+
+    def fill(self, price: float) -> Optional[float]:
+        """Returns the fill premium or None"""
+        if np.isnan(price) or self.rng.random() >= self.fill_prob:
+            return None
+        return max(price - self.slippage, 0.0)
+
+    def trade_fee(self, premium: float) -> float:
+        return min(self.fee, self.fee_cap * premium)
+
+    def settle_fee(self, value: float) -> float:
+        return min(self.delivery_fee, self.fee_cap * value) if value > 0 else 0.0
+
+def trade_orders(result, put_options, call_options):
+    """Default adapter, the trading strategies already return post_orders lists"""
+    return result
+
+class Backtester:
+    """Replays recorded chain, index and DVOL ticks (see recorder.TickRecorder) through a
+    strategy every interval seconds, the same way CBot.check_riskfree_trade does. Orders
+    pass the post_orders gating (Deribit_Exchange.order_gate: dvol thresholds, traded_prems,
+    strike_dist, expire_time) before the fill model. Open positions are settled against the
+    index at the 08:00 UTC expiry. PnL is in BTC"""
+
+    def __init__(self, path: str, strategy: Callable, exchange_conf: dict = {}, interval: float = 5.0,
+                    fill_model: FillModel = None, to_orders: Callable = trade_orders, currency: str = 'BTC',
+                    data: dict = None, logger: logging.Logger = None):
+
+        self.path = path
+        self.strategy = strategy
+        self.interval = interval
+        self.fill_model = FillModel() if fill_model is None else fill_model
+        self.to_orders = to_orders
+        self.currency = exchange_conf.get('currency', currency)
+        self.data = {} if data is None else data    # preloaded streams, see load()
+
+        if logger is None:
+            logger = logging.getLogger('backtest')
+            logger.setLevel(logging.WARNING)
+        self.logger = logger
+
+        conf = {k: v for k, v in exchange_conf.items() if k not in ('url', 'auth', 'env', 'trading', 'currency')}
+        self.exchange = Deribit_Exchange(url={'backtest': ''}, auth={'backtest': {}}, env='backtest',
+                                            currency=self.currency, trading=True, logger=logger, **conf)
+
+    def load(self, odate: str) -> dict:
+        """Reads the recorded streams for odate, memory-mapped where possible"""
+        if odate not in self.data:
+            self.data[odate] = {
+                'chain': read_stream(self.path, 'chain', odate),
+                'index': read_stream(self.path, 'index', self.currency),
+                'dvol': read_stream(self.path, 'dvol', self.currency)
+            }
+        return self.data[odate]
+
+    def run(self, odate: str, start_ms: int = None) -> dict:
+        """Backtests one expiry. Returns the pnl, the trades and the mark-to-market curve"""
+        t_start = time.perf_counter()
+        data = self.load(odate)
+        chain, index, dvol = data['chain'], data['index'], data['dvol']
+
+        exch = self.exchange
+        exch.init_vals()
+        exch.odate = exch.chain.odate = odate
+
+        expiry_ms = int(datetime.strptime(odate, '%d%b%y').replace(hour=8, tzinfo=timezone.utc).timestamp() * 1000)
+        if len(chain['ts']) == 0 or len(index['ts']) == 0:
+            return {'odate': odate, 'pnl': 0.0, 'trades': pd.DataFrame(), 'curve': pd.DataFrame(), 'seconds': 0.0}
+
+        # one row per instrument, ticks sorted by time within each instrument
+        ts = np.asarray(chain['ts'])
+        key = np.asarray(chain['strike']) * 2 + np.asarray(chain['is_call'])
+        instr, inv = np.unique(key, return_inverse=True)
+        order = np.lexsort((ts, inv))
+        bounds = np.searchsorted(inv[order], np.arange(len(instr) + 1))
+
+        first = max(int(ts.min()), int(index['ts'][0])) if start_ms is None else start_ms
+        last = min(int(ts.max()), expiry_ms)
+        evals = np.arange(first, last + 1, int(self.interval * 1000), dtype=np.int64)
+
+        # latest tick of every instrument at every evaluation time, -1 before its first tick
+        rows = np.full((len(instr), len(evals)), -1, dtype=np.int64)
+        for i in range(len(instr)):
+            sel = order[bounds[i]:bounds[i + 1]]
+            pos = np.searchsorted(ts[sel], evals, 'right') - 1
+            rows[i] = np.where(pos >= 0, sel[np.maximum(pos, 0)], -1)
+
+        price_at = np.asarray(index['price'])[np.maximum(np.searchsorted(index['ts'], evals, 'right') - 1, 0)]
+        if len(dvol['ts']):
+            dvol_at = np.asarray(dvol['volatility'])[np.maximum(np.searchsorted(dvol['ts'], evals, 'right') - 1, 0)]
+        else:
+            dvol_at = np.zeros(len(evals))
+        hours = (evals // 3600000) % 24
+
+        cols = {c: np.asarray(chain[c]) for c in QUOTE_COLS}
+        strikes = instr // 2
+        is_call = (instr % 2).astype(bool)
+        names = [f'{self.currency}-{odate}-{int(k)}-{"C" if c else "P"}' for k, c in zip(strikes, is_call)]
+
+        put_options, call_options = {}, {}
+        last_rows = np.full(len(instr), -1, dtype=np.int64)
+        trades, curve, positions = [], [], []
+        pnl = 0.0
+
+        for e, now in enumerate(evals):
+            # copy-on-write: rebuild only the quotes that ticked since the last evaluation
+            changed = np.flatnonzero(rows[:, e] != last_rows)
+            if len(changed):
+                put_options, call_options = dict(put_options), dict(call_options)
+                for i in changed:
+                    r = rows[i, e]
+                    quote = {'strike': float(strikes[i]), 'instrument_name': names[i],
+                                'option_type': 'call' if is_call[i] else 'put', 'timestamp': int(ts[r])}
+                    quote.update({c: float(cols[c][r]) for c in QUOTE_COLS})
+                    (call_options if is_call[i] else put_options)[float(strikes[i])] = quote
+                last_rows = rows[:, e].copy()
+
+            if not put_options or not call_options:
+                continue
+
+            price = float(price_at[e])
+            exch.asset_price = price
+            exch.dvol = float(dvol_at[e])
+
+            result = self.strategy(put_options, call_options, price, exch.min_prem, exch.strike_dist)
+            order_list = self.to_orders(result, put_options, call_options)
+
+            if order_list:
+                gate = exch.order_gate(order_list, int(hours[e]))
+                if gate is not None:
+                    bid_ask, premium, strk_dist, max_prem_cnt = gate
+                    ord_size = exch.order_size * max_prem_cnt
+
+                    for o in order_list:
+                        fill = self.fill_model.fill(o[bid_ask])
+                        if fill is None:
+                            continue
+
+                        fee = self.fill_model.trade_fee(fill) * ord_size
+                        positions.append((o['instrument']['instrument_name'], float(o['strike']),
+                                            o['option_type'] == 'call', ord_size, fill))
+                        trades.append({'ts': int(now), 'instrument_name': o['instrument']['instrument_name'],
+                                        'direction': 'sell', 'amount': ord_size, 'price': fill, 'fee': fee,
+                                        'label': f'{premium},{strk_dist}', 'index': price})
+                        pnl += fill * ord_size - fee
+
+                    exch.add_traded_prem(str(premium), max_prem_cnt)
+
+            # mark to market: buy back the shorts at the ask
+            if positions:
+                mtm = pnl
+                for name, strike, call, size, _ in positions:
+                    quote = (call_options if call else put_options).get(strike)
+                    ask = quote['ask'] if quote else np.nan
+                    mtm -= size * (ask if not np.isnan(ask) else 0.0)
+                curve.append((int(now), price, mtm))
+
+        # expiry settlement of the remaining shorts
+        settle_ms = min(expiry_ms, int(index['ts'][-1]))
+        settle_price = float(np.asarray(index['price'])[max(np.searchsorted(index['ts'], settle_ms, 'right') - 1, 0)])
+        settled = expiry_tau(odate, datetime.fromtimestamp(settle_ms / 1000, timezone.utc)) == 0
+
+        for name, strike, call, size, _ in positions:
+            value = (max(settle_price - strike, 0.0) if call else max(strike - settle_price, 0.0)) / settle_price
+            fee = self.fill_model.settle_fee(value) * size
+
+            # data ends before expiry, buy back at the last ask instead
+            quote = (call_options if call else put_options).get(strike)
+            if not settled and quote and not np.isnan(quote['ask']):
+                value = quote['ask']
+                fee = self.fill_model.trade_fee(value) * size
+
+            pnl -= value * size + fee
+            trades.append({'ts': settle_ms, 'instrument_name': name, 'direction': 'settle' if settled else 'close',
+                            'amount': size, 'price': value, 'fee': fee, 'label': '', 'index': settle_price})
+
+        return {
+            'odate': odate,
+            'pnl': pnl,
+            'trades': pd.DataFrame(trades),
+            'curve': pd.DataFrame(curve, columns=['ts', 'index', 'mtm']),
+            'seconds': time.perf_counter() - t_start
+        }
+
+    def run_days(self, odates: list) -> dict:
+        """Backtests consecutive expiries, the bot state is reset every day as CBot.run does"""
+        days = [self.run(odate) for odate in odates]
+        return {
+            'pnl': sum(d['pnl'] for d in days),
+            'days': pd.DataFrame([{'odate': d['odate'], 'pnl': d['pnl'], 'trades': len(d['trades'])} for d in days]),
+            'trades': pd.concat([d['trades'] for d in days], ignore_index=True) if days else pd.DataFrame()
+        }
+
+def main():
+    import argparse
+    import yaml
+    import risk_free_strategy
+
+    parser = argparse.ArgumentParser(description='Backtest a risk_free_strategy function on recorded ticks')
+    parser.add_argument('odates', nargs='+', help='expiries to replay, e.g. 20OCT22')
+    parser.add_argument('--path', default='ticks')
+    parser.add_argument('--strategy', default='sell_008_premium_2k_dist')
+    parser.add_argument('--config', default='./config_v3.yaml')
+    parser.add_argument('--interval', type=float, default=5.0)
+    parser.add_argument('--slippage', type=float, default=0.0)
+    parser.add_argument('--fill-prob', type=float, default=1.0)
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = yaml.load(f.read(), Loader = yaml.FullLoader)
+
+    bt = Backtester(args.path, getattr(risk_free_strategy, args.strategy), config['exchange'], args.interval,
+                    FillModel(args.slippage, args.fill_prob))
+    res = bt.run_days(args.odates)
+
+    print(res['days'].to_string(index=False))
+    print(res['trades'].to_string(index=False))
+    print(f"Total PnL: {res['pnl']:.6f} BTC")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import numpy as np
+
+from datetime import datetime, timedelta, timezone
+
+import arbitrage_strategy
+import risk_free_strategy
+from exchange import Deribit_Exchange
+from scenario import inverse_option_price, norm_cdf
+
+CHAIN_SIZES = (10, 40, 160)
+RESULTS_DIR = 'benchmarks'
+
+def quiet_logger(name: str = 'benchmark') -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.WARNING)
+    return logger
+
+def synthetic_chain(n_strikes: int, price: float = 20000.0, odate: str = None, vol: float = 0.5,
+                        days: float = 1.0, step: float = None, seed: int = 0):
+    """Put and call dicts shaped like prepare_option_struct + fetch_orderbook_data output,
+    priced with Black-76 around price. The default strike step divides 500 (at most 500),
+    so the 500 strike grid collar_strategy looks up is listed for every size"""
+    rng = np.random.default_rng(seed)
+    if odate is None:
+        odate = (datetime.now(timezone.utc) + timedelta(days)).strftime('%d%b%y').upper().lstrip('0')
+
+    step = step or max([s for s in (50.0, 100.0, 250.0, 500.0) if s <= price // n_strikes] or [50.0])
+    atm = price - price % step
+    strikes = atm + step * (np.arange(n_strikes) - n_strikes // 2)
+    tau = days / 365
+    sig_t = vol * np.sqrt(tau)
+    d1 = (np.log(price / strikes) + 0.5 * sig_t ** 2) / sig_t
+    now_ms = int(time.time() * 1000)
+
+    put_options, call_options = {}, {}
+    for options, is_call in ((put_options, False), (call_options, True)):
+        value = inverse_option_price(price, strikes, vol, tau, is_call)
+        delta = norm_cdf(d1) - (0 if is_call else 1)
+        for k, v, d in zip(strikes, value, delta):
+            spread = 0.0005 * (1 + rng.random())
+            bid = round(v - spread / 2, 4)
+            options[float(k)] = {
+                'strike': float(k),
+                'instrument_name': f'BTC-{odate}-{int(k)}-{"C" if is_call else "P"}',
+                'option_type': 'call' if is_call else 'put',
+                'date': odate,
+                'bid': bid if bid > 0 else np.nan,
+                'ask': round(v + spread / 2, 4),
+                'bid_amt': 10.0, 'ask_amt': 10.0,
+                'delta': float(d), 'gamma': 0.0002, 'vega': 3.0, 'rho': 0.1 * float(d),
+                'mark_iv': vol * 100, 'timestamp': now_ms
+            }
+
+    return put_options, call_options
+
+def ticker_frame(quote: dict) -> str:
+    """Raw ticker subscription frame as sent by Deribit for quote"""
+    data = {
+        'instrument_name': quote['instrument_name'],
+        'timestamp': int(time.time() * 1000),
+        'best_bid_price': 0.0 if np.isnan(quote['bid']) else quote['bid'],
+        'best_bid_amount': quote['bid_amt'],
+        'best_ask_price': quote['ask'],
+        'best_ask_amount': quote['ask_amt'],
+        'mark_iv': quote['mark_iv'],
+        'greeks': {k: quote[k] for k in ('delta', 'gamma', 'vega', 'rho')}
+    }
+    return json.dumps({'jsonrpc': '2.0', 'method': 'subscription',
+                        'params': {'channel': f"ticker.{quote['instrument_name']}.raw", 'data': data}})
+
+def timeit(func, min_time: float = 0.2, batches: int = 20) -> dict:
+    """Runs func in batches for about min_time seconds. Returns the median, p99 and
+    min of the per call time in microseconds"""
+    start = time.perf_counter()
+    func()
+    once = time.perf_counter() - start
+    per_batch = max(1, int(min_time / batches / max(once, 1e-7)))
+
+    samples = []
+    for _ in range(batches):
+        start = time.perf_counter_ns()
+        for _ in range(per_batch):
+            func()
+        samples.append((time.perf_counter_ns() - start) / per_batch / 1000)
+
+    samples = np.array(samples)
+    return {'median_us': float(np.median(samples)), 'p99_us': float(np.percentile(samples, 99)),
+            'min_us': float(samples.min()), 'calls': per_batch * batches}
+
+class FakeSocket:
+    async def send(self, message):
+        self.last = message
+
+def strategy_stages(put_options, call_options, price):
+    """Every strategy function of risk_free_strategy.py and arbitrage_strategy.py"""
+    scanner = arbitrage_strategy.ParityScanner()
+    odate = next(iter(put_options.values()))['date']
+
+    # the DataFrame based arbitrage checks rename columns by position, they take the bare
+    # instrument + bid/ask layout of the original chain
+    legacy = [{k: {'strike': q['strike'], 'instrument_name': q['instrument_name'], 'option_type': q['option_type'],
+                    'settlement_period': 'day', 'date': q['date'], 'bid': q['bid'], 'ask': q['ask']}
+                for k, q in options.items()} for options in (put_options, call_options)]
+    return {
+        'strategy.dist_1500': lambda: risk_free_strategy.dist_1500([], put_options, call_options, price),
+        'strategy.delta_10_20': lambda: risk_free_strategy.delta_10_20([], put_options, call_options, price),
+        'strategy.delta_2nd_max': lambda: risk_free_strategy.delta_2nd_max([], put_options, call_options, price),
+        'strategy.selling_premiums': lambda: risk_free_strategy.selling_premiums(put_options, call_options, price),
+        'strategy.sell_008_premium_2k_dist': lambda: risk_free_strategy.sell_008_premium_2k_dist(put_options, call_options, price, 0.004, 1000),
+        'strategy.test': lambda: risk_free_strategy.test(put_options, call_options, price),
+        'strategy.collar_strategy': lambda: risk_free_strategy.collar_strategy(put_options, call_options, price),
+        'strategy.check_riskfree_trade': lambda: arbitrage_strategy.check_riskfree_trade(*legacy, price),
+        'strategy.check_riskfree_trade_v2': lambda: arbitrage_strategy.check_riskfree_trade_v2(*legacy, price),
+        'strategy.parity_scanner': lambda: scanner.scan({odate: (put_options, call_options)}, price)
+    }
+
+def run_benchmarks(sizes = CHAIN_SIZES, min_time: float = 0.2, stages: str = '') -> dict:
+    results = {}
+    price = 20000.0
+
+    for n in sizes:
+        put_options, call_options = synthetic_chain(n, price)
+        exchange = Deribit_Exchange(url={'bench': ''}, auth={'bench': {}}, env='bench', currency='BTC',
+                                        trading=True, logger=quiet_logger())
+        exchange.put_options, exchange.call_options = put_options, call_options
+        exchange.asset_price = price
+        exchange.odate = exchange.chain.odate = next(iter(put_options.values()))['date']
+
+        quotes = list(put_options.values()) + list(call_options.values())
+        frames = [ticker_frame(q) for q in quotes]
+        datas = [json.loads(f)['params']['data'] for f in frames]
+        it = {'i': 0}
+
+        def next_frame():
+            it['i'] = (it['i'] + 1) % len(frames)
+            return it['i']
+
+        ws = FakeSocket()
+        loop = asyncio.new_event_loop()
+
+        def end_to_end():
+            # tick -> chain -> snapshot -> strategy -> post_orders gating -> order message send
+            exchange.dispatch(frames[next_frame()])
+            snap = exchange.chain.snapshot()
+            orders = risk_free_strategy.sell_008_premium_2k_dist(snap.put_options, snap.call_options, price, 0.0, 0)
+            exchange.traded_prems = {}
+            gate = exchange.order_gate(orders, hour=0) if orders else None
+            if gate:
+                bid_ask, premium, strk_dist, max_prem_cnt = gate
+                for o in orders:
+                    params = {'instrument_name': o['instrument']['instrument_name'], 'type': 'limit',
+                                'price': o[bid_ask], 'amount': exchange.order_size * max_prem_cnt,
+                                'label': f'{premium},{strk_dist}'}
+                    loop.run_until_complete(ws.send(exchange.create_message('private/sell', params)))
+
+        order_params = {'instrument_name': quotes[0]['instrument_name'], 'type': 'limit', 'price': 0.0035,
+                        'amount': 0.1, 'label': '0.0035,2000'}
+        bench = {
+            'decode': lambda: exchange.get_response_result(frames[next_frame()], result_prop='params'),
+            'chain_update': lambda: exchange.on_ticker(datas[next_frame()]),
+            'snapshot': lambda: (exchange.chain.apply('C', quotes[-1]['strike'], {'bid': 0.001}), exchange.chain.snapshot()),
+            'create_message': lambda: exchange.create_message('private/sell', order_params),
+            'end_to_end': end_to_end
+        }
+        bench.update(strategy_stages(put_options, call_options, price))
+
+        for name, func in bench.items():
+            if stages and not any(s in name for s in stages.split(',')):
+                continue
+            key = f'{name}[{n}]'
+            try:
+                results[key] = timeit(func, min_time)
+            except Exception as E:
+                results[key] = {'error': f'{type(E).__name__}: {E}'}
+
+        loop.close()
+
+    return results
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Stages whose median time regressed by more than threshold (0.2 = 20%), and stages
+    of the baseline that now fail (time and ratio None)"""
+    regressions = []
+    for key, res in results.items():
+        base = baseline.get(key)
+        if not base or 'median_us' not in base:
+            continue
+        if 'error' in res:
+            regressions.append((key, base['median_us'], None, None))
+            continue
+        ratio = res['median_us'] / base['median_us']
+        if ratio > 1 + threshold:
+            regressions.append((key, base['median_us'], res['median_us'], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Tick-to-order hot path benchmarks')
+    parser.add_argument('--sizes', default=','.join(map(str, CHAIN_SIZES)), help='chain sizes in strikes')
+    parser.add_argument('--stages', default='', help='comma separated name filter')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per stage')
+    parser.add_argument('--dir', default=RESULTS_DIR)
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown vs baseline')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    results = run_benchmarks(sizes, args.min_time, args.stages)
+
+    for key, res in results.items():
+        if 'error' in res:
+            print(f'{key:50s} {res["error"]}')
+        else:
+            print(f'{key:50s} median {res["median_us"]:10.2f} us  p99 {res["p99_us"]:10.2f} us')
+
+    os.makedirs(args.dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+    with open(os.path.join(args.dir, f'results-{stamp}.json'), 'w') as f:
+        json.dump({'python': sys.version, 'results': results}, f, indent=1)
+
+    baseline_file = os.path.join(args.dir, 'baseline.json')
+    if args.save_baseline:
+        with open(baseline_file, 'w') as f:
+            json.dump(results, f, indent=1)
+        print(f'Baseline saved to {baseline_file}')
+        return
+
+    if os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for key, base, now, ratio in regressions:
+            if now is None:
+                print(f'REGRESSION {key}: {base:.2f} us -> {results[key]["error"]}')
+            else:
+                print(f'REGRESSION {key}: {base:.2f} us -> {now:.2f} us ({ratio:.2f}x)')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
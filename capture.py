@@ -0,0 +1,141 @@
+import argparse
+import asyncio
+import bisect
+import logging
+import os
+import struct
+import time
+
+from datetime import datetime, timezone
+from typing import Union
+
+FRAME = struct.Struct('<qI')    # receive time in ns since epoch, frame length
+INDEX = struct.Struct('<qq')    # receive time in ns, file offset of the frame
+
+class FrameCapture:
+    """Appends raw inbound websocket frames with their receive time to {path}/frames-{start}.bin.
+    Every index_interval seconds an (receive time, offset) entry goes to the matching .idx
+    file so that replays can seek without scanning the whole capture"""
+
+    def __init__(self, path: str = 'frames', index_interval: float = 1.0,
+                    logger: Union[logging.Logger, str, None] = None):
+
+        self.logger = (logging.getLogger(logger) if isinstance(logger,str) else logger)
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+
+        os.makedirs(path, exist_ok=True)
+        name = os.path.join(path, datetime.now(timezone.utc).strftime('frames-%Y%m%d%H%M%S'))
+        self.filename = name + '.bin'
+
+        self._data = open(self.filename, 'ab')
+        self._index = open(name + '.idx', 'ab')
+        self._index_interval = int(index_interval * 1e9)
+        self._next_index = 0
+        self.frames = 0
+
+        self.logger.info(f'Capturing frames to {self.filename}')
+
+    def write(self, raw: Union[str, bytes], recv_ns: int = None):
+        if recv_ns is None:
+            recv_ns = time.time_ns()
+        if isinstance(raw, str):
+            raw = raw.encode()
+
+        if recv_ns >= self._next_index:
+            self._index.write(INDEX.pack(recv_ns, self._data.tell()))
+            self._data.flush()
+            self._index.flush()
+            self._next_index = recv_ns + self._index_interval
+
+        self._data.write(FRAME.pack(recv_ns, len(raw)))
+        self._data.write(raw)
+        self.frames += 1
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+class FrameReplay:
+    """Reads a capture written by FrameCapture, optionally starting at a receive time"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.index_ts, self.index_pos = [], []
+
+        idx = filename[:-len('.bin')] + '.idx'
+        if os.path.exists(idx):
+            with open(idx, 'rb') as f:
+                for ts, pos in INDEX.iter_unpack(f.read()):
+                    self.index_ts.append(ts)
+                    self.index_pos.append(pos)
+
+    def frames(self, start_ns: int = None, end_ns: int = None):
+        """Yields (recv_ns, raw frame) in capture order"""
+        offset = 0
+        if start_ns is not None and self.index_ts:
+            i = bisect.bisect_right(self.index_ts, start_ns) - 1
+            offset = self.index_pos[i] if i >= 0 else 0
+
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            while True:
+                head = f.read(FRAME.size)
+                if len(head) < FRAME.size:
+                    break
+
+                recv_ns, size = FRAME.unpack(head)
+                raw = f.read(size)
+                if len(raw) < size:
+                    break   # frame cut by a crash
+                if start_ns is not None and recv_ns < start_ns:
+                    continue
+                if end_ns is not None and recv_ns > end_ns:
+                    break
+
+                yield recv_ns, raw
+
+async def replay(exchange, filename: str, speed: float = 1.0, start_ns: int = None, end_ns: int = None) -> dict:
+    """Feeds captured frames through exchange.dispatch, the same path the listeners use.
+    speed is the replay rate versus capture time (1x, Nx), 0 replays as fast as possible.
+    Returns the frame count and the ingest throughput"""
+
+    frames = 0
+    first_ns = None
+    start = time.monotonic()
+
+    for recv_ns, raw in FrameReplay(filename).frames(start_ns, end_ns):
+        if first_ns is None:
+            first_ns = recv_ns
+
+        if speed > 0:
+            wait = (recv_ns - first_ns) / 1e9 / speed - (time.monotonic() - start)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        exchange.dispatch(raw)
+        frames += 1
+
+    elapsed = time.monotonic() - start
+    return {'frames': frames, 'seconds': elapsed, 'frames_per_sec': frames / elapsed if elapsed else 0.0}
+
+def main():
+    from exchange import Deribit_Exchange
+
+    parser = argparse.ArgumentParser(description='Replay a raw frame capture through Deribit_Exchange')
+    parser.add_argument('filename')
+    parser.add_argument('--speed', type=float, default=0, help='1 = real time, N = N times faster, 0 = max speed')
+    parser.add_argument('--start', help='start receive time, ISO format UTC')
+    parser.add_argument('--currency', default='BTC')
+    args = parser.parse_args()
+
+    start_ns = None
+    if args.start:
+        start_ns = int(datetime.fromisoformat(args.start).replace(tzinfo=timezone.utc).timestamp() * 1e9)
+
+    exchange = Deribit_Exchange(url={'test': ''}, auth={'test': {}}, currency=args.currency)
+    res = asyncio.run(replay(exchange, args.filename, args.speed, start_ns))
+    print(f"{res['frames']} frames in {res['seconds']:.3f}s, {res['frames_per_sec']:.0f} frames/s, chain seq {exchange.chain.seq}")
+
+if __name__ == '__main__':
+    main()
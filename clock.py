@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+from datetime import date, datetime, timezone
+from typing import Optional
+
+class Clock:
+    """Time source of the time dependent bot logic: the UTC wall clock for schedules and
+    expiries, the monotonic clock for intervals and sleep. This one is the real time"""
+
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.time(), timezone.utc)
+
+    def today(self) -> date:
+        return self.now().date()
+
+    def real(self, seconds: float) -> float:
+        """Real seconds that seconds of this clock take"""
+        return seconds
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(self.real(seconds))
+
+CLOCK = Clock()
+
+class SimClock(Clock):
+    """Accelerated clock for tests and simulations: from start (UTC, e.g. '2022-10-20 05:55')
+    simulated time runs speed times faster than real time, sleeps are shortened to match.
+    At 3600 a trading day with the roll and the settlement passes in 24 s"""
+
+    def __init__(self, start: Optional[str] = None, speed: float = 3600.0):
+        if start is None:
+            self.start = time.time()
+        else:
+            self.start = datetime.fromisoformat(start).replace(tzinfo=timezone.utc).timestamp()
+        self.speed = speed
+        self.real_start = time.monotonic()
+        self.skipped = 0.0
+
+    def elapsed(self) -> float:
+        """Simulated seconds since start"""
+        return (time.monotonic() - self.real_start) * self.speed + self.skipped
+
+    def time(self) -> float:
+        return self.start + self.elapsed()
+
+    def monotonic(self) -> float:
+        return self.elapsed()
+
+    def real(self, seconds: float) -> float:
+        return max(seconds, 0) / self.speed
+
+    def advance(self, seconds: float):
+        """Jumps seconds ahead, scheduler timers and bot waits due in between end at their next check"""
+        self.skipped += seconds
@@ -5,4 +5,8 @@ class CBotResponseError(Exception):
 
 class CBotError(Exception):
     def __init__(self, message):
-        super().__init__(message)
\ No newline at end of file
+        super().__init__(message)
+
+class CBotFeedError(CBotError):
+    """The whole market data feed went quiet, every session has to be reopened"""
+    pass
\ No newline at end of file
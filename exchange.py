@@ -4,13 +4,27 @@ import json
 import time
 import logging
 import numpy as np
-import pandas as pd
 
-from datetime import date, datetime, timedelta, timezone
+from datetime import timedelta
 from typing import Union, Optional, NoReturn
-import websockets
 
 from exceptions import CBotResponseError , CBotError
+from chain import OptionChain
+from latency import LatencyTracker
+from metrics import REGISTRY, RateCredits
+from clock import CLOCK
+from runtime import connect, process_age
+from scheduler import HourRegime
+from scenario import book_arrays, expiry_tau, scenario_grid
+
+MESSAGES = REGISTRY.counter('deribit_messages_total', 'Subscription messages received', ('channel',))
+REQUESTS = REGISTRY.counter('deribit_requests_total', 'Requests sent', ('method',))
+RECONNECTS = REGISTRY.counter('deribit_reconnects_total', 'Websocket listener reconnects', ('listener',))
+ORDERS = REGISTRY.counter('deribit_orders_total', 'Orders sent or rejected', ('direction', 'status'))
+RATE_LIMITED = REGISTRY.counter('deribit_rate_limited_total', 'too_many_requests errors')
+CREDITS = REGISTRY.gauge('deribit_rate_credits', 'Estimated non-matching engine credits left')
+LATENCY = REGISTRY.histogram('bot_latency_seconds', 'Tick to trade latency per stage', ('stage',))
+FIRST_SUBSCRIPTION = REGISTRY.gauge('bot_time_to_first_subscription_seconds', 'Seconds from process start to the first ticker subscription')
 
 class Deribit_Exchange:
     """The class describes the object of a simple bot that works with the Deribit exchange.
@@ -20,6 +34,8 @@ class Deribit_Exchange:
     def __init__(self, url, auth: dict, currency: str = 'ETH', env: str = 'test', trading: bool = False, order_size: float = 0.1,
                 daydelta: int = 2, risk_perc: float = 0.003, min_prem: float = 0.001, mid_prem: float = 0.008, strike_dist: int = 1500, expire_time: int = 7,
                 dvol_min: float = 50.0, dvol_mid: float = 60.0, default_prems = None, max_prem_cnt = 2, maker: bool = False, ord_type: str = '',
+                max_scenario_loss: float = 0.0, scenario_horizon: float = 0.0, recorder = None, capture = None, latency_report: float = 60.0, state_store = None,
+                clock = None,
                 logger: Union[logging.Logger, str, None] = None):
 
         self.currency = currency
@@ -30,12 +46,19 @@ class Deribit_Exchange:
         self.min_prem = min_prem
         self.strike_dist = strike_dist
         self.expire_time = expire_time
+        self.clock = clock if clock is not None else CLOCK
+        self.regime = HourRegime(expire_time, self.clock)
         self.dvol_min = dvol_min
         self.dvol_mid = dvol_mid
         self.default_prems = default_prems
         self.max_prem_cnt = max_prem_cnt
         self.maker = maker
         self.ord_type = ord_type
+        self.max_scenario_loss = max_scenario_loss      # fraction of equity, 0 = disabled
+        self.scenario_horizon = scenario_horizon        # hours to roll the book forward
+        self.recorder = recorder
+        self.capture = capture
+        self.state_store = state_store
 
         self.url = url[env]
         self.__credentials = auth[env]
@@ -46,6 +69,11 @@ class Deribit_Exchange:
         if self.logger is None:
             self.logger = logging.getLogger(__name__)
 
+        self.latency = LatencyTracker(latency_report, self.logger)
+        self.response_us = (None, None)
+        self.first_subscription = None  # seconds after process start, once per process
+        self.credits = RateCredits()
+
         self.df_initcols = ['strike', 'instrument_name', 'option_type']
 
         if env == 'test': # set 
@@ -55,6 +83,12 @@ class Deribit_Exchange:
         self.logger.info(f'Bot init for {self.currency} options, tradin = {trading}')
         self.logger.info(f'mid_prem={mid_prem} strike_dist={strike_dist}')
 
+    def export_metrics(self):
+        """Makes the process-wide credit and latency metrics read this exchange, called by
+        the bot that trades on it (backtests, benchmarks and load tests leave them alone)"""
+        CREDITS.func = self.credits.available
+        LATENCY.source = lambda: {(stage,): h for stage, h in self.latency.hists.items()}
+
     @property
     def keep_alive(self) -> bool :
         return self._keep_alive
@@ -79,15 +113,38 @@ class Deribit_Exchange:
     def asset_price(self, price: float):
         self._asset_price = price
 
+    @property
+    def put_options(self) -> dict :
+        return self.chain.put_options
+
+    @put_options.setter
+    def put_options(self, options: dict):
+        self.chain.put_options = options
+
+    @property
+    def call_options(self) -> dict :
+        return self.chain.call_options
+
+    @call_options.setter
+    def call_options(self, options: dict):
+        self.chain.call_options = options
+
+    def init_session(self):
+        """Partial reset for warm restarts, the chain, account state, orders and
+        traded premiums are kept"""
+        self.keep_alive = True
+        self.updated = False
+
     def init_vals(self):
+        """Full reset, used at start and for the next expiry"""
         # self.logger = logging.getLogger(__name__)
+        self.init_session()
         self.orders = {}
-        self.keep_alive = True
-        self.updated = False
         self.pos_updated = False
+        self.restored = False   # orders and positions come from a state snapshot, not the account yet
         self.asset_price = 0
-        self.put_options = {}
-        self.call_options = {}
+        self.chain = OptionChain()
+        self.chains = {}    # odate: chain of the active, next and settling expiries
         self.equity = 0
         self.avail_funds = 0
         self.dvol = 0
@@ -98,6 +155,7 @@ class Deribit_Exchange:
         # self.prev_call_options = {}
         # self.prev_put_options = {}
         self.trigger_orders = {}
+        self.positions = {}
         # self.best_put_instr = None
         # self.best_call_instr = None
         
@@ -114,6 +172,8 @@ class Deribit_Exchange:
         }
 
         self.logger.debug(f'Create message = {obj}')
+        REQUESTS.labels(method).inc()
+        self.credits.spend()
 
         return obj if as_dict else json.dumps(obj)
 
@@ -126,6 +186,7 @@ class Deribit_Exchange:
         """
 
         obj = json.loads(raw_response)
+        self.response_us = (obj.get('usIn'), obj.get('usOut'))
 
         self.logger.debug(f'Get response = {obj}')
 
@@ -135,6 +196,8 @@ class Deribit_Exchange:
         if 'error' in obj:
             self.keep_alive = False
             self.logger.info('Error found!')
+            if obj['error']['code'] == 10028:
+                RATE_LIMITED.inc()
             self.logger.info(f'Error: code: {obj["error"]["code"]}')
             self.logger.info(f'Error: msg: {obj["error"]["message"]}')
 
@@ -149,6 +212,89 @@ class Deribit_Exchange:
         return None
 
 
+    async def recv_frame(self, ws, capture: bool = True) -> str:
+        """Receives the next frame, appending it to the raw capture when enabled and capture"""
+        raw = await ws.recv()
+        self.latency.frame_received()
+        if self.capture and capture:
+            self.capture.write(raw)
+        return raw
+
+    def dispatch(self, raw_response: str):
+        """Routes a subscription frame to its channel handler, used for replays"""
+        self.latency.frame_received()
+        message = self.get_response_result(raw_response, raise_error=False, result_prop='params')
+        if message is None or 'channel' not in message or 'data' not in message:
+            return
+
+        channel = message['channel']
+        MESSAGES.labels(channel).inc()
+        if channel.startswith('ticker.'):
+            self.on_ticker(message['data'])
+        elif channel.startswith('deribit_price_index.'):
+            self.on_index(message['data'])
+        elif channel.startswith('deribit_volatility_index.'):
+            self.on_dvol(message['data'])
+
+    def on_index(self, data: dict):
+        self.asset_price = data['price']
+        self.updated = True
+
+        if self.recorder:
+            self.recorder.record('index', self.currency, (data['timestamp'], data['price']))
+
+        price = int(self.asset_price)
+        if price in self.put_options:
+            self.logger.info(f'ATM PUT buy price:  {self.put_options[price]["ask"]}: price: {price}')
+            self.logger.info(f'ATM CALL buy price: {self.call_options[price]["ask"]}: price: {price}')
+
+    def on_dvol(self, data: dict):
+        self.dvol = data['volatility']
+
+        if self.recorder:
+            self.recorder.record('dvol', self.currency, (data['timestamp'], data['volatility']))
+
+        self.logger.debug(f'DVOL index: {self.dvol}')
+
+    def on_ticker(self, data: dict):
+        self.logger.debug(f'Option quotes: {data}')
+
+        new_data = {
+            'bid': data['best_bid_price'] if data['best_bid_price'] > 0 else np.nan,
+            'bid_amt': data['best_bid_amount'],
+            'ask': data['best_ask_price'] if data['best_ask_price'] > 0 else np.nan,
+            'ask_amt': data['best_ask_amount'],
+            'delta': data['greeks']['delta'],
+            'gamma': data['greeks']['gamma'],
+            'vega': data['greeks']['vega'],
+            'rho': data['greeks']['rho'],
+            'mark_iv': data['mark_iv'],
+            'timestamp': data['timestamp']
+        }
+
+        _, odate, strike, order_type  = data['instrument_name'].split('-')
+
+        # replays start without prepare_option_struct, add instruments as they show up
+        chain = self.chains.get(odate)
+        if chain is None:
+            if self.odate is not None and odate != self.odate:
+                return
+            chain = self.chain
+
+        options = chain.put_options if order_type == 'P' else chain.call_options
+        if float(strike) not in options:
+            options[float(strike)] = {'strike': float(strike), 'instrument_name': data['instrument_name'],
+                                        'option_type': 'put' if order_type == 'P' else 'call', 'date': odate}
+
+        chain.apply(order_type, float(strike), new_data)
+        self.latency.tick_applied(data['timestamp'])
+
+        if self.recorder:
+            self.recorder.record_quote(odate, float(strike), order_type == 'C', data['timestamp'], new_data)
+
+        if chain is self.chain:
+            self.updated = True
+
     async def auth(self, ws, creds=None) -> Optional[dict]:
 
         if creds is None:
@@ -162,7 +308,8 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv())
+        # the response carries the access and refresh tokens, keep them out of the capture
+        return self.get_response_result(await self.recv_frame(ws, capture=False))
 
     async def get_instrument(self, ws, instrument_name) -> Optional[dict]:
         self.logger.info('get_instrument')
@@ -178,7 +325,7 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv())
+        return self.get_response_result(await self.recv_frame(ws))
 
     async def get_instruments(self, ws) -> Optional[dict]:
         self.logger.info('get_instruments')
@@ -196,13 +343,13 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv())
+        return self.get_response_result(await self.recv_frame(ws))
 
     async def get_index_price(self, ws, delay = 0):
         
         self.logger.info('get_index_price')
 
-        await asyncio.sleep(delay)
+        await self.clock.sleep(delay)
 
         prop = { 'index_name': f'{self.currency.lower()}_usd' }
 
@@ -213,7 +360,7 @@ class Deribit_Exchange:
             )
         )
 
-        price = self.get_response_result(await ws.recv())
+        price = self.get_response_result(await self.recv_frame(ws))
         if 'index_price' in price:
             # self.init_price = price['index_price']
             self.asset_price = price['index_price']
@@ -224,14 +371,18 @@ class Deribit_Exchange:
     async def create_order(self, ws, direction: str = 'sell', params: dict = {},
                             raise_error: bool = True):
 
-        await ws.send(
-            self.create_message(
-                f'private/{direction}',
-                { **params }
-            )
+        message = self.create_message(
+            f'private/{direction}',
+            { **params }
         )
 
-        return self.get_response_result(await ws.recv(), raise_error = raise_error)
+        sent = self.latency.order_sent()
+        await ws.send(message)
+
+        result = self.get_response_result(await self.recv_frame(ws), raise_error = raise_error)
+        self.latency.order_acked(sent, *self.response_us)
+
+        return result
 
     async def edit_order(self, ws, params: dict = {}, raise_error: bool = True):
 
@@ -242,7 +393,7 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv(), raise_error = raise_error)
+        return self.get_response_result(await self.recv_frame(ws), raise_error = raise_error)
 
     async def create_order_bk(self, ws, instrument_name: str, price: float, amount: float,
                             direction: str = 'sell', label: str = '', ord_type: str = 'limit',
@@ -260,7 +411,7 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv(), raise_error = raise_error)
+        return self.get_response_result(await self.recv_frame(ws), raise_error = raise_error)
 
     async def cancel_all(self, ws, raise_error: bool = True):
 
@@ -271,7 +422,7 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv(), raise_error = raise_error)
+        return self.get_response_result(await self.recv_frame(ws), raise_error = raise_error)
 
     # todo delete, not needed ?
     async def cancel_all_by_currency(self, ws, currency: str = 'BTC', kind: str = 'option',
@@ -285,7 +436,7 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv(), raise_error = raise_error)
+        return self.get_response_result(await self.recv_frame(ws), raise_error = raise_error)
 
     async def get_order_state(self, ws, order_id: Union[int, str],
                                 raise_error: bool = True):
@@ -297,7 +448,7 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv(), raise_error = raise_error)
+        return self.get_response_result(await self.recv_frame(ws), raise_error = raise_error)
 
     async def get_open_orders_by_currency(self, ws, currency: str = 'BTC', kind: str = 'option',
                                 raise_error: bool = True):
@@ -310,7 +461,7 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv(), raise_error = raise_error)
+        return self.get_response_result(await self.recv_frame(ws), raise_error = raise_error)
 
     async def get_open_orders_by_instrument(self, ws, instrument_name: str = '', oo_type: str = '',
                                 raise_error: bool = True):
@@ -323,7 +474,7 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv(), raise_error = raise_error)
+        return self.get_response_result(await self.recv_frame(ws), raise_error = raise_error)
 
     async def get_user_trades_by_currency(self, ws, currency: str = 'BTC', kind: str = 'option',
                                     raise_error: bool = True):
@@ -336,7 +487,7 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv(), raise_error = raise_error)
+        return self.get_response_result(await self.recv_frame(ws), raise_error = raise_error)
 
     async def get_positions(self, ws, currency: str = 'BTC', kind: str = 'option',
                                     raise_error: bool = True):
@@ -349,7 +500,7 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv(), raise_error = raise_error)
+        return self.get_response_result(await self.recv_frame(ws), raise_error = raise_error)
 
     async def get_order_history_by_currency(self, ws, currency: str = 'BTC', kind: str = 'option',
                                     raise_error: bool = True):
@@ -362,7 +513,7 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv(), raise_error = raise_error)
+        return self.get_response_result(await self.recv_frame(ws), raise_error = raise_error)
 
     async def get_account_summary(self, ws, currency: str = 'BTC',
                                     raise_error: bool = True):
@@ -374,7 +525,7 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv(), raise_error = raise_error)
+        return self.get_response_result(await self.recv_frame(ws), raise_error = raise_error)
 
     async def close_position(self, ws, params, raise_error: bool = True):
 
@@ -385,7 +536,7 @@ class Deribit_Exchange:
             )
         )
 
-        self.get_response_result(await ws.recv(), raise_error = raise_error)
+        return self.get_response_result(await self.recv_frame(ws), raise_error = raise_error)
         
 
     async def unsubscribe_all(self, ws) -> Optional[dict]:
@@ -398,7 +549,7 @@ class Deribit_Exchange:
             )
         )
 
-        return self.get_response_result(await ws.recv())
+        return self.get_response_result(await self.recv_frame(ws))
 
     async def get_ord_size(self):
         # total premium (reward) = 0.008
@@ -440,6 +591,105 @@ class Deribit_Exchange:
         self.logger.info(f'new amount = {amount}')
         return amount
 
+    def scenario_pnl(self, new_orders: list = None, ord_size: float = 0.0):
+        """Reprices open positions plus new_orders (sold at ord_size) on the stress grid.
+        Each expiry is priced on its own chain with its own time to settlement, settled
+        expiries are left out. Returns the PnL surface and the worst scenario loss in BTC"""
+
+        by_odate = {}
+        for name, size in self.positions.items():
+            parts = name.split('-')
+            if len(parts) == 4:
+                by_odate.setdefault(parts[1], {})[name] = size
+        for order in new_orders or []:
+            name = order['instrument']['instrument_name']
+            book = by_odate.setdefault(name.split('-')[1], {})
+            book[name] = book.get(name, 0.0) - ord_size
+
+        now = self.clock.now()
+        arrays = []
+        for odate, book in by_odate.items():
+            tau = expiry_tau(odate, now)
+            chain = self.chains.get(odate, self.chain if odate == self.odate else None)
+            if not tau or chain is None:
+                continue
+            strikes, is_call, sizes, vols = book_arrays(book, chain.put_options, chain.call_options)
+            arrays.append((strikes, is_call, sizes, vols, np.full(len(strikes), tau)))
+
+        if not arrays:
+            return scenario_grid([], [], [], [], self.asset_price, 0.0)
+
+        strikes, is_call, sizes, vols, tau = (np.concatenate(a) for a in zip(*arrays))
+        return scenario_grid(strikes, is_call, sizes, vols, self.asset_price, tau,
+                                horizon=np.minimum(self.scenario_horizon / 8760, tau))
+
+    def order_gate(self, order_list: list, hour: int = None) -> Optional[tuple]:
+        """Premium, dvol, strike distance and traded premium checks of post_orders.
+        Returns (bid_ask, premium, strk_dist, max_prem_cnt) when the orders may be sent,
+        None otherwise. hour is the UTC hour, defaults to the current hour regime"""
+
+        if self.maker:
+            bid_ask = 'ask' 
+        else:
+            bid_ask = 'bid' 
+
+        max_prem_cnt = self.max_prem_cnt
+
+        premium = order_list[0]['sum_premium'][bid_ask]
+        strk_dist = order_list[0]['strk_dist']
+        self.logger.info(f'Premium is {premium}')
+
+        if np.isnan(premium):
+            return None
+
+        if hour is None:
+            hour = self.regime.current().hour
+
+        if hour >= self.expire_time:
+
+            if self.dvol < self.dvol_min:
+                max_prem_cnt = self.max_prem_cnt * 2
+
+            else:
+                if self.dvol >= self.dvol_mid:
+                    if premium < self.mid_prem:
+                        self.logger.info(f'Premium {premium} < {self.mid_prem}')
+                        return None
+
+                    # if premium <= self.max_traded_prem:
+                    #     self.logger.info(f'{premium} premium <= {self.max_traded_prem} max traded prem')
+                    #     return
+                
+                else:
+                    # max_prem_cnt = self.max_prem_cnt * 2
+                    if premium < self.min_prem:
+                        self.logger.info(f'Premium {premium} < {self.min_prem}')
+                        return None
+
+            if strk_dist <= self.strike_dist:
+                self.logger.info(f'Strike Dist {strk_dist} <= {self.strike_dist}')
+                return None
+
+        if str(premium) in self.traded_prems:
+            if self.traded_prems[str(premium)] >= max_prem_cnt:
+                self.logger.info(f'Max count of {self.traded_prems[str(premium)]} for premium {premium} already traded!')
+                return None
+
+        return bid_ask, premium, strk_dist, max_prem_cnt
+
+    def persist(self):
+        """Snapshots the trading state after a change"""
+        if self.state_store:
+            self.state_store.save(self)
+
+    def add_traded_prem(self, premium: str, max_prem_cnt: int):
+        if premium in self.traded_prems:
+            self.traded_prems[premium] += max_prem_cnt
+        else:
+            self.traded_prems[premium] = max_prem_cnt
+
+        self.max_traded_prem = float(premium)
+
     async def post_orders(self, order_list):
 
         if not self.trading: return
@@ -526,54 +776,16 @@ class Deribit_Exchange:
 
             # allow all trades when low volatility and time between 0-exp time
 
-            if self.maker:
-                bid_ask = 'ask' 
-            else:
-                bid_ask = 'bid' 
-
-            max_prem_cnt = self.max_prem_cnt
-
-            premium = order_list[0]['sum_premium'][bid_ask]
-            strk_dist = order_list[0]['strk_dist']
-            self.logger.info(f'Premium is {premium}')
-
-            if np.isnan(premium):
+            gate = self.order_gate(order_list)
+            if gate is None:
                 return
 
-            if datetime.now(timezone.utc).hour >= self.expire_time:
-
-                if self.dvol < self.dvol_min:
-                    max_prem_cnt = self.max_prem_cnt * 2
-
-                else:
-                    if self.dvol >= self.dvol_mid:
-                        if premium < self.mid_prem:
-                            self.logger.info(f'Premium {premium} < {self.mid_prem}')
-                            return
-
-                        # if premium <= self.max_traded_prem:
-                        #     self.logger.info(f'{premium} premium <= {self.max_traded_prem} max traded prem')
-                        #     return
-                    
-                    else:
-                        # max_prem_cnt = self.max_prem_cnt * 2
-                        if premium < self.min_prem:
-                            self.logger.info(f'Premium {premium} < {self.min_prem}')
-                            return
-
-                if strk_dist <= self.strike_dist:
-                    self.logger.info(f'Strike Dist {strk_dist} <= {self.strike_dist}')
-                    return
-
-            if str(premium) in self.traded_prems:
-                if self.traded_prems[str(premium)] >= max_prem_cnt:
-                    self.logger.info(f'Max count of {self.traded_prems[str(premium)]} for premium {premium} already traded!')
-                    return
+            bid_ask, premium, strk_dist, max_prem_cnt = gate
 
             # websocket = await websockets.connect(self.url)
 
             premium = str(premium)
-            async with websockets.connect(self.url) as websocket:
+            async with connect(self.url) as websocket:
 
                 await self.auth(websocket)
 
@@ -588,6 +800,12 @@ class Deribit_Exchange:
                     return
                 
                 if await self.check_init_margin_vs_fund(): return
+
+                if self.max_scenario_loss > 0:
+                    _, worst = self.scenario_pnl(order_list, self.order_size * max_prem_cnt)
+                    if -worst > self.max_scenario_loss * self.equity:
+                        self.logger.info(f'Scenario loss {-worst} > {self.max_scenario_loss} of {self.equity} equity')
+                        return
             
                 # try:
                 direction = ''
@@ -616,6 +834,11 @@ class Deribit_Exchange:
                             'label'           :  f'{premium},{strk_dist}' #premium, strike distance, 
                         }
                         order_res = await self.create_order(websocket, 'sell', params)
+                        ORDERS.labels('sell', 'sent').inc()
+                        # only the filled part is a position, resting remainders are booked by the account reconcile
+                        filled = float((order_res or {}).get('order', {}).get('filled_amount', 0.0))
+                        if filled:
+                            self.positions[params['instrument_name']] = self.positions.get(params['instrument_name'], 0.0) - filled
                         # if 'order' in order_res:
                         #     order_det = order_res['order']
                         #     self.orders[order_det['instrument_name']] = order['instrument']
@@ -663,26 +886,23 @@ class Deribit_Exchange:
                         # else:
                         #     self.logger.info('Error in post_orders: Order not in order_res!')
 
-                        await asyncio.sleep(0.5)
+                        await self.clock.sleep(0.5)
 
                     except Exception as E:
                         self.logger.info(f'Error in post_orders: {err_loc} : {E}')
+                        ORDERS.labels('sell', 'rejected').inc()
             
             # else:
             # self.traded_prems.add(premium)
-            if premium in self.traded_prems:
-                self.traded_prems[premium] += max_prem_cnt
-            else:
-                self.traded_prems[premium] = max_prem_cnt
-
-            self.max_traded_prem = float(premium)
+            self.add_traded_prem(premium, max_prem_cnt)
+            self.persist()
     
     async def close_losing_positions(self):
 
         if self.orders:
             err_tresh = 0
             # websocket = await websockets.connect(self.url)
-            async with websockets.connect(self.url) as websocket:
+            async with connect(self.url) as websocket:
 
                 await self.auth(websocket)
 
@@ -699,7 +919,7 @@ class Deribit_Exchange:
                         }
                         res = await self.close_position(websocket, params)
                         self.orders.pop(id, None)
-                        await asyncio.sleep(0.5)
+                        await self.clock.sleep(0.5)
 
                 except Exception as E:
                     self.logger.info(f'Error in close_losing_positions: {E}')
@@ -710,13 +930,13 @@ class Deribit_Exchange:
         if self.orders:
             err_tresh = 0
             # websocket = await websockets.connect(self.url)
-            async with websockets.connect(self.url) as websocket:
+            async with connect(self.url) as websocket:
                 await self.auth(websocket)
 
                 try:
                     # cancel all user orders and triggers on all currencies
                     await self.cancel_all(websocket)
-                    await asyncio.sleep(0.5)
+                    await self.clock.sleep(0.5)
 
                     instrument_name = 'BTC-PERPETUAL'
                     self.logger.info(f'Closing position {instrument_name}')
@@ -731,7 +951,7 @@ class Deribit_Exchange:
                     else:
                         self.logger.info('Order not in response. Error closing BTC-PERPETUAL ...')
 
-                    await asyncio.sleep(0.5)
+                    await self.clock.sleep(0.5)
 
                 except Exception as E:
                     self.logger.info(f'Error in close_all_positions: {E}')
@@ -744,7 +964,7 @@ class Deribit_Exchange:
 
         self.logger.info(f'fetch_account_equity')
 
-        await asyncio.sleep(delay)
+        await self.clock.sleep(delay)
         res = await self.get_account_summary(ws, currency=self.currency)
         self.equity = float(res['equity'])
         self.avail_funds = float(res['available_funds'])
@@ -754,7 +974,7 @@ class Deribit_Exchange:
 
         self.logger.info(f'fetch_trigger_orders')
 
-        await asyncio.sleep(delay)
+        await self.clock.sleep(delay)
         # orders = await self.get_positions(ws, currency=self.currency) # << to be deleted?
 
         trig_orders = await self.get_open_orders_by_instrument(ws, 'BTC-PERPETUAL', self.ord_type)
@@ -772,10 +992,14 @@ class Deribit_Exchange:
 
         self.logger.info(f'fetch_account_positions')
 
-        await asyncio.sleep(delay)
+        await self.clock.sleep(delay)
         orders = await self.get_positions(ws, currency=self.currency)
         orders_hist = await self.get_order_history_by_currency(ws, currency=self.currency)
         instrument = None
+        hist_prems = {}
+
+        # rebuilt from the exchange, positions closed or settled meanwhile must not survive a restore
+        open_orders, positions = {}, {}
 
         for order in orders:
             if order['instrument_name'] == 'BTC-PERPETUAL':
@@ -784,12 +1008,12 @@ class Deribit_Exchange:
             _, odate, strike, order_type  = order['instrument_name'].split('-')
             
             self.logger.info(f"{order['instrument_name']} : {order['realized_profit_loss']}")
-            if float(order['realized_profit_loss']) == 0:
+            if float(order['realized_profit_loss']) == 0 and float(order['size']) != 0:
                 # if odate == self.odate:
-                if order_type == 'P':
-                    instrument = self.put_options[float(strike)]
-                else:
-                    instrument = self.call_options[float(strike)]
+                # positions of a settling expiry are looked up in its own chain during a roll
+                chain = self.chains.get(odate, self.chain)
+                options = chain.put_options if order_type == 'P' else chain.call_options
+                instrument = options.get(float(strike), {'instrument_name': order['instrument_name']})
 
                 # else:
                 #     if order_type == 'P':
@@ -797,7 +1021,8 @@ class Deribit_Exchange:
                 #     else:
                 #         instrument = self.prev_call_options[float(strike)]
                 
-                self.orders[order['instrument_name']] = instrument
+                open_orders[order['instrument_name']] = instrument
+                positions[order['instrument_name']] = float(order['size'])
                 # if order_type == 'P':
                 #     if self.best_put_instr is not None:
                 #         self.logger.info(f"Best Put Stike: {self.best_put_instr['strike']} bid: {self.best_put_instr['bid']}   Order Strike: {instrument['strike']} bid: {instrument['bid']}")
@@ -819,6 +1044,9 @@ class Deribit_Exchange:
                 else:
                     self.logger.info(f'Strike {strike} not found in triger_orders!')
 
+        self.orders = open_orders
+        self.positions = positions
+
         for order in orders_hist:
             if order['instrument_name'] == 'BTC-PERPETUAL':
                 continue
@@ -836,33 +1064,35 @@ class Deribit_Exchange:
                     lbl_prem = order['label']
 
                 if order_type == 'P':
-                    if lbl_prem not in self.traded_prems:
-                        self.traded_prems[lbl_prem] = self.max_prem_cnt
-                    else:
-                        self.traded_prems[lbl_prem] += self.max_prem_cnt
+                    hist_prems[lbl_prem] = hist_prems.get(lbl_prem, 0) + self.max_prem_cnt
+
+        # a restored snapshot knows the doubled counts of low dvol trades, the labels do not
+        for lbl_prem, cnt in hist_prems.items():
+            self.traded_prems[lbl_prem] = max(self.traded_prems.get(lbl_prem, 0), cnt)
 
         self.pos_updated = True
+        self.restored = False
+        self.persist()
         self.logger.info(f'There are {len(self.orders)} open positions!')
 
     async def fetch_account_info(self) -> NoReturn:
 
         self.logger.info(f'fetch_account_info')
 
-        async with websockets.connect(self.url) as websocket:
+        async with connect(self.url) as websocket:
             await self.auth(websocket)
 
-            await asyncio.gather(
-                self.fetch_account_equity(websocket, 0.5),
-                self.fetch_trigger_orders(websocket, 1),
-                self.fetch_account_positions(websocket, 1.5)
-            )
+            # one after the other, the requests share the websocket and its replies
+            await self.fetch_account_equity(websocket, 0.5)
+            await self.fetch_trigger_orders(websocket, 0.5)
+            await self.fetch_account_positions(websocket, 0.5)
 
     async def test_run(self) -> NoReturn:
 
         self.logger.info(f'test_run')
 
         # websocket = await websockets.connect(self.url)
-        async with websockets.connect(self.url) as websocket:
+        async with connect(self.url) as websocket:
             await self.auth(websocket)
             await asyncio.gather(
                 self.fetch_account_equity(websocket, 0.5),
@@ -879,7 +1109,7 @@ class Deribit_Exchange:
             )
             if 'order' in order_res:
                 order_det = order_res['order']
-                await asyncio.sleep(0.5)
+                await self.clock.sleep(0.5)
 
             await self.close_position(websocket, 'BTC-20OCT22-18000-P', 0.0255)
 
@@ -893,7 +1123,7 @@ class Deribit_Exchange:
         # websocket = await websockets.connect(self.url)
 
         # first_run = True
-        async for websocket in websockets.connect(self.url):
+        async for websocket in connect(self.url):
 
             await self.auth(websocket)
 
@@ -911,26 +1141,20 @@ class Deribit_Exchange:
             )
 
             self.logger.info(f'fetch_deribit_price_index: before while loop')
-            await asyncio.sleep(0.5)
+            await self.clock.sleep(0.5)
 
             data = None
             while self.keep_alive:
 
                 try:    
-                    message = self.get_response_result(await websocket.recv(), result_prop='params')
+                    message = self.get_response_result(await self.recv_frame(websocket), result_prop='params')
 
                     if (not message is None and
                             ('channel' in message) and
                             ('data' in message)):
 
-                        data = message['data']
-                        self.asset_price = data['price']
-                        self.updated = True
-
-                        price = int(self.asset_price)
-                        if price in self.put_options:
-                            self.logger.info(f'ATM PUT buy price:  {self.put_options[price]["ask"]}: price: {price}')
-                            self.logger.info(f'ATM CALL buy price: {self.call_options[price]["ask"]}: price: {price}')
+                        MESSAGES.labels(message['channel']).inc()
+                        self.on_index(message['data'])
 
                         # if self.asset_price >= self.init_price + 2000 or self.asset_price <= self.init_price - 2000:
                         #     self.logger.info('Resetting bot... ')
@@ -939,6 +1163,7 @@ class Deribit_Exchange:
                 except Exception as E:
                     self.logger.info(f'Error in fetch_deribit_price_index: {E}')
                     self.logger.info(f'Reconnecting Price listener...')
+                    RECONNECTS.labels('price_index').inc()
                     break
             
             if not self.keep_alive:
@@ -950,7 +1175,7 @@ class Deribit_Exchange:
         """Реализует логику работы бота"""
         self.logger.info(f'fetch_dvol_index')
 
-        async for websocket in websockets.connect(self.url):
+        async for websocket in connect(self.url):
 
             await self.auth(websocket)
 
@@ -962,26 +1187,25 @@ class Deribit_Exchange:
             )
 
             self.logger.info(f'fetch_dvol_index: before while loop')
-            await asyncio.sleep(0.5)
+            await self.clock.sleep(0.5)
 
             data = None
             while self.keep_alive:
 
                 try:    
-                    message = self.get_response_result(await websocket.recv(), result_prop='params')
+                    message = self.get_response_result(await self.recv_frame(websocket), result_prop='params')
 
                     if (not message is None and
                             ('channel' in message) and
                             ('data' in message)):
 
-                        data = message['data']
-                        self.dvol = data['volatility']
-
-                        self.logger.debug(f'DVOL index: {self.dvol}')
+                        MESSAGES.labels(message['channel']).inc()
+                        self.on_dvol(message['data'])
                 
                 except Exception as E:
                     self.logger.info(f'Error in fetch_dvol_index: {E}')
                     self.logger.info(f'Reconnecting DVOL listener...')
+                    RECONNECTS.labels('dvol_index').inc()
                     break
             
             if not self.keep_alive:
@@ -991,20 +1215,17 @@ class Deribit_Exchange:
 
     async def fetch_orderbook_data(self, strike: str, delay: float = 0, odate: str = '') -> NoReturn:
         """Реализует логику работы бота"""
-        await asyncio.sleep(delay)
+        await self.clock.sleep(delay)
         
         self.logger.info(f'fetch_orderbook_data: Listener for {strike} started..')
 
         # websocket = await websockets.connect(self.url)
         put_inst_name = ''
         call_inst_name = ''
-        put_options = {}
-        call_options = {}
         # if odate == '':
-        put_inst_name = self.put_options[float(strike)]['instrument_name']
-        call_inst_name = self.call_options[float(strike)]['instrument_name']
-        put_options = self.put_options
-        call_options = self.call_options
+        chain = self.chains.get(odate, self.chain)
+        put_inst_name = chain.put_options[float(strike)]['instrument_name']
+        call_inst_name = chain.call_options[float(strike)]['instrument_name']
         # else:
         #     put_inst_name = self.prev_put_options[float(strike)]['instrument_name']
         #     call_inst_name = self.prev_call_options[float(strike)]['instrument_name']
@@ -1014,7 +1235,7 @@ class Deribit_Exchange:
         max_err_cnt = 2
         err_cnt = 0
 
-        async for websocket in websockets.connect(self.url):
+        async for websocket in connect(self.url):
 
             await self.auth(websocket)
 
@@ -1032,47 +1253,32 @@ class Deribit_Exchange:
                 )
             )
 
+            if self.first_subscription is None:
+                self.first_subscription = process_age()
+                FIRST_SUBSCRIPTION.set(self.first_subscription)
+                self.logger.info(f'First ticker subscription {self.first_subscription:.2f} s after process start')
+
             data = None
             while self.keep_alive:
 
                 try:
-                    message = self.get_response_result(await websocket.recv(), result_prop='params')
+                    message = self.get_response_result(await self.recv_frame(websocket), result_prop='params')
 
                     if (not message is None and
                             ('channel' in message) and
                             ('data' in message)):
 
-                        data = message['data']
-                        self.logger.debug(f'Option quotes: {data}')
-
-                        new_data = {
-                            'bid': data['best_bid_price'] if data['best_bid_price'] > 0 else np.nan,
-                            'bid_amt': data['best_bid_amount'],
-                            'ask': data['best_ask_price'] if data['best_ask_price'] > 0 else np.nan,
-                            'ask_amt': data['best_ask_amount'],
-                            'delta': data['greeks']['delta'],
-                            'gamma': data['greeks']['gamma'],
-                            'vega': data['greeks']['vega'],
-                            'rho': data['greeks']['rho']
-                        }
-
-                        _, _, strike, order_type  = data['instrument_name'].split('-')
-
-                        if order_type == 'P':
-                            put_options[float(strike)].update(new_data)
-                        else:
-                            call_options[float(strike)].update(new_data)
-
-                        # options_dict[strike].update(new_data)
-                        self.updated = True
+                        MESSAGES.labels(message['channel']).inc()
+                        self.on_ticker(message['data'])
                     
                     else:
                         self.logger.info('Data not updated > ')
                         self.logger.info(f'Message: {message}')
                 
                 except Exception as E:
-                    await asyncio.sleep(delay)
+                    await self.clock.sleep(delay)
                     self.logger.info(f'Reconnecting listener for {strike}')
+                    RECONNECTS.labels('orderbook').inc()
                     
                     err_cnt += 1
                     if err_cnt == max_err_cnt:
@@ -1112,6 +1318,49 @@ class Deribit_Exchange:
 
 
     async def prepare_option_struct(self) -> NoReturn:
+        odate, put_options, call_options = await self.load_expiry()
+
+        self.add_expiry(odate, put_options, call_options)
+        self.activate(odate, reset=False)
+
+    def add_expiry(self, odate: str, put_options: dict, call_options: dict):
+        """Registers the chain of odate, its quotes are updated by on_ticker from now on"""
+        self.chains[odate] = OptionChain(put_options, call_options, odate)
+
+    def activate(self, odate: str, reset: bool = True):
+        """Atomically makes odate the traded expiry, the strategies see its chain from
+        their next evaluation. reset clears the per expiry traded premiums"""
+        self.chain = self.chains[odate]
+        self.odate = odate
+
+        if reset:
+            self.traded_prems = {}
+            self.max_traded_prem = 0.0
+            self.persist()
+
+        self.logger.info(f'Active expiry: {odate}')
+
+    def retire(self, odate: str):
+        """Drops a settled expiry with its orders and positions"""
+        self.chains.pop(odate, None)
+        for book in (self.orders, self.positions):
+            for name in [n for n in book if f'-{odate}-' in n]:
+                del book[name]
+        self.persist()
+
+        self.logger.info(f'Expiry {odate} retired')
+
+    def has_orders(self, odate: str) -> bool:
+        return any(f'-{odate}-' in name for name in self.orders)
+
+    def expiries(self) -> set:
+        """Expiries with a chain, an order or a position"""
+        names = [name.split('-') for book in (self.orders, self.positions) for name in book]
+        return set(self.chains) | {parts[1] for parts in names if len(parts) == 4}
+
+    async def load_expiry(self) -> tuple:
+        """Instruments of the expiry to trade now, around the index price.
+        Returns (odate, put_options, call_options), the dicts are empty when none are listed"""
 
         daydelta = self.daydelta
         if daydelta < 1:
@@ -1120,22 +1369,20 @@ class Deribit_Exchange:
         self.logger.info('prepare_option_struct')
         DAY = None
 
-        async with websockets.connect(self.url) as websocket:
+        async with connect(self.url) as websocket:
             
             await self.auth(websocket)
 
-            if datetime.now(timezone.utc).hour < self.expire_time or self.env == 'test':
+            if not self.regime.current().after_expire or self.env == 'test':
                 DAY = timedelta(daydelta-1)          # 1 day option expiry
             else:
                 DAY = timedelta(daydelta)          # 2 days option expiry
 
-            expire_dt = date.today() + DAY
+            expire_dt = self.clock.today() + DAY
             self.logger.info(f'Today is {expire_dt}')
             expire_dt = expire_dt.strftime(f"{expire_dt.day}%b%y").upper()
             self.logger.info(f'Today is {expire_dt}')
 
-            self.odate = expire_dt
-            
             raw_instruments = await self.get_instruments(websocket)
             await self.get_index_price(websocket)
             
@@ -1143,56 +1390,54 @@ class Deribit_Exchange:
 
             if not raw_instruments:
                 self.logger.info('Raw Instruments empty!')
-                return # (None, None)
-
-            raw_instruments = pd.DataFrame(raw_instruments)
+                return expire_dt, {}, {}
 
             # self.logger.info('List of Raw Instruments ----->>>>')
             # self.logger.info(raw_instruments['instrument_name'])
 
-            pd_inst = pd.DataFrame(raw_instruments)[self.df_initcols].set_index('strike', drop=False)
-            pd_inst['date'] = pd_inst['instrument_name'].str.split('-', expand=True)[1]
-
             while self.asset_price == 0:     # wait for price to be fetched
                 self.logger.info('Price not updated!')
-                await asyncio.sleep(0.5)
+                await self.clock.sleep(0.5)
             
             styk_interval = 250
             bounds = 5000
             price = self.asset_price
             price -= price % styk_interval
 
-            pd_inst = pd_inst[(pd_inst['date'] == expire_dt) & (pd_inst['strike'] >= price - bounds) & (pd_inst['strike'] <= price + bounds)]
+            # a few hundred instruments, plain dicts keep pandas off the startup path
+            put_options, call_options = {}, {}
+            for inst in sorted(raw_instruments, key=lambda i: i['strike']):
+                odate = inst['instrument_name'].split('-')[1]
+                if odate != expire_dt or not price - bounds <= inst['strike'] <= price + bounds:
+                    continue
+
+                options = call_options if inst['option_type'] == 'call' else put_options
+                options[float(inst['strike'])] = {
+                    'strike': float(inst['strike']), 'instrument_name': inst['instrument_name'],
+                    'option_type': inst['option_type'], 'date': odate,
+                    'bid': np.nan, 'ask': np.nan, 'delta': 0.0, 'gamma': 0.0, 'vega': 0.0, 'rho': 0.0,
+                    'mark_iv': np.nan, 'timestamp': np.nan
+                }
+
             # pd_inst = pd_inst[(pd_inst['date'] == expire_dt) \
             #     & (
             #         ((pd_inst['option_type'] == 'call') & (pd_inst['strike'] >= price - 2000) & (pd_inst['strike'] <= price + bounds)) \
             #         | ((pd_inst['option_type'] == 'put') & (pd_inst['strike'] >= price - bounds) & (pd_inst['strike'] <= price + 2000))
             #     )]
-            pd_inst.sort_index(inplace=True)
 
-            if pd_inst.empty:
+            if not put_options and not call_options:
                 self.logger.info(f'No available options for day {expire_dt}')
-                return #(None, None)
-
-            pd_inst['bid'] = np.nan
-            pd_inst['ask'] = np.nan
-            pd_inst['delta'] = 0.0
-            pd_inst['gamma'] = 0.0
-            pd_inst['vega'] = 0.0
-            pd_inst['rho'] = 0.0
-
-            self.logger.info('List of Instruments ----->>>>')
-            self.logger.info(pd_inst)
+                return expire_dt, {}, {}
 
-            call_options = pd_inst[pd_inst['option_type'] == 'call'].to_dict('index')
-            put_options  = pd_inst[pd_inst['option_type'] == 'put'].to_dict('index')
+            strikes = sorted({*put_options, *call_options})
+            self.logger.info(f'Instruments of {expire_dt}: {len(put_options)} puts, {len(call_options)} calls, '
+                                f'strikes {strikes[0]} to {strikes[-1]}')
 
-            self.call_options, self.put_options = (call_options, put_options)
-            # return (call_options, put_options)
+            return expire_dt, put_options, call_options
 
             # await self.fetch_account_positions(websocket)
 
     async def grace_exit(self):
         self.logger.info('grace_exit')
-        async with websockets.connect(self.url) as websocket:
+        async with connect(self.url) as websocket:
             await self.unsubscribe_all(websocket)
\ No newline at end of file
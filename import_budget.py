@@ -0,0 +1,61 @@
+import argparse
+import subprocess
+import sys
+
+def import_times(module: str) -> list:
+    """(depth, self us, cumulative us, name) of every import of a fresh interpreter
+    running import module, from -X importtime"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True)
+    if proc.returncode:
+        raise RuntimeError(f'import {module} failed:\n{proc.stderr[-2000:]}')
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cum_us, name = line[len('import time:'):].split('|')
+        rows.append(((len(name) - len(name.lstrip())) // 2, int(self_us), int(cum_us), name.strip()))
+    return rows
+
+def check(module: str = 'app_v3', budget_ms: float = 250.0, forbid: tuple = ('pandas',), runs: int = 3,
+            top: int = 15) -> bool:
+    """Best of runs import times of module against budget_ms, and none of forbid imported"""
+    best = None
+    for _ in range(runs):
+        rows = import_times(module)
+        total = next(cum for depth, _, cum, name in rows if name == module)
+        if best is None or total < best[0]:
+            best = (total, rows)
+    total, rows = best
+
+    print(f'import {module}: {total / 1000:.1f} ms (budget {budget_ms:.0f} ms, best of {runs})')
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for depth, self_us, cum_us, name in sorted((r for r in rows if r[0] <= 1), key=lambda r: -r[2])[:top]:
+        print(f'{cum_us / 1000:10.1f}ms {self_us / 1000:8.1f}ms  {"  " * depth}{name}')
+
+    ok = total / 1000 <= budget_ms
+    if not ok:
+        print(f'Over budget by {total / 1000 - budget_ms:.1f} ms')
+
+    imported = {name.split('.')[0] for _, _, _, name in rows}
+    for name in forbid:
+        if name in imported:
+            print(f'{name} is imported at startup')
+            ok = False
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup import time budget (python -X importtime)')
+    parser.add_argument('--module', default='app_v3')
+    parser.add_argument('--budget', type=float, default=250.0, help='ms for import module')
+    parser.add_argument('--forbid', default='pandas', help='comma separated top level packages not to import')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    forbid = tuple(name for name in args.forbid.split(',') if name)
+    sys.exit(0 if check(args.module, args.budget, forbid, args.runs, args.top) else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+import logging
+import time
+
+from typing import Union, Optional
+
+SUB_BITS = 6    # 64 sub-buckets per power of two, values are kept within ~1.6%
+
+class Histogram:
+    """HDR-style log-linear histogram of integer values (ns). Values below 2*64 are
+    exact, above that each power of two is split in 64 buckets. record is a handful
+    of integer operations and the memory is fixed, so it can stay on the hot path"""
+
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, max_bits: int = 44):
+        self.counts = [0] * ((max_bits - SUB_BITS + 1) << SUB_BITS)
+        self.reset()
+
+    def reset(self):
+        self.counts[:] = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    @staticmethod
+    def _value(index: int) -> int:
+        """Upper bound of the bucket"""
+        shift = (index >> SUB_BITS) - 1
+        if shift <= 0:
+            return index
+        return (((index & ((1 << SUB_BITS) - 1)) | (1 << SUB_BITS)) + 1 << shift) - 1
+
+    def record(self, value: int):
+        if value < 0:
+            value = 0
+        shift = value.bit_length() - SUB_BITS - 1
+        idx = value if shift <= 0 else (shift << SUB_BITS) + (value >> shift)
+        if idx >= len(self.counts):
+            idx = len(self.counts) - 1
+        self.counts[idx] += 1
+
+        if not self.count or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def merge(self, other: 'Histogram'):
+        for i, c in enumerate(other.counts):
+            if c:
+                self.counts[i] += c
+        if other.count:
+            self.min = other.min if not self.count else min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+
+    def copy(self) -> 'Histogram':
+        other = Histogram.__new__(Histogram)
+        other.counts = list(self.counts)
+        other.count, other.total, other.min, other.max = self.count, self.total, self.min, self.max
+        return other
+
+    def since(self, prev: 'Histogram') -> 'Histogram':
+        """Values recorded after the prev copy, min and max are bucket bounds"""
+        other = Histogram.__new__(Histogram)
+        other.counts = [a - b for a, b in zip(self.counts, prev.counts)]
+        other.count, other.total = self.count - prev.count, self.total - prev.total
+        used = [i for i, c in enumerate(other.counts) if c]
+        other.min = min(self._value(used[0]), self.max) if used else 0
+        other.max = min(self._value(used[-1]), self.max) if used else 0
+        return other
+
+    def percentile(self, q: float) -> int:
+        """Value at percentile q (0-100), clamped to the recorded min and max"""
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * q // 100))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return max(self.min, min(self._value(i), self.max))
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+# tick to trade stages, all in ns
+STAGES = (
+    'feed',              # exchange ticker timestamp -> frame received (wall clock)
+    'apply',             # frame received -> quote applied to the chain
+    'tick_to_strategy',  # last applied tick -> strategy start
+    'strategy',          # strategy start -> end
+    'decision_to_send',  # strategy end -> order sent
+    'tick_to_send',      # tick the strategy saw last -> order sent
+    'ack',               # order sent -> response received
+    'uplink',            # order sent -> exchange usIn (wall clock)
+    'matching',          # exchange usIn -> usOut
+    'downlink'           # exchange usOut -> response received (wall clock)
+)
+
+class LatencyTracker:
+    """Timestamps along the tick to trade path, kept per stage in histograms.
+    Monotonic perf_counter_ns stamps are used within the bot, the wall clock only where
+    exchange times (ticker timestamp in ms, usIn/usOut in us) are joined in, so those
+    stages include the clock offset to the exchange"""
+
+    def __init__(self, report_interval: float = 60.0, logger: Union[logging.Logger, str, None] = None):
+        self.report_interval = report_interval
+        self.hists = {stage: Histogram() for stage in STAGES}
+        self.marks = {stage: h.copy() for stage, h in self.hists.items()}
+
+        self.recv_ns = 0            # receive time of the frame being handled
+        self.recv_wall_ns = 0
+        self.last_tick_ns = 0       # receive time of the last quote applied to the chain
+        self.decision_tick_ns = 0   # last_tick_ns when the strategy started
+        self.strategy_start_ns = 0
+        self.strategy_end_ns = 0
+        self.last_report = time.monotonic()
+
+        self.logger = (logging.getLogger(logger) if isinstance(logger,str) else logger)
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+
+    def record(self, stage: str, ns: int):
+        self.hists[stage].record(ns)
+
+    def window(self) -> dict:
+        """Histograms of the values recorded since the last report"""
+        return {stage: h.since(self.marks[stage]) for stage, h in self.hists.items()}
+
+    def frame_received(self) -> int:
+        self.recv_ns = time.perf_counter_ns()
+        self.recv_wall_ns = time.time_ns()
+        return self.recv_ns
+
+    def tick_applied(self, exchange_ts_ms: int):
+        now = time.perf_counter_ns()
+        self.hists['apply'].record(now - self.recv_ns)
+        self.hists['feed'].record(self.recv_wall_ns - exchange_ts_ms * 1000000)
+        self.last_tick_ns = self.recv_ns
+
+    def strategy_started(self):
+        self.strategy_start_ns = time.perf_counter_ns()
+        self.decision_tick_ns = self.last_tick_ns
+        if self.decision_tick_ns:
+            self.record('tick_to_strategy', self.strategy_start_ns - self.decision_tick_ns)
+
+    def strategy_ended(self):
+        self.strategy_end_ns = time.perf_counter_ns()
+        self.record('strategy', self.strategy_end_ns - self.strategy_start_ns)
+
+    def order_sent(self) -> tuple:
+        """Returns the (perf_counter_ns, wall ns) send stamps for order_acked"""
+        now = time.perf_counter_ns()
+        if self.strategy_end_ns:
+            self.record('decision_to_send', now - self.strategy_end_ns)
+        if self.decision_tick_ns:
+            self.record('tick_to_send', now - self.decision_tick_ns)
+        return now, time.time_ns()
+
+    def order_acked(self, sent: tuple, us_in: Optional[int] = None, us_out: Optional[int] = None):
+        sent_ns, sent_wall = sent
+        now = time.perf_counter_ns()
+        self.record('ack', now - sent_ns)
+
+        if us_in and us_out:
+            recv_wall = sent_wall + now - sent_ns
+            self.record('uplink', us_in * 1000 - sent_wall)
+            self.record('matching', (us_out - us_in) * 1000)
+            self.record('downlink', recv_wall - us_out * 1000)
+
+    def query(self, stage: str, q: float = 50.0, window: bool = False) -> float:
+        """Percentile q of stage in ms, since start or since the last report"""
+        hist = self.hists[stage].since(self.marks[stage]) if window else self.hists[stage]
+        return hist.percentile(q) / 1e6
+
+    def summary(self, window: bool = False) -> dict:
+        """{stage: {'count', 'p50', 'p99', 'max'}} in ms for the stages with data"""
+        hists = self.window() if window else self.hists
+        return {stage: {'count': h.count, 'p50': h.percentile(50) / 1e6, 'p99': h.percentile(99) / 1e6,
+                        'max': h.max / 1e6}
+                for stage, h in hists.items() if h.count}
+
+    def maybe_report(self):
+        """Logs one summary line per report_interval and starts a new window"""
+        now = time.monotonic()
+        if now - self.last_report < self.report_interval:
+            return
+
+        stats = self.summary(window=True)
+        if stats:
+            line = ' | '.join(f'{stage} {s["p50"]:.3f}/{s["p99"]:.3f}/{s["max"]:.3f}' for stage, s in stats.items())
+            self.logger.info(f'Latency p50/p99/max ms: {line}')
+
+        self.marks = {stage: h.copy() for stage, h in self.hists.items()}
+        self.last_report = now
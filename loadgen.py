@@ -0,0 +1,282 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+import random
+import time
+import websockets
+
+from typing import Union
+
+from mock_deribit import MockDeribit
+from scenario import YEAR
+
+class MarketModel:
+    """Spot GBM whose volatility mean reverts to theta (an OU process on the annualized
+    vol with vol_of_vol, correlated rho with the spot). Called with dt in seconds,
+    returns (index, dvol) for MockDeribit"""
+
+    def __init__(self, price: float = 20000.0, vol: float = 0.5, theta: float = 0.5, kappa: float = 20.0,
+                    vol_of_vol: float = 1.5, rho: float = -0.5, seed: int = 0):
+        self.price = price
+        self.vol = vol
+        self.theta = theta
+        self.kappa = kappa
+        self.vol_of_vol = vol_of_vol
+        self.rho = rho
+        self.rng = random.Random(seed)
+
+    def __call__(self, dt: float) -> tuple:
+        if dt > 0:
+            t = dt / YEAR
+            z1 = self.rng.gauss(0, 1)
+            z2 = self.rho * z1 + math.sqrt(1 - self.rho ** 2) * self.rng.gauss(0, 1)
+            self.price *= math.exp(self.vol * math.sqrt(t) * z1 - 0.5 * self.vol ** 2 * t)
+            self.vol = max(self.vol + self.kappa * (self.theta - self.vol) * t + self.vol_of_vol * math.sqrt(t) * z2, 0.05)
+        return self.price, self.vol * 100
+
+class LoadGenerator(MockDeribit):
+    """MockDeribit publishing the subscribed ticker channels at rate messages per second
+    in total (round robin over the subscriptions, freshly stamped), times burst_factor for
+    burst_length seconds every burst_every seconds. The market model steps and the index
+    and DVOL channels publish every step_interval. public/set_load changes the load of a
+    running generator"""
+
+    def __init__(self, rate: float = 1000.0, burst_every: float = 0.0, burst_length: float = 0.5,
+                    burst_factor: float = 5.0, step_interval: float = 0.1, batch_interval: float = 0.005,
+                    model: MarketModel = None, **kwargs):
+        super().__init__(model=model or MarketModel(kwargs.get('price', 20000.0), kwargs.get('dvol', 50.0) / 100), **kwargs)
+        self.rate = rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.burst_factor = burst_factor
+        self.step_interval = step_interval
+        self.batch_interval = batch_interval
+        self.sent = 0
+        self.bodies = {}    # ticker channel: frame without the closing timestamp, rebuilt every step
+        self.handlers['public/set_load'] = self.set_load
+
+    def set_load(self, ws, params: dict) -> dict:
+        for key in ('rate', 'burst_every', 'burst_length', 'burst_factor'):
+            if key in params:
+                setattr(self, key, float(params[key]))
+        return {'rate': self.rate, 'sent': self.sent}
+
+    def current_rate(self, t: float) -> float:
+        if self.burst_every and t % self.burst_every < self.burst_length:
+            return self.rate * self.burst_factor
+        return self.rate
+
+    async def feed(self):
+        start = last_step = last = time.monotonic()
+        budget = 0.0
+        cursor = 0
+
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            now = time.monotonic()
+
+            if now - last_step >= self.step_interval:
+                last_step = now
+                self.step()
+                self.bodies = {}
+                await self.publish_index()
+
+            subs = [(ws, ch) for ws, channels in list(self.clients.items()) for ch in channels if ch.startswith('ticker.')]
+            if not subs:
+                continue
+
+            budget = min(budget + self.current_rate(now - start) * (now - last), len(subs) * 10)
+            last = now
+            now_ms = int(time.time() * 1000)
+            while budget >= 1:
+                ws, channel = subs[cursor % len(subs)]
+                cursor += 1
+                budget -= 1
+                body = self.bodies.get(channel)
+                if body is None:
+                    quote = self.quotes.get(channel.split('.')[1])
+                    if quote is None:
+                        continue
+                    data = json.dumps({k: v for k, v in quote.items() if k != 'timestamp'})
+                    body = self.bodies[channel] = (f'{{"jsonrpc":"2.0","method":"subscription","params":'
+                                                    f'{{"channel":"{channel}","data":{data[:-1]},"timestamp":')
+                try:
+                    await ws.send(f'{body}{now_ms}}}}}}}')
+                    self.sent += 1
+                except websockets.ConnectionClosed:
+                    self.clients.pop(ws, None)
+
+    async def publish_index(self):
+        for ws, channels in list(self.clients.items()):
+            try:
+                for frame in self.frames_for({ch for ch in channels if not ch.startswith('ticker.')}):
+                    await ws.send(frame)
+            except websockets.ConnectionClosed:
+                self.clients.pop(ws, None)
+
+def _serve(queue, kwargs: dict):
+    async def run():
+        ready = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(LoadGenerator(**kwargs).serve(port=0, ready=ready))
+        queue.put(await ready)
+        await task
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run())
+
+def start_generator(**kwargs) -> tuple:
+    """LoadGenerator in a child process, so it does not share the loop under test.
+    Returns (process, url)"""
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(queue, kwargs), name='loadgen', daemon=True)
+    process.start()
+    return process, f'ws://127.0.0.1:{queue.get(timeout=30)}'
+
+async def measure(url: str, rates: list, duration: float = 5.0, warmup: float = 1.0, feed_limit: float = 100.0,
+                    min_ratio: float = 0.95, currency: str = 'BTC', logger: Union[logging.Logger, str, None] = None) -> dict:
+    """Subscribes a Deribit_Exchange to every listed strike of the generator at url and steps
+    through rates. Per step: offered, sent and applied ticker messages per second, exchange to
+    apply (feed) and receive to apply (apply) latency percentiles in ms and the worst loop lag.
+    The ceiling is the highest applied rate of the steps that applied min_ratio of what was
+    sent with a feed p99 below feed_limit ms. Steps where the generator could not send
+    min_ratio of the offer are generator bound, the ceiling is a lower bound then"""
+    from exchange import Deribit_Exchange
+
+    logger = (logging.getLogger(logger) if isinstance(logger,str) else logger)
+    if logger is None:
+        logger = logging.getLogger(__name__)
+
+    exchange = Deribit_Exchange(url={'mock': url}, auth={'mock': {'grant_type': 'client_credentials'}}, env='mock',
+                                currency=currency, logger=logger)
+    odate, put_options, call_options = await exchange.load_expiry()
+    exchange.add_expiry(odate, put_options, call_options)
+    exchange.activate(odate, reset=False)
+
+    tasks = [asyncio.create_task(exchange.fetch_orderbook_data(strike, odate=odate)) for strike in call_options]
+    tasks += [asyncio.create_task(exchange.fetch_deribit_price_index()), asyncio.create_task(exchange.fetch_dvol_index())]
+
+    steps = []
+    async with websockets.connect(url) as control:
+        async def set_load(rate):
+            await control.send(json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': 'public/set_load', 'params': {'rate': rate}}))
+            return json.loads(await control.recv())['result']
+
+        await asyncio.sleep(warmup + len(call_options) * 0.01)
+        for rate in rates:
+            await set_load(rate)
+            await asyncio.sleep(warmup)
+
+            marks = {stage: h.copy() for stage, h in exchange.latency.hists.items()}
+            sent = (await set_load(rate))['sent']
+            lags = []
+            end = time.monotonic() + duration
+            while time.monotonic() < end:
+                start = time.monotonic()
+                await asyncio.sleep(0.05)
+                lags.append(time.monotonic() - start - 0.05)
+
+            sent = (await set_load(rate))['sent'] - sent
+            feed = exchange.latency.hists['feed'].since(marks['feed'])
+            apply = exchange.latency.hists['apply'].since(marks['apply'])
+            steps.append({'rate': rate, 'sent_per_sec': sent / duration, 'applied_per_sec': apply.count / duration,
+                            'feed_p50_ms': feed.percentile(50) / 1e6, 'feed_p99_ms': feed.percentile(99) / 1e6,
+                            'apply_p50_us': apply.percentile(50) / 1e3, 'apply_p99_us': apply.percentile(99) / 1e3,
+                            'loop_lag_max_ms': max(lags) * 1000,
+                            'generator_bound': sent / duration < min_ratio * rate})
+            logger.info(f'{steps[-1]}')
+
+    exchange.keep_alive = False
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    ok = [s for s in steps if s['applied_per_sec'] >= min_ratio * s['sent_per_sec'] and s['feed_p99_ms'] < feed_limit]
+    best = max(ok, key=lambda s: s['applied_per_sec'], default=None)
+    return {'steps': steps, 'ceiling': best['applied_per_sec'] if best else 0.0,
+            'lower_bound': best is not None and best is steps[-1] and best['generator_bound'],
+            'subscriptions': 2 * len(call_options)}
+
+def _measure_profile(queue, profile: str, url: str, rates: list, duration: float, feed_limit: float):
+    from runtime import Runtime, PROFILES
+
+    logging.basicConfig(level=logging.WARNING)
+    runtime = Runtime(**PROFILES[profile])
+    runtime.apply()
+    loop = runtime.new_event_loop()
+    runtime.started()
+    try:
+        queue.put(loop.run_until_complete(measure(url, rates, duration, feed_limit=feed_limit)))
+    finally:
+        loop.close()
+
+def compare_profiles(profiles: list, rates: list, duration: float = 5.0, feed_limit: float = 100.0, **kwargs) -> dict:
+    """measure under each runtime.PROFILES profile, each in a fresh process against a fresh generator"""
+    results = {}
+    for profile in profiles:
+        generator, url = start_generator(rate=0, **kwargs)
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_measure_profile, name=f'measure-{profile}',
+                                            args=(queue, profile, url, rates, duration, feed_limit))
+        process.start()
+        try:
+            results[profile] = queue.get(timeout=len(rates) * (duration + 10) + 60)
+        finally:
+            process.join(5)
+            generator.terminate()
+    return results
+
+def report(res: dict):
+    print(f"{res['subscriptions']} ticker subscriptions")
+    print(f"{'rate':>8} {'sent/s':>9} {'applied/s':>10} {'feed p50':>9} {'feed p99':>9} {'apply p50':>10} {'apply p99':>10} {'loop lag':>9}")
+    for s in res['steps']:
+        print(f"{s['rate']:8.0f} {s['sent_per_sec']:9.0f} {s['applied_per_sec']:10.0f} {s['feed_p50_ms']:7.1f}ms "
+                f"{s['feed_p99_ms']:7.1f}ms {s['apply_p50_us']:8.1f}us {s['apply_p99_us']:8.1f}us {s['loop_lag_max_ms']:7.1f}ms"
+                f"{'  generator bound' if s['generator_bound'] else ''}")
+    print(f"Ingest ceiling: {'>= ' if res['lower_bound'] else ''}{res['ceiling']:.0f} ticker messages/s")
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic ticker load through the mock Deribit server')
+    parser.add_argument('--strikes', type=int, default=41)
+    parser.add_argument('--rates', default='500,1000,2000,5000,10000,20000', help='ticker messages per second')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per rate step')
+    parser.add_argument('--burst-every', type=float, default=0.0, help='seconds between bursts, 0 = no bursts')
+    parser.add_argument('--burst-length', type=float, default=0.5)
+    parser.add_argument('--burst-factor', type=float, default=5.0)
+    parser.add_argument('--feed-limit', type=float, default=100.0, help='feed p99 in ms above which a rate is not sustained')
+    parser.add_argument('--profiles', help='compare runtime profiles, e.g. default,tuned')
+    parser.add_argument('--serve', type=int, default=0, help='only serve the generator on this port')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    kwargs = {'strikes': args.strikes, 'burst_every': args.burst_every, 'burst_length': args.burst_length,
+                'burst_factor': args.burst_factor}
+    if args.serve:
+        logging.basicConfig(level=logging.INFO)
+        asyncio.run(LoadGenerator(**kwargs).serve(port=args.serve))
+        return
+
+    logging.basicConfig(level=logging.WARNING)
+    rates = [float(r) for r in args.rates.split(',')]
+    if args.profiles:
+        res = compare_profiles(args.profiles.split(','), rates, args.duration, args.feed_limit, **kwargs)
+        for profile, profile_res in res.items():
+            print(f'\nProfile {profile}')
+            report(profile_res)
+        print('\n' + ', '.join(f"{p}: {r['ceiling']:.0f}/s" for p, r in res.items()))
+    else:
+        process, url = start_generator(rate=0, **kwargs)
+        try:
+            res = asyncio.run(measure(url, rates, args.duration, feed_limit=args.feed_limit))
+        finally:
+            process.terminate()
+        report(res)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(res, f, indent=2)
+
+if __name__ == '__main__':
+    main()
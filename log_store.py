@@ -0,0 +1,184 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from recorder import read_chunk
+
+# bot_log rows: time, Put/Call, strike, index price, premium, delta, gamma, vega, rho
+LOG_SCHEMA = [('ts', 'i8'), ('is_call', 'i1'), ('strike', 'f8'), ('index', 'f8'), ('premium', 'f8'),
+              ('delta', 'f4'), ('gamma', 'f4'), ('vega', 'f4'), ('rho', 'f4')]
+SIDES = {'Put': 0, 'Call': 1}
+BATCH = 50000
+
+def _write_batch(path: str, rows: list):
+    ts, side, *rest = zip(*rows)
+    cols = [np.array(ts, dtype='datetime64[ms]').astype('i8'), np.array(side, dtype='i1')]
+    cols += [np.array(c, dtype=float) for c in rest]
+
+    for (name, dtype), values in zip(LOG_SCHEMA, cols):
+        with open(os.path.join(path, f'{name}.bin'), 'ab') as f:
+            values.astype(dtype).tofile(f)
+
+def convert_log(src: str, path: str) -> int:
+    """Streams one bot_log CSV into a chunk of typed column files, header and
+    malformed lines are skipped. Returns the number of rows"""
+    os.makedirs(path, exist_ok=True)
+    for name, _ in LOG_SCHEMA:
+        open(os.path.join(path, f'{name}.bin'), 'wb').close()
+    with open(os.path.join(path, 'schema.json'), 'w') as f:
+        json.dump(LOG_SCHEMA, f)
+
+    rows, count = [], 0
+    with open(src, newline='') as f:
+        for line in csv.reader(f):
+            if len(line) != 9 or line[1] not in SIDES:
+                continue
+            try:
+                rows.append((line[0], SIDES[line[1]], *map(float, line[2:])))
+            except ValueError:
+                continue
+
+            if len(rows) == BATCH:
+                _write_batch(path, rows)
+                count += len(rows)
+                rows = []
+
+    if rows:
+        _write_batch(path, rows)
+        count += len(rows)
+
+    return count
+
+class LogStore:
+    """Memory-mapped store of converted bot logs, one chunk per source file.
+    Conversion is incremental: files already converted with the same size and mtime are skipped"""
+
+    def __init__(self, path: str = 'bot_log_store'):
+        self.path = path
+        self.manifest_file = os.path.join(path, 'manifest.json')
+        self.manifest = {}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file) as f:
+                self.manifest = json.load(f)
+        self._chunks = {}
+
+    def add(self, pattern: str) -> int:
+        """Converts the log files matching pattern (e.g. 'bot_log*'), returns the new row count"""
+        added = 0
+        os.makedirs(self.path, exist_ok=True)
+
+        for src in sorted(glob.glob(pattern)):
+            if not os.path.isfile(src):
+                continue
+
+            stat = os.stat(src)
+            name = os.path.basename(src)
+            entry = self.manifest.get(name)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                continue
+
+            chunk = os.path.join(self.path, name.replace('.', '_'))
+            rows = convert_log(src, chunk)
+            added += rows
+
+            ts = np.memmap(os.path.join(chunk, 'ts.bin'), dtype='i8', mode='r') if rows else []
+            self.manifest[name] = {'chunk': os.path.basename(chunk), 'rows': rows, 'size': stat.st_size,
+                                    'mtime': stat.st_mtime, 'first': int(ts[0]) if rows else 0,
+                                    'last': int(ts[-1]) if rows else 0}
+            self._chunks.pop(name, None)
+
+        with open(self.manifest_file, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        return added
+
+    def _chunk(self, name: str) -> dict:
+        if name not in self._chunks:
+            self._chunks[name] = read_chunk(os.path.join(self.path, self.manifest[name]['chunk']))
+        return self._chunks[name]
+
+    def slice(self, start=None, end=None) -> dict:
+        """Columns between start and end (anything pd.Timestamp accepts, UTC), only the
+        overlapping chunks are touched and a single chunk comes back as memmap views"""
+        lo = -np.inf if start is None else pd.Timestamp(start).value // 1_000_000
+        hi = np.inf if end is None else pd.Timestamp(end).value // 1_000_000
+
+        names = sorted((n for n, e in self.manifest.items() if e['rows'] and e['last'] >= lo and e['first'] <= hi),
+                        key=lambda n: self.manifest[n]['first'])
+
+        parts = []
+        for name in names:
+            cols = self._chunk(name)
+            i = np.searchsorted(cols['ts'], lo, 'left') if start is not None else 0
+            j = np.searchsorted(cols['ts'], hi, 'right') if end is not None else len(cols['ts'])
+            parts.append({k: v[i:j] for k, v in cols.items()})
+
+        if not parts:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in LOG_SCHEMA}
+        if len(parts) == 1:
+            return parts[0]
+        return {name: np.concatenate([p[name] for p in parts]) for name, _ in LOG_SCHEMA}
+
+    def resample(self, freq: str = '1min', start=None, end=None, strike: float = None, side: str = None) -> pd.DataFrame:
+        """Per (strike, side, bucket): OHLC of the premium and the last greeks and index"""
+        cols = self.slice(start, end)
+
+        mask = np.ones(len(cols['ts']), dtype=bool)
+        if strike is not None:
+            mask &= cols['strike'] == strike
+        if side is not None:
+            mask &= cols['is_call'] == SIDES[side]
+        cols = {k: np.asarray(v[mask]) for k, v in cols.items()}
+        if not len(cols['ts']):
+            return pd.DataFrame()
+
+        step = pd.Timedelta(freq).value // 1_000_000
+        bucket = cols['ts'] // step * step
+
+        order = np.lexsort((cols['ts'], bucket, cols['is_call'], cols['strike']))
+        key = np.stack([cols['strike'][order], cols['is_call'][order], bucket[order]])
+        starts = np.flatnonzero(np.r_[True, np.any(key[:, 1:] != key[:, :-1], axis=0)])
+        ends = np.r_[starts[1:], len(order)] - 1
+
+        prem = cols['premium'][order]
+        out = {
+            'ts': pd.to_datetime(bucket[order][starts], unit='ms', utc=True),
+            'strike': cols['strike'][order][starts],
+            'side': np.where(cols['is_call'][order][starts] == 1, 'Call', 'Put'),
+            'open': prem[starts],
+            'high': np.maximum.reduceat(prem, starts),
+            'low': np.minimum.reduceat(prem, starts),
+            'close': prem[ends],
+            'ticks': ends - starts + 1
+        }
+        for name in ('index', 'delta', 'gamma', 'vega', 'rho'):
+            out[name] = cols[name][order][ends]
+
+        return pd.DataFrame(out)
+
+    def join_index(self, frame: pd.DataFrame, index: dict) -> pd.DataFrame:
+        """Adds the last index price at or before each row of a resampled frame.
+        index is a {'ts', 'price'} stream, e.g. recorder.read_stream(path, 'index', 'BTC')"""
+        ts = frame['ts'].values.astype('datetime64[ms]').astype('i8')
+        pos = np.searchsorted(index['ts'], ts, 'right') - 1
+        price = np.where(pos >= 0, np.asarray(index['price'])[np.maximum(pos, 0)], np.nan)
+        return frame.assign(index_price=price)
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert bot logs into a memory-mapped store and resample them')
+    parser.add_argument('pattern', nargs='?', default='*bot_log*')
+    parser.add_argument('--store', default='bot_log_store')
+    parser.add_argument('--freq', default='1min')
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    args = parser.parse_args()
+
+    store = LogStore(args.store)
+    print(f'{store.add(args.pattern)} new rows converted')
+    print(store.resample(args.freq, args.start, args.end).to_string(index=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from typing import Callable, Union
+
+from metrics import REGISTRY
+
+LOOP_LAG = REGISTRY.gauge('bot_loop_lag_seconds', 'Event loop lag over the last interval', ('stat',))
+LAG = REGISTRY.histogram('bot_loop_lag', 'Event loop wake up lag')
+STALLS = REGISTRY.counter('bot_loop_stalls_total', 'Times a callback held the loop beyond the threshold')
+STALL_TIME = REGISTRY.histogram('bot_loop_stall_seconds', 'Duration of the loop stalls')
+
+class LoopMonitor:
+    """Heartbeat coroutine plus a watchdog thread. The heartbeat measures how late the loop
+    wakes up from a period sleep. When it has not beaten for threshold seconds the watchdog
+    grabs the stack of the loop thread (sys._current_frames), which shows the coroutine
+    or callback holding the loop, and logs it once per stall"""
+
+    def __init__(self, period: float = 0.05, threshold: float = 0.1, interval: float = 5.0,
+                    logger: Union[logging.Logger, str, None] = None):
+        self.period = period
+        self.threshold = threshold
+        self.interval = interval
+        self.lag = {'avg': 0.0, 'max': 0.0}
+        self.stalls = []    # (time, duration, stack) of the recent stalls
+        self.beat = time.monotonic()
+        self.loop_thread = None
+        self._stop = threading.Event()
+
+        self.logger = (logging.getLogger(logger) if isinstance(logger,str) else logger)
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+
+    def watchdog(self):
+        stall_start, stack = None, None
+
+        while not self._stop.wait(self.threshold / 2):
+            blocked = time.monotonic() - self.beat - self.period
+            if blocked < self.threshold:
+                if stall_start is not None:
+                    self.logger.info(f'Loop stall ended after {time.monotonic() - stall_start:.3f} s')
+                    stall_start = None
+                continue
+
+            if stall_start is None:
+                stall_start = self.beat + self.period
+                frame = sys._current_frames().get(self.loop_thread)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+                STALLS.inc()
+                self.stalls = self.stalls[-19:] + [(time.time(), None, stack)]
+                self.logger.info(f'Loop blocked for {blocked:.3f} s so far, loop thread stack:\n{stack}')
+
+    def stop(self):
+        self._stop.set()
+
+    async def run(self, alive: Callable[[], bool]):
+        """Beats until alive() turns false, the watchdog thread lives as long"""
+        self.loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self._stop.clear()
+        thread = threading.Thread(target=self.watchdog, name='loop-watchdog', daemon=True)
+        thread.start()
+
+        lags = []
+        last_log = time.monotonic()
+        try:
+            while alive():
+                start = time.monotonic()
+                await asyncio.sleep(self.period)
+                now = time.monotonic()
+                self.beat = now
+
+                lag = now - start - self.period
+                lags.append(lag)
+                LAG.observe(lag)
+                if lag >= self.threshold:
+                    STALL_TIME.observe(lag)
+                    if self.stalls and self.stalls[-1][1] is None:
+                        self.stalls[-1] = (self.stalls[-1][0], lag, self.stalls[-1][2])
+
+                if now - last_log >= self.interval:
+                    self.lag = {'avg': sum(lags) / len(lags), 'max': max(lags)}
+                    LOOP_LAG.labels('avg').set(self.lag['avg'])
+                    LOOP_LAG.labels('max').set(self.lag['max'])
+                    self.logger.info(f'Loop lag: avg {self.lag["avg"] * 1000:.2f} ms, max {self.lag["max"] * 1000:.2f} ms')
+                    lags = []
+                    last_log = now
+        finally:
+            self.stop()
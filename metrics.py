@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import math
+import time
+import urllib.parse
+
+from typing import Callable, Union
+
+from latency import Histogram
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+def _num(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Child:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+class Metric:
+    """Base of the registry metrics, children are created per label values and cached"""
+    kind = ''
+
+    def __init__(self, name: str, help: str = '', labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.children = {}
+        if not self.label_names:
+            self.children[()] = self._new()
+
+    def _new(self):
+        return _Child()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._new()
+        return child
+
+    def samples(self):
+        for values, child in self.children.items():
+            yield self.name, _labels(self.label_names, values), child.value
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{name}{labels} {_num(value)}' for name, labels, value in self.samples()]
+        return lines
+
+class _CounterChild(_Child):
+    __slots__ = ()
+
+    def inc(self, n: float = 1):
+        self.value += n
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new(self):
+        return _CounterChild()
+
+    def inc(self, n: float = 1):
+        self.children[()].value += n
+
+class _GaugeChild(_Child):
+    __slots__ = ()
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, n: float = 1):
+        self.value += n
+
+    def dec(self, n: float = 1):
+        self.value -= n
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str = '', labels: tuple = (), func: Callable = None):
+        super().__init__(name, help, labels)
+        self.func = func    # read at scrape time instead of set()
+
+    def _new(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.children[()].value = value
+
+    def inc(self, n: float = 1):
+        self.children[()].value += n
+
+    def dec(self, n: float = 1):
+        self.children[()].value -= n
+
+    def samples(self):
+        if self.func is not None:
+            self.children[()].value = self.func()
+        return super().samples()
+
+# exposition buckets in seconds, the values themselves are kept at ~1.6% resolution
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class HistogramMetric(Metric):
+    """Prometheus histogram over latency.Histogram children recording ns, the
+    cumulative buckets are only built at scrape time"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str = '', labels: tuple = (), buckets: tuple = BUCKETS, source: Callable = None):
+        self.buckets = buckets
+        self.source = source    # returns {label values: Histogram} to export existing histograms
+        super().__init__(name, help, labels)
+
+    def _new(self):
+        return Histogram()
+
+    def record(self, ns: int):
+        self.children[()].record(ns)
+
+    def observe(self, seconds: float):
+        self.children[()].record(int(seconds * 1e9))
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        children = self.source() if self.source is not None else self.children
+
+        for values, hist in children.items():
+            bounds = [int(b * 1e9) for b in self.buckets]
+            cum = [0] * len(bounds)
+            for i, c in enumerate(hist.counts):
+                if c:
+                    upper = hist._value(i)
+                    for j, b in enumerate(bounds):
+                        if upper <= b:
+                            cum[j] += c
+                            break
+
+            seen = 0
+            for b, c in zip(self.buckets, cum):
+                seen += c
+                labels = _labels(self.label_names + ('le',), values + (_num(b),))
+                lines.append(f'{self.name}_bucket{labels} {seen}')
+            labels = _labels(self.label_names + ('le',), values + ('+Inf',))
+            lines.append(f'{self.name}_bucket{labels} {hist.count}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, values)} {_num(hist.total / 1e9)}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, values)} {hist.count}')
+        return lines
+
+class Registry:
+    """In-process metrics, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric: Metric) -> Metric:
+        # modules reloaded or bots restarted in the same process get the existing metric back
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str = '', labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str = '', labels: tuple = (), func: Callable = None) -> Gauge:
+        return self._add(Gauge(name, help, labels, func))
+
+    def histogram(self, name: str, help: str = '', labels: tuple = (), buckets: tuple = BUCKETS,
+                    source: Callable = None) -> HistogramMetric:
+        return self._add(HistogramMetric(name, help, labels, buckets, source))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+class RateCredits:
+    """Local estimate of the Deribit non-matching engine credits: every request costs
+    cost credits, refill credits come back per second up to max_credits"""
+
+    def __init__(self, max_credits: float = 50000, refill: float = 10000, cost: float = 500):
+        self.max_credits = max_credits
+        self.refill = refill
+        self.cost = cost
+        self.credits = max_credits
+        self.last = time.monotonic()
+
+    def spend(self) -> float:
+        now = time.monotonic()
+        self.credits = min(self.max_credits, self.credits + (now - self.last) * self.refill) - self.cost
+        self.last = now
+        return self.credits
+
+    def available(self) -> float:
+        return min(self.max_credits, self.credits + (time.monotonic() - self.last) * self.refill)
+
+async def serve(host: str = '127.0.0.1', port: int = 9108, registry: Registry = REGISTRY,
+                routes: dict = None, logger: Union[logging.Logger, str, None] = None):
+    """Serves registry.render() on GET /metrics until cancelled. routes adds local
+    control commands, {path: callable(query dict) -> text}, a ValueError of the callable
+    is answered with 400 Bad Request"""
+    logger = (logging.getLogger(logger) if isinstance(logger,str) else logger)
+    if logger is None:
+        logger = logging.getLogger(__name__)
+
+    async def handle(reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request.decode().split()
+            path, _, query = parts[1].partition('?') if len(parts) >= 2 and parts[0] == 'GET' else ('', '', '')
+            if path in ('/', '/metrics'):
+                status, body = '200 OK', registry.render().encode()
+            elif routes and path in routes:
+                try:
+                    status, body = '200 OK', (routes[path](dict(urllib.parse.parse_qsl(query))) + '\n').encode()
+                except ValueError as E:
+                    status, body = '400 Bad Request', f'{E}\n'.encode()
+            else:
+                status, body = '404 Not Found', b'not found\n'
+
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except Exception as E:
+            logger.info(f'Error in metrics request: {E}')
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f'Metrics served on http://{host}:{port}/metrics')
+    async with server:
+        await server.serve_forever()
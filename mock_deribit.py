@@ -0,0 +1,510 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import numpy as np
+import websockets
+
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Union, Optional
+
+from clock import Clock, CLOCK
+from scenario import inverse_option_price, norm_cdf, YEAR
+
+SETTLE_HOUR = 8
+PERPETUAL = 'PERPETUAL'
+
+def odate_of(day) -> str:
+    """Expiry code of a date as used in the instrument names, e.g. '5NOV22'"""
+    return day.strftime(f'{day.day}%b%y').upper()
+
+class MockError(Exception):
+
+    def __init__(self, message: str, code: int):
+        super().__init__(message)
+        self.code = code
+
+class MockDeribit:
+    """Local stand-in for the subset of the Deribit JSON-RPC websocket API the bot uses:
+    public/auth, get_instruments, get_index_price, (un)subscribe to the ticker, index and
+    DVOL channels, private buy/sell/edit/cancel/close_position, positions, order history
+    and the account summary.
+    Quotes are Black-76 prices at the DVOL around an index moved by model (dt) -> (index,
+    dvol), a GBM at the DVOL by default, and published every tick_interval seconds of clock.
+    Orders match against the mock book: limits crossing the quote fill at the quote, the
+    rest rests and is matched on later ticks, stop orders trigger on the index. Options
+    settle at 08:00 UTC on their expiry day.
+    latency (+ up to jitter) delays every response, error_rate fails random requests with
+    too_many_requests, fail() queues errors for a method"""
+
+    def __init__(self, currency: str = 'BTC', price: float = 20000.0, dvol: float = 50.0, days: tuple = (1, 2),
+                    strikes: int = 41, strike_step: float = 250.0, spread: float = 0.0005, tick_interval: float = 0.5,
+                    latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, balance: float = 1.0,
+                    model: Optional[Callable] = None, clock: Clock = CLOCK, seed: int = 0,
+                    logger: Union[logging.Logger, str, None] = None):
+        self.currency = currency
+        self.index = price
+        self.dvol = dvol
+        self.days = days
+        self.strikes = strikes
+        self.strike_step = strike_step
+        self.spread = spread
+        self.tick_interval = tick_interval
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.model = model
+        self.clock = clock
+        self.rng = random.Random(seed)
+
+        self.balance = balance
+        self.clients = {}       # websocket: subscribed channels
+        self.instruments = {}   # instrument_name: instrument
+        self.quotes = {}        # instrument_name: ticker data
+        self.orders = {}        # order_id: order
+        self.positions = {}     # instrument_name: position
+        self.trades = []
+        self.failures = {}      # method: [(code, message)]
+        self.order_seq = 0
+        self.trade_seq = 0
+        self.requests = 0
+        self.frames = 0
+        self.last_step = None
+
+        self.logger = (logging.getLogger(logger) if isinstance(logger,str) else logger)
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+
+        self.handlers = {
+            'public/auth': self.auth,
+            'public/get_instruments': self.get_instruments,
+            'public/get_instrument': self.get_instrument,
+            'public/get_index_price': self.get_index_price,
+            'public/subscribe': self.subscribe,
+            'private/subscribe': self.subscribe,
+            'public/unsubscribe': self.unsubscribe,
+            'private/unsubscribe': self.unsubscribe,
+            'public/unsubscribe_all': self.unsubscribe_all,
+            'private/unsubscribe_all': self.unsubscribe_all,
+            'private/buy': lambda ws, params: self.place('buy', params),
+            'private/sell': lambda ws, params: self.place('sell', params),
+            'private/edit': self.edit,
+            'private/cancel': self.cancel,
+            'private/cancel_all': self.cancel_all,
+            'private/cancel_all_by_currency': self.cancel_all,
+            'private/close_position': self.close_position,
+            'private/get_order_state': self.get_order_state,
+            'private/get_open_orders_by_currency': self.get_open_orders,
+            'private/get_open_orders_by_instrument': self.get_open_orders,
+            'private/get_order_history_by_currency': self.get_order_history,
+            'private/get_user_trades_by_currency': self.get_user_trades,
+            'private/get_positions': self.get_positions,
+            'private/get_account_summary': self.get_account_summary
+        }
+
+        self.list_instruments()
+        self.reprice()
+
+    # market
+
+    def list_instruments(self):
+        """Lists the expiries days ahead (and today's until settlement) around the index"""
+        now = self.clock.now()
+        expiries = [now.date() + timedelta(d) for d in self.days]
+        if now.hour < SETTLE_HOUR:
+            expiries.insert(0, now.date())
+
+        atm = self.index - self.index % self.strike_step
+        listed = {}
+        for day in expiries:
+            odate = odate_of(day)
+            expiry = datetime(day.year, day.month, day.day, SETTLE_HOUR, tzinfo=timezone.utc)
+            known = [i for i in self.instruments.values() if i['odate'] == odate]
+            strikes = {i['strike'] for i in known} or \
+                        {atm + self.strike_step * (k - self.strikes // 2) for k in range(self.strikes)}
+            for strike in strikes:
+                if strike <= 0:
+                    continue
+                for option_type in ('put', 'call'):
+                    name = f'{self.currency}-{odate}-{int(strike)}-{option_type[0].upper()}'
+                    listed[name] = {
+                        'instrument_name': name, 'kind': 'option', 'base_currency': self.currency,
+                        'option_type': option_type, 'strike': float(strike), 'odate': odate,
+                        'settlement_period': 'day', 'is_active': True, 'tick_size': 0.0005,
+                        'min_trade_amount': 0.1, 'contract_size': 1.0,
+                        'expiration_timestamp': int(expiry.timestamp() * 1000)
+                    }
+
+        self.instruments = listed
+
+    def reprice(self):
+        """Quotes of every listed option at the current index and DVOL"""
+        now_ms = int(self.clock.time() * 1000)
+        names = list(self.instruments)
+        if names:
+            inst = [self.instruments[n] for n in names]
+            strikes = np.array([i['strike'] for i in inst])
+            is_call = np.array([i['option_type'] == 'call' for i in inst])
+            tau = np.maximum(np.array([i['expiration_timestamp'] for i in inst]) / 1000 - now_ms / 1000, 0) / YEAR
+            vol = self.dvol / 100
+            value = inverse_option_price(self.index, strikes, vol, tau, is_call)
+            sig_t = vol * np.sqrt(np.maximum(tau, 1e-12))
+            d1 = (np.log(self.index / strikes) + 0.5 * sig_t ** 2) / sig_t
+            delta = norm_cdf(d1) - np.where(is_call, 0.0, 1.0)
+            gamma = np.exp(-0.5 * d1 ** 2) / np.sqrt(2 * np.pi) / (self.index * sig_t)
+            vega = self.index * np.exp(-0.5 * d1 ** 2) / np.sqrt(2 * np.pi) * np.sqrt(tau) / 100
+
+            for n, v, d, g, ve in zip(names, value.tolist(), delta.tolist(), gamma.tolist(), vega.tolist()):
+                bid = round(v - self.spread / 2, 4)
+                self.quotes[n] = {
+                    'instrument_name': n, 'timestamp': now_ms, 'state': 'open',
+                    'best_bid_price': bid if bid > 0 else 0.0, 'best_bid_amount': 10.0 if bid > 0 else 0.0,
+                    'best_ask_price': max(round(v + self.spread / 2, 4), 0.0005), 'best_ask_amount': 10.0,
+                    'mark_price': v, 'mark_iv': self.dvol, 'underlying_price': self.index, 'index_price': self.index,
+                    'greeks': {'delta': round(d, 5), 'gamma': round(g, 8), 'vega': round(ve, 5), 'theta': 0.0,
+                                'rho': round(d * 0.01, 5)}
+                }
+
+        perpetual = f'{self.currency}-{PERPETUAL}'
+        self.quotes[perpetual] = {'instrument_name': perpetual, 'timestamp': now_ms, 'mark_price': self.index,
+                                    'best_bid_price': self.index - 0.5, 'best_ask_price': self.index + 0.5,
+                                    'best_bid_amount': 1e6, 'best_ask_amount': 1e6, 'index_price': self.index}
+
+    def step(self):
+        """Moves the market by the clock time since the last step, then settles, matches and reprices"""
+        now = self.clock.monotonic()
+        dt = 0.0 if self.last_step is None else now - self.last_step
+        self.last_step = now
+
+        if self.model is not None:
+            self.index, self.dvol = self.model(dt)
+        elif dt > 0:
+            sigma = self.dvol / 100 * (dt / YEAR) ** 0.5
+            self.index *= float(np.exp(sigma * self.rng.gauss(0, 1) - 0.5 * sigma * sigma))
+
+        self.settle()
+        self.list_instruments()
+        self.reprice()
+        self.match()
+
+    def settle(self):
+        """Cash settles the options past their expiry"""
+        now_ms = self.clock.time() * 1000
+        for name, inst in list(self.instruments.items()):
+            if inst['expiration_timestamp'] > now_ms:
+                continue
+            pos = self.positions.pop(name, None)
+            if pos is not None and pos['size']:
+                payoff = float(inverse_option_price(self.index, inst['strike'], 0.0, 0.0, inst['option_type'] == 'call'))
+                self.balance += pos['size'] * payoff
+                self.logger.info(f'{name} settled at {payoff:.4f}, position {pos["size"]}')
+            for order in [o for o in self.orders.values() if o['instrument_name'] == name and o['order_state'] in ('open', 'untriggered')]:
+                order['order_state'] = 'cancelled'
+            self.quotes.pop(name, None)
+
+    # matching engine
+
+    def best(self, name: str, direction: str) -> float:
+        quote = self.quotes[name]
+        return quote['best_ask_price'] if direction == 'buy' else quote['best_bid_price']
+
+    def fill(self, order: dict, price: float):
+        name, amount = order['instrument_name'], order['amount'] - order['filled_amount']
+        signed = amount if order['direction'] == 'buy' else -amount
+        pos = self.positions.setdefault(name, {'instrument_name': name, 'size': 0.0, 'average_price': 0.0,
+                                                'realized_profit_loss': 0.0,
+                                                'kind': 'future' if name.endswith(PERPETUAL) else 'option'})
+
+        if pos['kind'] == 'option':
+            self.balance -= signed * price
+        elif pos['size'] and (pos['size'] > 0) != (signed > 0):
+            closed = min(abs(signed), abs(pos['size'])) * (1 if pos['size'] > 0 else -1)
+            self.balance += closed * (1 / pos['average_price'] - 1 / price)
+
+        size = pos['size'] + signed
+        if not pos['size'] or (pos['size'] > 0) == (signed > 0):
+            pos['average_price'] = (pos['average_price'] * abs(pos['size']) + price * abs(signed)) / abs(size)
+        elif size and (size > 0) != (pos['size'] > 0):
+            pos['average_price'] = price    # flipped
+        pos['size'] = round(size, 8)
+        if not pos['size']:
+            self.positions.pop(name)
+
+        self.trade_seq += 1
+        trade = {'trade_id': f'MOCK-T{self.trade_seq}', 'order_id': order['order_id'], 'instrument_name': name,
+                    'direction': order['direction'], 'amount': amount, 'price': price, 'label': order['label'],
+                    'timestamp': int(self.clock.time() * 1000)}
+        self.trades.append(trade)
+
+        order['average_price'] = price
+        order['filled_amount'] = order['amount']
+        order['order_state'] = 'filled'
+        order['last_update_timestamp'] = trade['timestamp']
+        return trade
+
+    def try_fill(self, order: dict) -> list:
+        if order['order_state'] == 'untriggered':
+            index = self.index
+            if (order['direction'] == 'buy') == (index >= order['trigger_price']):
+                order['order_state'] = 'open'
+                order['triggered'] = True
+            else:
+                return []
+
+        if order['order_state'] != 'open':
+            return []
+
+        best = self.best(order['instrument_name'], order['direction'])
+        if order['order_type'] in ('market', 'stop_market'):
+            return [self.fill(order, best)] if best > 0 else []
+        if best > 0 and (best <= order['price'] if order['direction'] == 'buy' else best >= order['price']):
+            return [self.fill(order, best)]
+        return []
+
+    def match(self):
+        for order in list(self.orders.values()):
+            if order['order_state'] in ('open', 'untriggered') and order['instrument_name'] in self.quotes:
+                self.try_fill(order)
+
+    def place(self, direction: str, params: dict) -> dict:
+        name = params['instrument_name']
+        if name not in self.quotes:
+            raise MockError('instrument_not_found', 10009 if name.endswith(PERPETUAL) else 13020)
+        amount = float(params['amount'])
+        if amount <= 0:
+            raise MockError('invalid amount', 11044)
+
+        order_type = params.get('type', 'limit')
+        if order_type == 'limit' and 'price' not in params:
+            raise MockError('price required', 11044)
+
+        self.order_seq += 1
+        now_ms = int(self.clock.time() * 1000)
+        order = {
+            'order_id': f'MOCK-{self.order_seq}', 'instrument_name': name, 'direction': direction,
+            'amount': amount, 'filled_amount': 0.0, 'price': float(params.get('price', 0.0)) or 'market_price',
+            'average_price': 0.0, 'order_type': order_type, 'label': params.get('label', ''),
+            'order_state': 'untriggered' if order_type.startswith('stop') else 'open',
+            'trigger': params.get('trigger'), 'trigger_price': params.get('trigger_price'),
+            'reduce_only': params.get('reduce_only', False), 'post_only': params.get('post_only', False),
+            'creation_timestamp': now_ms, 'last_update_timestamp': now_ms
+        }
+        self.orders[order['order_id']] = order
+        trades = self.try_fill(order)
+        return {'order': dict(order), 'trades': trades}
+
+    def order(self, order_id: str) -> dict:
+        if order_id not in self.orders:
+            raise MockError('order_not_found', 11044)
+        return self.orders[order_id]
+
+    def edit(self, ws, params: dict) -> dict:
+        order = self.order(params['order_id'])
+        if order['order_state'] not in ('open', 'untriggered'):
+            raise MockError('not_open_order', 11044)
+        order['amount'] = float(params.get('amount', order['amount']))
+        if 'price' in params:
+            order['price'] = float(params['price'])
+        order['last_update_timestamp'] = int(self.clock.time() * 1000)
+        return {'order': dict(order), 'trades': self.try_fill(order)}
+
+    def cancel(self, ws, params: dict) -> dict:
+        order = self.order(params['order_id'])
+        if order['order_state'] in ('open', 'untriggered'):
+            order['order_state'] = 'cancelled'
+        return dict(order)
+
+    def cancel_all(self, ws, params: dict) -> int:
+        cancelled = 0
+        for order in self.orders.values():
+            if order['order_state'] in ('open', 'untriggered'):
+                order['order_state'] = 'cancelled'
+                cancelled += 1
+        return cancelled
+
+    def close_position(self, ws, params: dict) -> dict:
+        pos = self.positions.get(params['instrument_name'])
+        if pos is None or not pos['size']:
+            raise MockError('no position', 11044)
+        return self.place('sell' if pos['size'] > 0 else 'buy',
+                            {**params, 'amount': abs(pos['size']), 'type': params.get('type', 'market')})
+
+    # queries
+
+    def auth(self, ws, params: dict) -> dict:
+        return {'access_token': 'mock', 'refresh_token': 'mock', 'expires_in': 31536000,
+                'scope': 'account:read_write trade:read_write', 'token_type': 'bearer'}
+
+    def get_instruments(self, ws, params: dict) -> list:
+        self.list_instruments()
+        return [{k: v for k, v in i.items() if k != 'odate'} for i in self.instruments.values()]
+
+    def get_instrument(self, ws, params: dict) -> dict:
+        if params['instrument_name'] not in self.instruments:
+            raise MockError('instrument_not_found', 13020)
+        return {k: v for k, v in self.instruments[params['instrument_name']].items() if k != 'odate'}
+
+    def get_index_price(self, ws, params: dict) -> dict:
+        return {'index_price': self.index, 'estimated_delivery_price': self.index}
+
+    def subscribe(self, ws, params: dict) -> list:
+        channels = list(params.get('channels', []))
+        self.clients.setdefault(ws, set()).update(channels)
+        return channels
+
+    def unsubscribe(self, ws, params: dict) -> list:
+        channels = list(params.get('channels', []))
+        self.clients.get(ws, set()).difference_update(channels)
+        return channels
+
+    def unsubscribe_all(self, ws, params: dict) -> str:
+        self.clients.get(ws, set()).clear()
+        return 'ok'
+
+    def get_order_state(self, ws, params: dict) -> dict:
+        return dict(self.order(params['order_id']))
+
+    def get_open_orders(self, ws, params: dict) -> list:
+        name, kind = params.get('instrument_name'), params.get('type', 'all')
+        return [dict(o) for o in self.orders.values() if o['order_state'] in ('open', 'untriggered')
+                and (name is None or o['instrument_name'] == name) and kind in ('all', '', None, o['order_type'])]
+
+    def get_order_history(self, ws, params: dict) -> list:
+        return [dict(o) for o in reversed(list(self.orders.values())) if o['order_state'] in ('filled', 'cancelled')]
+
+    def get_user_trades(self, ws, params: dict) -> dict:
+        return {'trades': list(reversed(self.trades)), 'has_more': False}
+
+    def mark(self, pos: dict) -> float:
+        """Unrealized value of a position in the currency"""
+        quote = self.quotes.get(pos['instrument_name'])
+        if pos['kind'] == 'option':
+            return pos['size'] * (quote['mark_price'] if quote else 0.0)
+        return pos['size'] * (1 / pos['average_price'] - 1 / self.index)
+
+    def get_positions(self, ws, params: dict) -> list:
+        kind = params.get('kind')
+        return [{**pos, 'direction': 'buy' if pos['size'] > 0 else 'sell', 'floating_profit_loss': self.mark(pos),
+                    'mark_price': self.quotes[pos['instrument_name']]['mark_price']}
+                for pos in self.positions.values() if kind in (None, 'any', pos['kind'])]
+
+    def get_account_summary(self, ws, params: dict) -> dict:
+        equity = self.balance + sum(self.mark(pos) for pos in self.positions.values())
+        initial = sum(abs(pos['size']) * (0.15 + self.quotes[pos['instrument_name']]['mark_price'])
+                        for pos in self.positions.values() if pos['kind'] == 'option' and pos['size'] < 0)
+        initial += sum(abs(pos['size']) / self.index * 0.02 for pos in self.positions.values() if pos['kind'] == 'future')
+        return {'currency': self.currency, 'balance': self.balance, 'equity': equity,
+                'initial_margin': initial, 'maintenance_margin': initial * 0.75,
+                'available_funds': equity - initial, 'margin_balance': equity}
+
+    # transport
+
+    def fail(self, method: str, code: int = 10028, message: str = 'too_many_requests', times: int = 1):
+        """The next times requests of method fail with code"""
+        self.failures.setdefault(method, []).extend([(code, message)] * times)
+
+    def respond(self, ws, raw: str) -> str:
+        us_in = time.time_ns() // 1000
+        request = json.loads(raw)
+        method, params = request.get('method', ''), request.get('params', {})
+        self.requests += 1
+        obj = {'jsonrpc': '2.0', 'id': request.get('id'), 'testnet': True}
+
+        try:
+            if self.failures.get(method):
+                raise MockError(*reversed(self.failures[method].pop(0)))
+            if self.error_rate and self.rng.random() < self.error_rate:
+                raise MockError('too_many_requests', 10028)
+            if method not in self.handlers:
+                raise MockError('Method not found', -32601)
+            obj['result'] = self.handlers[method](ws, params)
+        except MockError as E:
+            obj['error'] = {'message': str(E), 'code': E.code}
+        except (KeyError, ValueError, TypeError) as E:
+            obj['error'] = {'message': f'Invalid params: {E}', 'code': -32602}
+
+        obj['usIn'] = us_in
+        obj['usOut'] = time.time_ns() // 1000
+        obj['usDiff'] = obj['usOut'] - us_in
+        return json.dumps(obj)
+
+    def frames_for(self, channels: set) -> list:
+        frames = []
+        prefix = self.currency.lower()
+        for channel in channels:
+            if channel.startswith('ticker.'):
+                data = self.quotes.get(channel.split('.')[1])
+            elif channel == f'deribit_price_index.{prefix}_usd':
+                data = {'index_name': f'{prefix}_usd', 'price': self.index, 'timestamp': int(self.clock.time() * 1000)}
+            elif channel == f'deribit_volatility_index.{prefix}_usd':
+                data = {'index_name': f'{prefix}_usd', 'volatility': self.dvol, 'timestamp': int(self.clock.time() * 1000)}
+            else:
+                data = None
+            if data is not None:
+                frames.append(json.dumps({'jsonrpc': '2.0', 'method': 'subscription',
+                                            'params': {'channel': channel, 'data': data}}))
+        return frames
+
+    async def publish(self):
+        """Sends the subscribed channels to every client"""
+        for ws, channels in list(self.clients.items()):
+            try:
+                for frame in self.frames_for(channels):
+                    await ws.send(frame)
+                    self.frames += 1
+            except websockets.ConnectionClosed:
+                self.clients.pop(ws, None)
+
+    async def handler(self, ws, path: str = None):
+        """Serves one connection, requests are answered in order after the latency"""
+        self.clients[ws] = set()
+        try:
+            async for raw in ws:
+                if self.latency or self.jitter:
+                    await asyncio.sleep(self.latency + self.jitter * self.rng.random())
+                await ws.send(self.respond(ws, raw))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.clients.pop(ws, None)
+
+    async def feed(self):
+        while True:
+            await self.clock.sleep(self.tick_interval)
+            self.step()
+            await self.publish()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765, ready: Optional[asyncio.Future] = None):
+        """Serves ws://host:port until cancelled, ready gets the bound port"""
+        async with websockets.serve(self.handler, host, port, max_size=None) as server:
+            port = list(server.sockets)[0].getsockname()[1]
+            self.logger.info(f'Mock Deribit on ws://{host}:{port}, {len(self.instruments)} instruments')
+            if ready is not None:
+                ready.set_result(port)
+            await self.feed()
+
+def main():
+    parser = argparse.ArgumentParser(description='Local mock of the Deribit websocket API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--currency', default='BTC')
+    parser.add_argument('--price', type=float, default=20000.0)
+    parser.add_argument('--dvol', type=float, default=50.0)
+    parser.add_argument('--tick-interval', type=float, default=0.5)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests failing with too_many_requests')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s [%(levelname)s]: %(message)s')
+    mock = MockDeribit(args.currency, args.price, args.dvol, tick_interval=args.tick_interval, latency=args.latency,
+                        jitter=args.jitter, error_rate=args.error_rate)
+    try:
+        asyncio.run(mock.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import asyncio
+import collections
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+
+from datetime import datetime, timezone
+from typing import Union, Optional
+
+class Profiler:
+    """On-demand profiler, nothing runs until start is called from SIGUSR1, the
+    /profile route of the metrics server or code.
+    mode 'sample' walks the stacks of every thread each interval for seconds and writes
+    folded stacks (flamegraph.pl, speedscope) plus a dump of the pending asyncio tasks.
+    mode 'cprofile' runs the deterministic profiler on the loop thread and writes a
+    pstats file and its text summary. Files go to path, next to the logs"""
+
+    def __init__(self, path: str = '.', seconds: float = 30.0, interval: float = 0.005,
+                    logger: Union[logging.Logger, str, None] = None):
+        self.path = path
+        self.seconds = seconds
+        self.interval = interval
+        self.loop = None
+        self.running = False
+
+        self.logger = (logging.getLogger(logger) if isinstance(logger,str) else logger)
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+
+    def install(self, loop: asyncio.AbstractEventLoop, sig: int = getattr(signal, 'SIGUSR1', None)):
+        """Starts a sample profile on sig, e.g. docker exec <container> kill -USR1 1"""
+        self.loop = loop
+        if sig is None:
+            return
+        try:
+            loop.add_signal_handler(sig, self.start)
+        except (NotImplementedError, RuntimeError) as E:
+            self.logger.info(f'Profiler signal handler not installed: {E}')
+
+    def _filename(self, ext: str) -> str:
+        os.makedirs(self.path, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+        return os.path.join(self.path, f'profile-{stamp}.{ext}')
+
+    def start(self, seconds: Optional[float] = None, mode: str = 'sample') -> str:
+        if self.running:
+            return 'Profiler already running'
+        seconds = self.seconds if seconds is None else seconds
+
+        if mode == 'sample':
+            self.running = True
+            threading.Thread(target=self._sample, args=(seconds,), name='profiler', daemon=True).start()
+        elif mode == 'cprofile':
+            if self.loop is None:
+                return 'cprofile mode needs install(loop) first'
+            self.running = True
+            prof = cProfile.Profile()
+            self.loop.call_soon_threadsafe(prof.enable)
+            self.loop.call_soon_threadsafe(self.loop.call_later, seconds, self._stop_cprofile, prof)
+        else:
+            return f'Unknown profiler mode: {mode}'
+
+        self.logger.info(f'Profiler started: {mode} for {seconds} s')
+        return f'Profiling {mode} for {seconds} s'
+
+    @staticmethod
+    def _fold(frame) -> list:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return stack[::-1]
+
+    def _sample(self, seconds: float):
+        counts = collections.Counter()
+        me = threading.get_ident()
+        end = time.monotonic() + seconds
+        samples = 0
+
+        try:
+            while time.monotonic() < end:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for tid, frame in sys._current_frames().items():
+                    if tid == me:
+                        continue
+                    counts[';'.join([names.get(tid, str(tid))] + self._fold(frame))] += 1
+                samples += 1
+                time.sleep(self.interval)
+
+            filename = self._filename('folded')
+            with open(filename, 'w') as f:
+                for stack, count in counts.most_common():
+                    f.write(f'{stack} {count}\n')
+            self.logger.info(f'Profiler wrote {samples} samples to {filename}')
+
+            if self.loop is not None and self.loop.is_running():
+                self.loop.call_soon_threadsafe(self._dump_tasks, filename[:-len('folded')] + 'tasks.txt')
+        finally:
+            self.running = False
+
+    def _dump_tasks(self, filename: str):
+        """Where each pending asyncio task is suspended, runs on the loop"""
+        with open(filename, 'w') as f:
+            for task in asyncio.all_tasks(self.loop):
+                f.write(f'{task.get_name()} {task.get_coro()}\n')
+                out = io.StringIO()
+                task.print_stack(file=out)
+                f.write(out.getvalue() + '\n')
+
+    def _stop_cprofile(self, prof: cProfile.Profile):
+        prof.disable()
+        try:
+            filename = self._filename('prof')
+            prof.dump_stats(filename)
+            with open(filename[:-len('prof')] + 'txt', 'w') as f:
+                pstats.Stats(prof, stream=f).sort_stats('cumulative').print_stats(60)
+            self.logger.info(f'Profiler wrote {filename}')
+        finally:
+            self.running = False
+
+    def route(self, query: dict) -> str:
+        """/profile?seconds=N&mode=sample|cprofile of the metrics server.
+        Raises ValueError (400 Bad Request) unless seconds is a positive number"""
+        seconds = None
+        if 'seconds' in query:
+            try:
+                seconds = float(query['seconds'])
+            except ValueError:
+                seconds = float('nan')
+            if not 0 < seconds < float('inf'):
+                raise ValueError(f'seconds must be a positive number, got {query["seconds"]}')
+        return self.start(seconds, query.get('mode', 'sample'))
@@ -0,0 +1,201 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+from datetime import datetime, timezone
+from typing import Union
+
+# Column layouts per stream, ts is the exchange timestamp in ms
+SCHEMAS = {
+    'chain': [('ts', 'i8'), ('strike', 'f8'), ('is_call', 'i1'), ('bid', 'f8'), ('ask', 'f8'),
+              ('bid_amt', 'f4'), ('ask_amt', 'f4'), ('delta', 'f4'), ('gamma', 'f4'),
+              ('vega', 'f4'), ('rho', 'f4'), ('mark_iv', 'f4')],
+    'index': [('ts', 'i8'), ('price', 'f8')],
+    'dvol':  [('ts', 'i8'), ('volatility', 'f4')]
+}
+
+def chunk_hour(ts_ms: int) -> str:
+    return datetime.fromtimestamp(ts_ms / 1000, timezone.utc).strftime('%Y%m%d%H')
+
+def chunk_dirs(root: str, stream: str, key: str) -> list:
+    """Chunk directories of a stream/key, oldest first"""
+    return sorted(glob.glob(os.path.join(root, stream, key, '[0-9]' * 10)))
+
+def read_chunk(path: str, mmap: bool = True) -> dict:
+    """Loads the columns of one chunk directory. Raw columns are memory-mapped
+    (read-only) when mmap is set, compressed ones are decompressed into memory"""
+    with open(os.path.join(path, 'schema.json')) as f:
+        schema = json.load(f)
+
+    cols = {}
+    for name, dtype in schema:
+        raw = os.path.join(path, f'{name}.bin')
+        parts = []
+
+        # a compressed chunk reopened after a restart has both files
+        if os.path.exists(raw + '.gz'):
+            with gzip.open(raw + '.gz', 'rb') as f:
+                parts.append(np.frombuffer(f.read(), dtype=dtype))
+
+        if os.path.exists(raw) and os.path.getsize(raw) > 0:
+            if mmap and not parts:
+                parts.append(np.memmap(raw, dtype=dtype, mode='r'))
+            else:
+                parts.append(np.fromfile(raw, dtype=dtype))
+
+        cols[name] = parts[0] if len(parts) == 1 else np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+    # a chunk being written may have columns of different length, cut to the shortest
+    n = min(len(c) for c in cols.values())
+    return {name: c[:n] for name, c in cols.items()}
+
+def read_stream(root: str, stream: str, key: str, start_ms: int = None, end_ms: int = None,
+                mmap: bool = True) -> dict:
+    """Concatenates the chunks of a stream/key between start_ms and end_ms, in arrival order.
+    ts is not sorted (chain ticks of many listeners interleave, late ticks go to the open
+    chunk), so the rows are selected with a mask and the hour after end_ms is read too"""
+    first = None if start_ms is None else chunk_hour(start_ms)
+    last = None if end_ms is None else chunk_hour(end_ms + 3600 * 1000)
+
+    parts = []
+    for path in chunk_dirs(root, stream, key):
+        hour = os.path.basename(path)
+        if (first and hour < first) or (last and hour > last):
+            continue
+        parts.append(read_chunk(path, mmap))
+
+    names = [name for name, _ in SCHEMAS[stream]]
+    if not parts:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in SCHEMAS[stream]}
+
+    cols = parts[0] if len(parts) == 1 else {n: np.concatenate([p[n] for p in parts]) for n in names}
+
+    if start_ms is None and end_ms is None:
+        return {n: cols[n] for n in names}
+
+    ts = cols['ts']
+    mask = np.ones(len(ts), dtype=bool)
+    if start_ms is not None:
+        mask &= ts >= start_ms
+    if end_ms is not None:
+        mask &= ts <= end_ms
+    return {n: cols[n][mask] for n in names}
+
+class TickRecorder:
+    """Appends chain, index and DVOL ticks to typed column files, one directory per
+    stream, key (expiry or currency) and UTC hour: {path}/{stream}/{key}/{YYYYmmddHH}/{column}.bin
+    The event loop only enqueues tuples; a background thread batches and writes them.
+    When the bounded queue is full ticks are dropped and counted, never blocking the caller.
+    Closed chunks are gzipped when compress is set"""
+
+    def __init__(self, path: str = 'ticks', compress: bool = False, max_buffer: int = 100000,
+                    flush_interval: float = 1.0, logger: Union[logging.Logger, str, None] = None):
+
+        self.path = path
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0
+
+        self.logger = (logging.getLogger(logger) if isinstance(logger,str) else logger)
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+
+        self._queue = queue.Queue(maxsize=max_buffer)
+        self._open = {}     # (stream, key) -> current chunk hour
+        self._thread = threading.Thread(target=self._run, name='tick-recorder', daemon=True)
+        self._thread.start()
+
+    def record(self, stream: str, key: str, row: tuple):
+        """Queues a row in SCHEMAS[stream] column order"""
+        try:
+            self._queue.put_nowait((stream, key, row))
+        except queue.Full:
+            self.dropped += 1
+
+    def record_quote(self, odate: str, strike: float, is_call: bool, ts: int, quote: dict):
+        self.record('chain', odate, (ts, strike, is_call, quote['bid'], quote['ask'],
+                    quote['bid_amt'], quote['ask_amt'], quote['delta'], quote['gamma'],
+                    quote['vega'], quote['rho'], quote['mark_iv']))
+
+    def close(self):
+        """Flushes the pending ticks and closes all chunks"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        pending = {}
+        last_flush = time.monotonic()
+        stop = False
+
+        while not stop:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = False
+
+            if item is None:
+                stop = True
+            elif item:
+                stream, key, row = item
+                pending.setdefault((stream, key, chunk_hour(row[0])), []).append(row)
+
+            if stop or time.monotonic() - last_flush >= self.flush_interval:
+                try:
+                    self._flush(pending)
+                except Exception as E:
+                    self.logger.info(f'Error in tick recorder: {E}')
+                pending = {}
+                last_flush = time.monotonic()
+
+        for (stream, key), hour in list(self._open.items()):
+            self._close_chunk(stream, key, hour)
+
+    def _flush(self, pending: dict):
+        for (stream, key, hour), rows in sorted(pending.items(), key=lambda p: p[0][2]):
+            prev = self._open.get((stream, key))
+            if prev is not None and hour < prev:
+                hour = prev     # late tick, keep it in the open chunk
+            if prev is not None and prev != hour:
+                self._close_chunk(stream, key, prev)
+
+            path = os.path.join(self.path, stream, key, hour)
+            if prev != hour:
+                os.makedirs(path, exist_ok=True)
+                with open(os.path.join(path, 'schema.json'), 'w') as f:
+                    json.dump(SCHEMAS[stream], f)
+                self._open[(stream, key)] = hour
+
+            # all columns of a batch or none, a failed write is cut back so the columns stay aligned
+            arrays = [(os.path.join(path, f'{name}.bin'), np.array(values, dtype=dtype))
+                        for (name, dtype), values in zip(SCHEMAS[stream], zip(*rows))]
+            sizes = [os.path.getsize(raw) if os.path.exists(raw) else 0 for raw, _ in arrays]
+            try:
+                for raw, values in arrays:
+                    with open(raw, 'ab') as f:
+                        values.tofile(f)
+            except Exception:
+                for (raw, _), size in zip(arrays, sizes):
+                    if os.path.exists(raw):
+                        os.truncate(raw, size)
+                raise
+
+            self.written += len(rows)
+
+    def _close_chunk(self, stream: str, key: str, hour: str):
+        self._open.pop((stream, key), None)
+        if not self.compress:
+            return
+
+        path = os.path.join(self.path, stream, key, hour)
+        for name, _ in SCHEMAS[stream]:
+            raw = os.path.join(path, f'{name}.bin')
+            with open(raw, 'rb') as src, gzip.open(raw + '.gz', 'ab') as dst:
+                dst.write(src.read())
+            os.remove(raw)
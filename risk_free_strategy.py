@@ -1,6 +1,7 @@
-import pandas as pd
 import numpy as np
 
+# pandas is imported inside the DataFrame based strategies, the trading path does not load it
+
 put_label = ['bid_p', 'ask_p']
 call_label = ['bid_c', 'ask_c']
 csv_label = ['strike', 'Call', 'Put']
@@ -49,6 +50,7 @@ def dist_1500(data, put_options, call_options, price):
     return data
 
 def delta_10_20(data, put_options, call_options, price):
+    import pandas as pd
 
     activated = False
     # create put/call dataframes and check if empty
@@ -77,6 +79,7 @@ def delta_10_20(data, put_options, call_options, price):
     return activated, data
 
 def delta_2nd_max(data, put_options, call_options, price):
+    import pandas as pd
 
     df_put_bk = pd.DataFrame(put_options.values())
     df_put_bk.set_index('strike', inplace=True, drop=False)
@@ -127,23 +130,12 @@ def sell_008_premium_2k_dist(put_options, call_options, price, min_prem, strike_
     data = []
     sum_premium = 0
 
-    # create put/call dataframes and check if empty
-    df_put_bk = pd.DataFrame(put_options.values())
-    df_put_bk.set_index('strike', inplace=True, drop=False)
-    df_put = df_put_bk[df_put_bk['delta'] >= -0.2]
-    # df_put = df_put_bk[(df_put_bk['delta'] <= -0.1) & (df_put_bk['delta'] >= -0.2)]
+    # lowest put delta >= -0.2 and highest call delta <= 0.2, the first strike wins ties.
+    # Plain dict scans, building DataFrames here cost more than the whole selection
+    df_put = min((p for p in put_options.values() if p['delta'] >= -0.2), key=lambda p: p['delta'], default=None)
+    df_call = max((c for c in call_options.values() if c['delta'] <= 0.2), key=lambda c: c['delta'], default=None)
 
-    df_call_bk = pd.DataFrame(call_options.values())
-    df_call_bk.set_index('strike', inplace=True, drop=False)
-    df_call = df_call_bk[df_call_bk['delta'] <= 0.2]
-    # df_call = df_call_bk[(df_call_bk['delta'] >= 0.1) & (df_call_bk['delta'] <= 0.2)]
-
-    if not df_put.empty and not df_call.empty:
-        pmin = df_put['delta'].values.argmin()
-        cmax = df_call['delta'].values.argmax()
-
-        df_put = df_put.iloc[pmin]
-        df_call = df_call.iloc[cmax]
+    if df_put is not None and df_call is not None:
 
         sum_premium = df_put['bid'] + df_call['bid']
         sum_premium_ask = df_put['ask'] + df_call['ask']
@@ -188,21 +180,11 @@ def test(put_options, call_options, price):
     data = []
     sum_premium = 0
 
-    # create put/call dataframes and check if empty
-    df_put_bk = pd.DataFrame(put_options.values())
-    df_put_bk.set_index('strike', inplace=True, drop=False)
-    df_put = df_put_bk[df_put_bk['delta'] >= -0.2]
+    # same selection as sell_008_premium_2k_dist
+    df_put = min((p for p in put_options.values() if p['delta'] >= -0.2), key=lambda p: p['delta'], default=None)
+    df_call = max((c for c in call_options.values() if c['delta'] <= 0.2), key=lambda c: c['delta'], default=None)
 
-    df_call_bk = pd.DataFrame(call_options.values())
-    df_call_bk.set_index('strike', inplace=True, drop=False)
-    df_call = df_call_bk[df_call_bk['delta'] <= 0.2]
-
-    if not df_put.empty and not df_call.empty:
-        pmin = df_put['delta'].values.argmin()
-        cmax = df_call['delta'].values.argmax()
-
-        df_put = df_put.iloc[pmin]
-        df_call = df_call.iloc[cmax]
+    if df_put is not None and df_call is not None:
 
         sum_premium = df_put['bid'] + df_call['bid']
         # if sum_premium >= 0.008 and abs(df_call['strike'] - df_put['strike']) >= 2000:
@@ -218,6 +200,8 @@ def test(put_options, call_options, price):
     return (data, str(sum_premium))
 
 def collar_strategy(put_options, call_options, price):
+    import pandas as pd
+
     styk_interval = 500
     prob = 0.5
 
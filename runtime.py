@@ -0,0 +1,93 @@
+import asyncio
+import gc
+import logging
+import os
+import sys
+import time
+import websockets
+
+from typing import Optional, Union
+
+IMPORTED = time.monotonic()
+
+# keyword arguments of every websockets.connect made through connect, set by Runtime.apply
+WS_OPTIONS = {}
+
+# profiles compared by python loadgen.py --profiles default,tuned
+PROFILES = {
+    'default': {'loop': 'asyncio', 'compression': 'deflate', 'max_size': 1 << 20, 'write_limit': 1 << 15,
+                'gc_freeze': False},
+    'tuned': {'loop': 'auto', 'compression': None, 'max_size': 1 << 22, 'write_limit': 1 << 16,
+                'gc_freeze': True, 'gc_threshold': (50000, 20, 20)}
+}
+
+def process_age() -> float:
+    """Seconds since the process started, from /proc on Linux, elsewhere since this module was imported"""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - IMPORTED
+
+def connect(url: str, **kwargs):
+    """websockets.connect with the options of the runtime profile, works with async with
+    and with async for (reconnecting)"""
+    return websockets.connect(url, **{**WS_OPTIONS, **kwargs})
+
+class Runtime:
+    """Runtime profile of the process.
+    loop: 'uvloop', 'asyncio' or 'auto' (uvloop when installed).
+    compression, max_size, max_queue and write_limit go to every websocket connection,
+    Deribit frames are small JSON where permessage-deflate costs more CPU than it saves.
+    gc_freeze moves everything allocated during startup (modules, instruments, chain) out
+    of the collected generations once the bot runs, gc_threshold sets the collection
+    thresholds and switch_interval the GIL switch interval for the helper threads"""
+
+    def __init__(self, loop: str = 'auto', compression: Optional[str] = None, max_size: Optional[int] = 1 << 22,
+                    max_queue: Optional[int] = 16, write_limit: int = 1 << 16, gc_freeze: bool = True,
+                    gc_threshold: Optional[tuple] = None, switch_interval: Optional[float] = None,
+                    logger: Union[logging.Logger, str, None] = None):
+        self.loop = loop
+        self.ws_options = {'compression': compression, 'max_size': max_size, 'max_queue': max_queue,
+                            'write_limit': write_limit}
+        self.gc_freeze = gc_freeze
+        self.gc_threshold = gc_threshold
+        self.switch_interval = switch_interval
+        self.frozen = False
+
+        self.logger = (logging.getLogger(logger) if isinstance(logger,str) else logger)
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+
+    def apply(self):
+        """Sets the websocket options and the interpreter settings, call before connecting"""
+        WS_OPTIONS.clear()
+        WS_OPTIONS.update(self.ws_options)
+        if self.gc_threshold:
+            gc.set_threshold(*self.gc_threshold)
+        if self.switch_interval:
+            sys.setswitchinterval(self.switch_interval)
+        self.logger.info(f'Runtime: websocket {WS_OPTIONS}, gc threshold {gc.get_threshold()}, '
+                            f'switch interval {sys.getswitchinterval()}')
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        if self.loop in ('auto', 'uvloop'):
+            try:
+                import uvloop
+                self.logger.info('Runtime: uvloop event loop')
+                return uvloop.new_event_loop()
+            except ImportError:
+                if self.loop == 'uvloop':
+                    self.logger.info('Runtime: uvloop not installed, using the asyncio event loop')
+        return asyncio.new_event_loop()
+
+    def started(self):
+        """Freezes the startup objects once, later calls do nothing"""
+        if self.gc_freeze and not self.frozen:
+            gc.collect()
+            gc.freeze()
+            self.frozen = True
+            self.logger.info(f'Runtime: {gc.get_freeze_count()} startup objects frozen')
@@ -0,0 +1,90 @@
+import numpy as np
+
+from datetime import datetime, timezone
+
+# Default grid: spot -20%..+20% in 1% steps, vol -25..+25 vol points in 5 pt steps
+SPOT_MOVES = np.linspace(-0.2, 0.2, 41)
+VOL_SHIFTS = np.linspace(-0.25, 0.25, 11)
+
+MIN_VOL = 0.01
+YEAR = 365.0 * 24 * 3600
+
+def norm_cdf(x):
+    """Vectorized standard normal CDF (Abramowitz-Stegun 7.1.26, abs error < 1.5e-7)"""
+    z = np.abs(x) / np.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1.0 - poly * np.exp(-z * z)
+    return 0.5 * (1.0 + np.sign(x) * erf)
+
+def inverse_option_price(spot, strike, vol, tau, is_call):
+    """Black-76 price of a Deribit (inverse) option in units of the underlying, r = 0.
+    All arguments broadcast against each other"""
+    spot = np.asarray(spot, dtype=float)
+    intrinsic = np.where(is_call, np.maximum(spot - strike, 0.0), np.maximum(strike - spot, 0.0))
+
+    if np.all(tau <= 0):
+        return intrinsic / spot
+
+    sig_t = np.maximum(vol, MIN_VOL) * np.sqrt(np.maximum(tau, 1e-12))
+    d1 = (np.log(spot / strike) + 0.5 * sig_t * sig_t) / sig_t
+    d2 = d1 - sig_t
+
+    call = spot * norm_cdf(d1) - strike * norm_cdf(d2)
+    put = call - spot + strike
+    usd = np.where(tau > 0, np.where(is_call, call, put), intrinsic)
+
+    return usd / spot
+
+def expiry_tau(odate: str, now: datetime = None, settle_hour: int = 8) -> float:
+    """Year fraction left until the 08:00 UTC settlement of odate (e.g. '20OCT22')"""
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    expiry = datetime.strptime(odate, '%d%b%y').replace(hour=settle_hour, tzinfo=timezone.utc)
+    return max((expiry - now).total_seconds(), 0.0) / YEAR
+
+def book_arrays(positions: dict, put_options: dict, call_options: dict):
+    """Builds position arrays (strike, is_call, size, vol) from {instrument_name: signed size}
+    of one expiry and the live chain of that expiry. Instruments not found in the chain are skipped"""
+    strikes, is_call, sizes, vols = [], [], [], []
+
+    for name, size in positions.items():
+        if not size:
+            continue
+
+        _, _, strike, order_type = name.split('-')
+        options = put_options if order_type == 'P' else call_options
+        instr = options.get(float(strike))
+        if instr is None:
+            continue
+
+        strikes.append(float(strike))
+        is_call.append(order_type == 'C')
+        sizes.append(float(size))
+        vols.append(instr.get('mark_iv', np.nan) / 100)
+
+    return np.array(strikes), np.array(is_call, dtype=bool), np.array(sizes), np.array(vols)
+
+def scenario_grid(strikes, is_call, sizes, vols, price, tau, horizon: float = 0.0,
+                    spot_moves = SPOT_MOVES, vol_shifts = VOL_SHIFTS, fallback_vol: float = 0.6):
+    """Reprices the positions on a spot move x vol shift grid.
+    Returns the PnL surface in BTC with shape (len(spot_moves), len(vol_shifts))
+    and the worst loss across the grid (<= 0). horizon is the year fraction the book
+    is rolled forward by; tau - horizon <= 0 prices at settlement. tau and horizon are
+    scalars or per position arrays"""
+
+    if len(strikes) == 0:
+        return np.zeros((len(spot_moves), len(vol_shifts))), 0.0
+
+    vols = np.where(np.isnan(vols), fallback_vol, vols)
+
+    now_value = inverse_option_price(price, strikes, vols, tau, is_call)
+
+    # (spot, vol, position)
+    spot = price * (1.0 + spot_moves)[:, None, None]
+    vol = vols[None, None, :] + vol_shifts[None, :, None]
+    scen_value = inverse_option_price(spot, strikes, vol, tau - horizon, is_call)
+
+    pnl = ((scen_value - now_value) * sizes).sum(axis=2)
+    return pnl, min(float(pnl.min()), 0.0)
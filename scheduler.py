@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import math
+
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Union
+
+from clock import Clock, CLOCK
+
+def _field(spec: str, low: int, high: int) -> frozenset:
+    values = set()
+    for part in spec.split(','):
+        rng, _, step = part.partition('/')
+        if rng == '*':
+            start, stop = low, high
+        elif '-' in rng:
+            start, stop = map(int, rng.split('-'))
+        else:
+            start = stop = int(rng)
+        values.update(range(start, stop + 1, int(step) if step else 1))
+    return frozenset(values)
+
+class Cron:
+    """UTC cron expression 'minute hour day month weekday' with *, a-b, a,b and */n.
+    weekday 0 is Sunday"""
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression needs 5 fields: {expr}')
+
+        self.expr = expr
+        self.minutes = _field(fields[0], 0, 59)
+        self.hours = _field(fields[1], 0, 23)
+        self.days = _field(fields[2], 1, 31)
+        self.months = _field(fields[3], 1, 12)
+        self.weekdays = _field(fields[4], 0, 6)
+
+    def next_after(self, ts: float) -> float:
+        """Unix time of the first match strictly after ts"""
+        dt = datetime.fromtimestamp(ts, timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif dt.day not in self.days or (dt.weekday() + 1) % 7 not in self.weekdays:
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+
+        raise ValueError(f'Cron expression never matches: {self.expr}')
+
+class TimerWheel:
+    """Hashed timer wheel on the monotonic clock. add and cancel are O(1), advance
+    only looks at the slots of the ticks that passed"""
+
+    def __init__(self, tick: float = 0.1, slots: int = 1024, now: float = 0.0):
+        self.tick = tick
+        self.slots = slots
+        self.wheel = [[] for _ in range(slots)]
+        self.origin = now
+        self.current = 0
+
+    def add(self, deadline: float, callback: Callable) -> list:
+        """Fires callback() at the first tick at or after the monotonic deadline.
+        Returns the timer, cancel by setting timer[2] = True"""
+        t = max(math.ceil((deadline - self.origin) / self.tick), self.current + 1)
+        timer = [t, callback, False]
+        self.wheel[t % self.slots].append(timer)
+        return timer
+
+    def advance(self, now: float) -> int:
+        target = int((now - self.origin) / self.tick)
+        if target <= self.current:
+            return 0
+
+        # after a long pause every slot is due at most once
+        ticks = range(self.current + 1, target + 1) if target - self.current < self.slots else range(self.slots)
+        due = []
+        for t in ticks:
+            slot = self.wheel[t % self.slots]
+            if slot:
+                keep = [timer for timer in slot if timer[0] > target]
+                if len(keep) != len(slot):
+                    due += [timer for timer in slot if timer[0] <= target]
+                    self.wheel[t % self.slots] = keep
+        self.current = target
+
+        due.sort(key=lambda timer: timer[0])
+        for timer in due:
+            if not timer[2]:
+                timer[1]()
+        return len(due)
+
+class HourRegime:
+    """UTC hour flags for the strategies and order gating. The hour is computed once per
+    hour (the scheduler refreshes it on the boundary), reading it is a monotonic check"""
+
+    __slots__ = ('expire_time', 'clock', 'hour', 'after_expire', 'valid_until')
+
+    def __init__(self, expire_time: int = 7, clock: Clock = CLOCK):
+        self.expire_time = expire_time
+        self.clock = clock
+        self.update()
+
+    def update(self):
+        now = self.clock.time()
+        self.hour = datetime.fromtimestamp(now, timezone.utc).hour
+        self.after_expire = self.hour >= self.expire_time
+        self.valid_until = self.clock.monotonic() + 3600 - now % 3600
+
+    def current(self) -> 'HourRegime':
+        if self.clock.monotonic() >= self.valid_until:
+            self.update()
+        return self
+
+class Scheduler:
+    """Central timer for the time based behaviour: interval jobs, UTC cron jobs and
+    sleeps until a cron time, all on one timer wheel driven by run()"""
+
+    def __init__(self, tick: float = 0.1, clock: Clock = CLOCK, logger: Union[logging.Logger, str, None] = None):
+        self.clock = clock
+        self.wheel = TimerWheel(tick, now=clock.monotonic())
+        self.jobs = {}
+        self.sleeps = set()
+
+        self.logger = (logging.getLogger(logger) if isinstance(logger,str) else logger)
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+
+    def _fire(self, name: str, callback: Callable):
+        try:
+            if asyncio.iscoroutinefunction(callback):
+                asyncio.get_running_loop().create_task(callback())
+            else:
+                callback()
+        except Exception as E:
+            self.logger.info(f'Error in scheduled job {name}: {E}')
+
+    def next_delay(self, cron: Union[Cron, str]) -> float:
+        """Seconds until the next cron time"""
+        cron = Cron(cron) if isinstance(cron, str) else cron
+        now = self.clock.time()
+        return cron.next_after(now) - now
+
+    def every(self, seconds: float, callback: Callable, name: str):
+        """Runs callback every seconds, replacing the job of the same name"""
+        def run():
+            if self.jobs.get(name) is not timer:
+                return
+            self.every(seconds, callback, name)
+            self._fire(name, callback)
+
+        self.cancel(name)
+        timer = self.wheel.add(self.clock.monotonic() + seconds, run)
+        self.jobs[name] = timer
+
+    def cron(self, cron: Union[Cron, str], callback: Callable, name: str):
+        """Runs callback at every UTC cron time, replacing the job of the same name"""
+        cron = Cron(cron) if isinstance(cron, str) else cron
+
+        def run():
+            if self.jobs.get(name) is not timer:
+                return
+            self.cron(cron, callback, name)
+            self._fire(name, callback)
+
+        self.cancel(name)
+        timer = self.wheel.add(self.clock.monotonic() + self.next_delay(cron), run)
+        self.jobs[name] = timer
+
+    def cancel(self, name: str):
+        timer = self.jobs.pop(name, None)
+        if timer is not None:
+            timer[2] = True
+
+    async def sleep_until(self, cron: Union[Cron, str]):
+        """Sleeps until the next cron time, or until run() ends"""
+        future = asyncio.get_running_loop().create_future()
+        timer = self.wheel.add(self.clock.monotonic() + self.next_delay(cron),
+                                lambda: future.done() or future.set_result(None))
+        self.sleeps.add(future)
+        try:
+            await future
+        finally:
+            timer[2] = True
+            self.sleeps.discard(future)
+
+    async def run(self, alive: Callable[[], bool]):
+        """Advances the wheel every tick until alive() turns false, then wakes the pending sleeps"""
+        try:
+            while alive():
+                self.wheel.advance(self.clock.monotonic())
+                await asyncio.sleep(max(self.clock.real(self.wheel.tick), 0.001))
+        finally:
+            for future in self.sleeps:
+                if not future.done():
+                    future.set_result(None)
@@ -0,0 +1,137 @@
+import numpy as np
+
+from chain import chain_arrays
+
+RANK_KEYS = ('kelly', 'ev')
+
+def _pairs(strikes):
+    """Lower/upper strike matrices and the K1 < K2 mask for every strike pair"""
+    k1 = strikes[:, None]
+    k2 = strikes[None, :]
+    return k1, k2, k1 < k2
+
+def _metrics(max_profit, max_loss, prob):
+    """Risk reward, Kelly fraction and expected value for a binary payout model.
+    max_loss is negative"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        risk_reward = max_profit / np.abs(max_loss)
+        kelly = (prob * risk_reward + prob - 1) / risk_reward
+    ev = prob * max_profit + (1 - prob) * max_loss
+    return risk_reward, kelly, ev
+
+def _top_k(cand: dict, mask, rank_by: str, top_k: int):
+    """Picks the top_k valid entries of the candidate matrices, best first"""
+    score = np.where(mask & np.isfinite(cand[rank_by]), cand[rank_by], -np.inf)
+    flat = score.ravel()
+
+    k = min(top_k, int(np.isfinite(flat).sum()))
+    if k == 0:
+        return []
+
+    idx = np.argpartition(-flat, k - 1)[:k]
+    idx = idx[np.argsort(-flat[idx])]
+
+    return [{key: (val.ravel()[i].item() if isinstance(val, np.ndarray) else val) for key, val in cand.items()}
+            for i in idx]
+
+def collar_scanner(put_options, call_options, price, prob: float = 0.5,
+                    rank_by: str = 'kelly', top_k: int = 5):
+    """collar_strategy over every (put strike, call strike) pair with put strike < call strike.
+    Returns up to top_k candidates with positive max profit and Kelly, best first"""
+
+    p_strk, put = chain_arrays(put_options, ('bid', 'ask'))
+    c_strk, call = chain_arrays(call_options, ('bid', 'ask'))
+
+    l_strike = p_strk[:, None]
+    h_strike = c_strk[None, :]
+    valid = l_strike < h_strike
+
+    out = []
+    for direction, sell, buy in (('bullish', call['bid'][None, :], put['ask'][:, None]),
+                                 ('bearish', put['bid'][:, None], call['ask'][None, :])):
+
+        payout = (sell - buy) * price                           # convert to price
+        max_profit = payout - np.abs(h_strike - price)
+        max_loss = payout - np.abs(l_strike - price)
+        risk_reward, kelly, ev = _metrics(max_profit, max_loss, prob)
+
+        cand = {
+            'strategy': 'collar',
+            'direction': direction,
+            'put_strike': np.broadcast_to(l_strike, payout.shape),
+            'call_strike': np.broadcast_to(h_strike, payout.shape),
+            'premium_payout': payout,
+            'max_profit': max_profit,
+            'max_loss': max_loss,
+            'risk_reward': risk_reward,
+            'kelly': kelly,
+            'ev': ev
+        }
+        out += _top_k(cand, valid & (max_profit > 0) & (kelly > 0), rank_by, top_k)
+
+    out.sort(key=lambda c: c[rank_by], reverse=True)
+    return out[:top_k]
+
+def vertical_scanner(put_options, call_options, price, rank_by: str = 'kelly', top_k: int = 5):
+    """Bull/bear debit and credit verticals over every strike pair K1 < K2.
+    The win probability is approximated by the mean |delta| of both legs.
+    Premiums and payoffs are in $, returns up to top_k candidates with positive Kelly"""
+
+    out = []
+    for option_type, options in (('call', call_options), ('put', put_options)):
+        strikes, q = chain_arrays(options, ('bid', 'ask', 'delta'))
+        k1, k2, valid = _pairs(strikes)
+        width = k2 - k1
+
+        bid1, ask1, bid2, ask2 = q['bid'][:, None], q['ask'][:, None], q['bid'][None, :], q['ask'][None, :]
+        # probability of finishing beyond the mid strike in the direction of the spread
+        p_up = np.abs(q['delta'][:, None] + q['delta'][None, :]) / 2
+        if option_type == 'put':
+            p_up = 1 - p_up
+
+        if option_type == 'call':
+            spreads = (('bull_call', 'debit', (ask1 - bid2) * price, p_up, 'K1', 'K2'),
+                       ('bear_call', 'credit', (bid1 - ask2) * price, 1 - p_up, 'K2', 'K1'))
+        else:
+            spreads = (('bear_put', 'debit', (ask2 - bid1) * price, 1 - p_up, 'K2', 'K1'),
+                       ('bull_put', 'credit', (bid2 - ask1) * price, p_up, 'K1', 'K2'))
+
+        for name, kind, premium, prob, long_leg, short_leg in spreads:
+            if kind == 'debit':
+                max_profit = width - premium
+                max_loss = -premium
+            else:
+                max_profit = premium
+                max_loss = premium - width
+
+            risk_reward, kelly, ev = _metrics(max_profit, max_loss, prob)
+            legs = {'K1': np.broadcast_to(k1, width.shape), 'K2': np.broadcast_to(k2, width.shape)}
+
+            cand = {
+                'strategy': name,
+                'long_strike': legs[long_leg],
+                'short_strike': legs[short_leg],
+                'premium': premium,
+                'max_profit': max_profit,
+                'max_loss': max_loss,
+                'prob': prob,
+                'risk_reward': risk_reward,
+                'kelly': kelly,
+                'ev': ev
+            }
+            out += _top_k(cand, valid & (premium > 0) & (max_profit > 0) & (kelly > 0), rank_by, top_k)
+
+    out.sort(key=lambda c: c[rank_by], reverse=True)
+    return out[:top_k]
+
+def scan_spreads(put_options, call_options, price, prob: float = 0.5,
+                    rank_by: str = 'kelly', top_k: int = 5):
+    """Best top_k collars and verticals ranked by Kelly or expected value"""
+    if rank_by not in RANK_KEYS:
+        raise ValueError(f'rank_by must be one of {RANK_KEYS}')
+
+    out = collar_scanner(put_options, call_options, price, prob, rank_by, top_k)
+    out += vertical_scanner(put_options, call_options, price, rank_by, top_k)
+    out.sort(key=lambda c: c[rank_by], reverse=True)
+
+    return out[:top_k]
@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+
+from typing import Union, Optional
+
+RECORD = struct.Struct('<II')   # payload length, crc32 of the payload
+
+def read_records(filename: str) -> tuple:
+    """Valid payloads of an append-only state file and the offset where they end,
+    reading stops at the first torn or corrupted record"""
+    records = []
+    if not os.path.exists(filename):
+        return records, 0
+
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    pos = 0
+    while pos + RECORD.size <= len(data):
+        length, crc = RECORD.unpack_from(data, pos)
+        payload = data[pos + RECORD.size:pos + RECORD.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        records.append(payload)
+        pos += RECORD.size + length
+
+    return records, pos
+
+class StateStore:
+    """Crash-safe snapshots of the exchange trading state in an append-only file of
+    checksummed JSON records. Every save appends the full state (a few kB) when it
+    changed, the file is compacted to the last record past max_size"""
+
+    def __init__(self, path: str = 'state/bot_state.log', max_size: int = 1 << 20, interval: float = 5.0,
+                    logger: Union[logging.Logger, str, None] = None):
+        self.path = path
+        self.max_size = max_size
+        self.interval = interval
+        self.last_payload = b''
+        self.last_save = 0.0
+
+        self.logger = (logging.getLogger(logger) if isinstance(logger,str) else logger)
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        # drop a record torn by a crash, appends would land behind it otherwise
+        _, end = read_records(path)
+        if os.path.exists(path) and os.path.getsize(path) > end:
+            self.logger.info(f'Truncating {os.path.getsize(path) - end} bytes of torn state records')
+            os.truncate(path, end)
+
+    @staticmethod
+    def state_of(exchange) -> dict:
+        return {
+            'odate': exchange.odate,
+            'traded_prems': exchange.traded_prems,
+            'max_traded_prem': exchange.max_traded_prem,
+            'trigger_orders': {str(k): v for k, v in exchange.trigger_orders.items()},
+            'orders': exchange.orders,
+            'positions': exchange.positions
+        }
+
+    def save(self, exchange, sync: bool = True) -> bool:
+        """Appends the state when it changed since the last save, fsynced when sync"""
+        state = self.state_of(exchange)
+        payload = json.dumps(state, sort_keys=True).encode()
+        self.last_save = time.monotonic()
+        if payload == self.last_payload:
+            return False
+
+        stamped = json.dumps({**state, 'saved_at': round(time.time(), 3)}, sort_keys=True).encode()
+        record = RECORD.pack(len(stamped), zlib.crc32(stamped)) + stamped
+
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(record) > self.max_size:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        else:
+            with open(self.path, 'ab') as f:
+                f.write(record)
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+
+        self.last_payload = payload
+        return True
+
+    def maybe_save(self, exchange):
+        """Periodic save, catches changes made outside the on-change hooks"""
+        if time.monotonic() - self.last_save >= self.interval:
+            self.save(exchange, sync=False)
+
+    def load(self) -> Optional[dict]:
+        records, _ = read_records(self.path)
+        return json.loads(records[-1]) if records else None
+
+    def restore(self, exchange) -> bool:
+        """Loads the last snapshot into exchange when it is for the same expiry.
+        exchange.restored marks it as not yet reconciled with the account"""
+        start = time.perf_counter()
+        state = self.load()
+        if state is None or state['odate'] != exchange.odate:
+            return False
+
+        exchange.traded_prems = state['traded_prems']
+        exchange.max_traded_prem = state['max_traded_prem']
+        exchange.trigger_orders = {float(k): v for k, v in state['trigger_orders'].items()}
+        exchange.orders = state['orders']
+        exchange.positions = state['positions']
+        exchange.restored = True    # until the account is reconciled, pos_updated stays unset
+
+        self.logger.info(f'State of {state["odate"]} saved at {state["saved_at"]} restored in '
+                            f'{(time.perf_counter() - start) * 1000:.2f} ms: {len(exchange.orders)} orders, '
+                            f'{len(exchange.traded_prems)} traded premiums')
+        return True
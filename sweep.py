@@ -0,0 +1,196 @@
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import os
+import random
+import numpy as np
+import pandas as pd
+import yaml
+
+from recorder import chunk_dirs, read_stream
+
+SWEEP_KEYS = ('min_prem', 'mid_prem', 'strike_dist', 'dvol_min', 'dvol_mid', 'max_prem_cnt', 'expire_time')
+
+_worker = None
+
+def param_grid(grid: dict) -> list:
+    """Every combination of {name: [values]}"""
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+def random_search(space: dict, n: int, seed: int = 0) -> list:
+    """n random draws of {name: [values] or (low, high)}, ints stay ints"""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        params = {}
+        for name, dom in sorted(space.items()):
+            if isinstance(dom, tuple):
+                low, high = dom
+                params[name] = rng.randint(low, high) if isinstance(low, int) and isinstance(high, int) else rng.uniform(low, high)
+            else:
+                params[name] = rng.choice(dom)
+        out.append(params)
+    return out
+
+def params_key(params: dict) -> str:
+    return json.dumps(params, sort_keys=True)
+
+def config_key(**config) -> str:
+    """Short hash of everything besides the swept parameters that a result depends on"""
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def source_files(path: str, stream: str, key: str) -> list:
+    """[name, size, mtime_ns] of every file of the recorded chunks of a stream/key"""
+    files = []
+    for chunk in chunk_dirs(path, stream, key):
+        for name in sorted(os.listdir(chunk)):
+            st = os.stat(os.path.join(chunk, name))
+            files.append([os.path.join(os.path.basename(chunk), name), st.st_size, st.st_mtime_ns])
+    return files
+
+def consolidate(path: str, odates: list, cache: str, currency: str = 'BTC') -> str:
+    """Writes each recorded stream as one contiguous .npy per column so that workers can
+    memory-map them instead of concatenating hourly chunks in every process.
+    source.json, written last, lists the chunk files the cache was built from; the
+    stream is rebuilt when they changed or the previous build was cut off"""
+    for odate in odates:
+        for stream, key in (('chain', odate), ('index', currency), ('dvol', currency)):
+            out = os.path.join(cache, odate, stream)
+            source = os.path.join(out, 'source.json')
+            files = source_files(path, stream, key)
+            if os.path.exists(source):
+                with open(source) as f:
+                    if json.load(f) == files:
+                        continue
+                os.remove(source)
+
+            os.makedirs(out, exist_ok=True)
+            for name, col in read_stream(path, stream, key).items():
+                np.save(os.path.join(out, f'{name}.npy'), np.ascontiguousarray(col))
+            with open(source, 'w') as f:
+                json.dump(files, f)
+    return cache
+
+def load_cache(cache: str, odates: list) -> dict:
+    """Memory-maps the consolidated streams, the page cache is shared by all workers"""
+    data = {}
+    for odate in odates:
+        data[odate] = {}
+        for stream in ('chain', 'index', 'dvol'):
+            folder = os.path.join(cache, odate, stream)
+            data[odate][stream] = {f[:-4]: np.load(os.path.join(folder, f), mmap_mode='r')
+                                    for f in os.listdir(folder) if f.endswith('.npy')}
+    return data
+
+def _init_worker(cache: str, odates: list, strategy: str, exchange_conf: dict, interval: float, fill: dict):
+    global _worker
+    import risk_free_strategy
+    from backtest import Backtester, FillModel
+
+    data = load_cache(cache, odates)
+    _worker = {
+        'odates': odates,
+        'conf': exchange_conf,
+        'make': lambda conf: Backtester(cache, getattr(risk_free_strategy, strategy), conf, interval,
+                                        FillModel(**fill), data=data)
+    }
+
+def _run_one(params: dict) -> dict:
+    conf = {**_worker['conf'], **params}
+    res = _worker['make'](conf).run_days(_worker['odates'])
+
+    days = res['days']
+    trades = res['trades']
+    return {
+        **params,
+        'pnl': res['pnl'],
+        'worst_day': float(days['pnl'].min()) if len(days) else 0.0,
+        'win_days': int((days['pnl'] > 0).sum()) if len(days) else 0,
+        'trades': int((trades['direction'] == 'sell').sum()) if len(trades) else 0
+    }
+
+def run_sweep(path: str, odates: list, candidates: list, exchange_conf: dict, out: str = 'sweep_results.jsonl',
+                strategy: str = 'sell_008_premium_2k_dist', interval: float = 5.0, fill: dict = {},
+                workers: int = None, cache: str = None) -> pd.DataFrame:
+    """Backtests every candidate parameter set over odates in a process pool. Finished runs are
+    appended to out as JSON lines tagged with the run config (odates, strategy, interval,
+    fill, exchange_conf); rerunning with the same out skips the ones of the same config (resume).
+    Returns all results of this config ranked by pnl"""
+
+    cache = consolidate(path, odates, cache or os.path.join(path, '.sweep_cache'))
+    config = config_key(odates=list(odates), strategy=strategy, interval=interval, fill=fill,
+                        exchange_conf=exchange_conf)
+
+    done = {}
+    if os.path.exists(out):
+        with open(out) as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue    # line cut by an interrupted run
+                if row.get('config') == config:
+                    done[params_key({k: row[k] for k in row['params']})] = row
+
+    todo = [p for p in candidates if params_key(p) not in done]
+    print(f'{len(candidates)} candidates, {len(done)} already done, {len(todo)} to run')
+
+    with open(out, 'a') as f, concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(cache, odates, strategy, exchange_conf, interval, fill)) as pool:
+
+        futures = {pool.submit(_run_one, p): p for p in todo}
+        for fut in concurrent.futures.as_completed(futures):
+            params = futures[fut]
+            try:
+                row = fut.result()
+            except Exception as E:
+                print(f'Error in {params}: {E}')
+                continue
+
+            row['params'] = sorted(params)
+            row['config'] = config
+            f.write(json.dumps(row) + '\n')
+            f.flush()
+            done[params_key(params)] = row
+
+    table = pd.DataFrame([{k: v for k, v in r.items() if k not in ('params', 'config')} for r in done.values()])
+    if table.empty:
+        return table
+    return table.sort_values('pnl', ascending=False).reset_index(drop=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Parameter sweep of the exchange thresholds on recorded ticks')
+    parser.add_argument('odates', nargs='+')
+    parser.add_argument('--path', default='ticks')
+    parser.add_argument('--config', default='./config_v3.yaml')
+    parser.add_argument('--set', nargs='*', default=[], metavar='NAME=V1,V2',
+                        help=f'grid values for any of {", ".join(SWEEP_KEYS)}')
+    parser.add_argument('--random', type=int, default=0, help='random draws from the --set values instead of the full grid')
+    parser.add_argument('--strategy', default='sell_008_premium_2k_dist')
+    parser.add_argument('--interval', type=float, default=5.0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default='sweep_results.jsonl')
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = yaml.load(f.read(), Loader = yaml.FullLoader)
+
+    space = {}
+    for item in args.set:
+        name, values = item.split('=')
+        if name not in SWEEP_KEYS:
+            parser.error(f'{name} is not one of {SWEEP_KEYS}')
+        space[name] = [yaml.safe_load(v) for v in values.split(',')]
+
+    candidates = random_search(space, args.random) if args.random else param_grid(space)
+    table = run_sweep(args.path, args.odates, candidates, config['exchange'], args.out,
+                        args.strategy, args.interval, workers=args.workers)
+    print(table.head(args.top).to_string())
+
+if __name__ == '__main__':
+    main()
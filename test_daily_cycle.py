@@ -0,0 +1,60 @@
+import asyncio
+
+from Bot_V3 import CBot
+from clock import SimClock
+from exchange import Deribit_Exchange
+from mock_deribit import MockDeribit
+from runtime import connect
+
+async def daily_cycle(clock: SimClock, until: str) -> tuple:
+    """Runs CBot against MockDeribit on clock until the UTC time until ('HH:MM'), a short put
+    and a perpetual hedge with a stop are opened once the bot has read the account"""
+    mock = MockDeribit(strikes=11, tick_interval=30.0, clock=clock)
+    ready = asyncio.get_running_loop().create_future()
+    server = asyncio.create_task(mock.serve(port=0, ready=ready))
+    url = f'ws://127.0.0.1:{await ready}'
+
+    exchange = Deribit_Exchange(url={'mock': url}, auth={'mock': {'grant_type': 'client_credentials'}}, env='mock',
+                                currency='BTC', trading=True, daydelta=1, expire_time=6, clock=clock)
+    bot = CBot(exchange, None, {'test': None, 'trading': None}, validate_quotes=False, roll_warmup=60.0)
+    bot.runtime.gc_freeze = False
+    start = asyncio.create_task(bot.start())
+
+    while not exchange.pos_updated:
+        await asyncio.sleep(0.01)
+
+    put = exchange.put_options[sorted(exchange.put_options)[5]]['instrument_name']
+    async with connect(url) as ws:
+        await exchange.auth(ws)
+        await exchange.create_order(ws, 'sell', {'instrument_name': put, 'type': 'limit', 'price': 0.0001, 'amount': 0.1})
+        await exchange.create_order(ws, 'buy', {'instrument_name': 'BTC-PERPETUAL', 'type': 'market', 'amount': 10})
+        await exchange.create_order(ws, 'sell', {'instrument_name': 'BTC-PERPETUAL', 'type': 'stop_market',
+                                                    'trigger': 'mark_price', 'trigger_price': 1.0, 'amount': 10})
+
+    hour, minute = map(int, until.split(':'))
+    while clock.now().hour * 60 + clock.now().minute < hour * 60 + minute:
+        assert not start.done(), start.exception()
+        await asyncio.sleep(0.05)
+
+    exchange.keep_alive = False
+    await asyncio.wait_for(start, 10)
+    server.cancel()
+    return bot, mock, put
+
+def test_roll_activate_retire():
+    clock = SimClock('2022-10-20 05:50', speed=600)
+    bot, mock, put = asyncio.run(daily_cycle(clock, '08:03'))
+    exchange = bot.exchange
+
+    # rolled to the next expiry, the settled one is gone with its listeners and positions
+    assert exchange.odate == '21OCT22'
+    assert set(exchange.chains) == {'21OCT22'}
+    assert '20OCT22' not in bot.listeners
+    assert not exchange.has_orders('20OCT22') and put not in exchange.positions
+
+    # the position opened after startup was found, so the stop was cancelled and the hedge closed before settlement
+    assert all(o['order_state'] != 'untriggered' for o in mock.orders.values())
+    assert 'BTC-PERPETUAL' not in mock.positions
+    closed = [o for o in mock.orders.values() if o['instrument_name'] == 'BTC-PERPETUAL' and o['direction'] == 'sell'
+                and o['order_type'] == 'market']
+    assert closed and closed[0]['creation_timestamp'] < 1666252800000     # 20OCT22 08:00 UTC
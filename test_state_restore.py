@@ -0,0 +1,73 @@
+import asyncio
+
+from Bot_V3 import CBot
+from clock import SimClock
+from exchange import Deribit_Exchange
+from mock_deribit import MockDeribit
+from state_store import StateStore
+
+PHANTOM = 'BTC-20OCT22-15000-P'
+
+async def restore_then_reconcile(path: str, failures: int) -> tuple:
+    """Starts CBot on a state snapshot with a position closed while the bot was down, the
+    first failures reconciles of the account fail like a network error"""
+    clock = SimClock('2022-10-20 05:00', speed=600)
+    mock = MockDeribit(strikes=11, tick_interval=30.0, clock=clock)
+    ready = asyncio.get_running_loop().create_future()
+    server = asyncio.create_task(mock.serve(port=0, ready=ready))
+    url = f'ws://127.0.0.1:{await ready}'
+
+    store = StateStore(path)
+    exchange = Deribit_Exchange(url={'mock': url}, auth={'mock': {'grant_type': 'client_credentials'}}, env='mock',
+                                currency='BTC', trading=True, daydelta=1, expire_time=6, clock=clock, state_store=store)
+    exchange.odate = '20OCT22'
+    exchange.orders = {PHANTOM: {'instrument_name': PHANTOM}}
+    exchange.positions = {PHANTOM: -0.1}
+    store.save(exchange)
+    exchange.init_vals()
+
+    fetch = exchange.fetch_account_info
+    calls = []
+
+    async def flaky_fetch():
+        calls.append(clock.now())
+        if len(calls) <= failures:
+            raise ConnectionResetError('connection reset')
+        await fetch()
+
+    exchange.fetch_account_info = flaky_fetch
+    bot = CBot(exchange, None, {'test': None, 'trading': None}, validate_quotes=False)
+    bot.runtime.gc_freeze = False
+    start = asyncio.create_task(bot.start())
+
+    while exchange.restored or not exchange.pos_updated:
+        assert not start.done(), start.exception()
+        await asyncio.sleep(0.01)
+
+    exchange.keep_alive = False
+    await asyncio.wait_for(start, 10)
+    server.cancel()
+    return exchange, calls
+
+def test_failed_reconcile_is_retried(tmp_path):
+    exchange, calls = asyncio.run(restore_then_reconcile(str(tmp_path / 'state.log'), failures=2))
+
+    # the reconcile is supervised: retried after the failures instead of restarting the session
+    assert len(calls) >= 3
+    assert exchange.keep_alive is False and not exchange.restored
+    assert exchange.avail_funds > 0
+    assert PHANTOM not in exchange.positions and PHANTOM not in exchange.orders
+
+def test_restore_does_not_mark_account_fetched(tmp_path):
+    path = str(tmp_path / 'state.log')
+    store = StateStore(path)
+    exchange = Deribit_Exchange(url={'test': ''}, auth={'test': {}}, currency='BTC')
+    exchange.odate = '20OCT22'
+    exchange.positions = {PHANTOM: -0.1}
+    store.save(exchange)
+
+    exchange.init_vals()
+    exchange.odate = '20OCT22'
+    assert store.restore(exchange)
+    assert exchange.restored and not exchange.pos_updated
+    assert exchange.positions == {PHANTOM: -0.1}